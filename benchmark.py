@@ -0,0 +1,408 @@
+"""
+Benchmarks every effect in Image Studio on synthetic images of different sizes.
+
+Examples:
+    # Run every benchmark with the default sizes and save the results
+    python3 benchmark.py run --output bench.json
+
+    # Only benchmark a few effects on bigger images
+    python3 benchmark.py run --effects blur,sobel --sizes 16,50,100 --output bench.json
+
+    # Only measure how long main.py takes to start up and process a tiny image
+    python3 benchmark.py run --effects startup:help,startup:brightness --output bench.json
+
+    # Compare against an older run. Exits with code 1 if anything got slower (or used more memory) than the threshold.
+    python3 benchmark.py compare baseline.json bench.json --threshold 10
+
+    # Check every backend against the Numpy reference, then find the fastest backend of each operation on this machine
+    python3 benchmark.py verify
+    python3 benchmark.py autotune
+"""
+
+from argparse import ArgumentParser
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import include.effects.dithering.error_diffusion as error_diffusion
+import include.effects.dithering.ordered_dither as ordered_dither
+import include.effects.color.colormapping as colormapping
+import include.effects.edge_detection.prewitt as prewitt
+import include.effects.edge_detection.canny as canny
+import include.effects.edge_detection.sobel as sobel
+import include.effects.color.brightness as brightness
+import include.effects.color.contrast as contrast
+import include.effects.color.quantize as quantize
+import include.effects.blur.denoise as denoise
+import include.effects.blur.sharpen as sharpen
+import include.effects.morphology.morphology as morphology
+import include.effects.blur.blur as blur
+
+import include.utils.backends as backends
+import include.utils.buffers as buffers
+import include.utils.colormodel as colormodel
+import include.utils.convolve2d as convolve2d
+import include.utils.kernels as kernels
+import include.utils.metrics as metrics
+import include.utils.parser as parser
+import include.utils.profiling as profiling
+import include.utils.synthetic as synthetic
+
+import main
+
+
+# The number of colors used by the quantization and dithering benchmarks
+nColors         = 8
+availableColors = np.linspace(0, 255, nColors, dtype=np.uint8)
+
+
+def rgbToHSVLUT(img):
+    hsvImg   = colormodel.rgb2hsv(quantize.quantize(img, availableColors))
+    colorLUT = colormapping.generatePalette(200, np.unique(hsvImg[..., 0]), 20, False)
+
+    return hsvImg, colorLUT
+
+
+def grayscaleToHSVLUT(img):
+    hsvImg   = colormodel.rgb2hsv(np.repeat(quantize.quantize(img, availableColors), repeats=3, axis=2))
+    colorLUT = colormapping.generatePalette(200, availableColors, 20, False)
+
+    return hsvImg, colorLUT
+
+
+# The "pipeline" benchmark runs main.process() with these options. Every run uses the same ScratchArena, like a script that
+# processes lots of images in the same process, so its peak memory only counts what the arena doesn't already have.
+pipelineOptions = ["-c", "5", "-br", "30", "-q", str(nColors), "-d", "ordered"]
+pipelineArena   = buffers.ScratchArena()
+
+
+def pipelineArguments(img):
+    args = parser.make_parser().parse_args(["--image", "synthetic.png"] + pipelineOptions)
+
+    return img, args, profiling.Profiler(enabled=False), {}, pipelineArena
+
+
+# Every benchmark is a tuple of (modes, setup, function). setup() prepares the arguments from the synthetic image
+# (that part is not timed), and function() is what actually gets timed.
+benchmarks = {
+    "convolve2d"                  : (["grayscale"],        lambda img: (img[..., 0].astype(np.float32), kernels.gaussianBlur3x3),
+                                                           convolve2d.convolve2d),
+    "blur"                        : (["grayscale", "rgb"], lambda img: (img, "gaussian3x3"),
+                                                           blur.blur),
+    "gaussianBlur"                : (["grayscale", "rgb"], lambda img: (img, 5.0),
+                                                           blur.gaussianBlur),
+    "medianFilter"                : (["grayscale", "rgb"], lambda img: (img, 3),
+                                                           denoise.medianFilter),
+    "bilateralFilter"             : (["grayscale", "rgb"], lambda img: (img, 8.0, 30.0),
+                                                           denoise.bilateralFilter),
+    "unsharpMask"                 : (["grayscale", "rgb"], lambda img: (img, 1.0, 1.5, 4),
+                                                           sharpen.unsharpMask),
+    "sobel"                       : (["grayscale"],        lambda img: (img, -1),
+                                                           sobel.sobel),
+    "prewitt"                     : (["grayscale"],        lambda img: (img, -1),
+                                                           prewitt.prewitt),
+    "canny"                       : (["grayscale"],        lambda img: (img, 0.1, 0.2, 1.4),
+                                                           canny.cannyEdges),
+    "morphology"                  : (["grayscale", "rgb"], lambda img: (img, "close", (7, 7)),
+                                                           morphology.morphology),
+    "quantize"                    : (["grayscale", "rgb"], lambda img: (img, availableColors),
+                                                           quantize.quantize),
+    "orderedDithering"            : (["grayscale", "rgb"], lambda img: (img, 2, availableColors),
+                                                           ordered_dither.orderedDithering),
+    "floydSteinberg"              : (["grayscale", "rgb"], lambda img: (img, availableColors),
+                                                           error_diffusion.floydSteinberg),
+    "rgb2hsv"                     : (["rgb"],              lambda img: (img,),
+                                                           colormodel.rgb2hsv),
+    "hsv2rgb"                     : (["rgb"],              lambda img: (colormodel.rgb2hsv(img),),
+                                                           colormodel.hsv2rgb),
+    "rgb2lab"                     : (["rgb"],              lambda img: (img,),
+                                                           colormodel.rgb2lab),
+    "rgb2ycbcr"                   : (["rgb"],              lambda img: (img,),
+                                                           colormodel.rgb2ycbcr),
+    "quantizeLab"                 : (["grayscale", "rgb"], lambda img: (img, availableColors),
+                                                           quantize.quantizeLab),
+    "psnr"                        : (["grayscale", "rgb"], lambda img: (img, quantize.quantize(img, availableColors)),
+                                                           metrics.psnr),
+    "ssim"                        : (["grayscale", "rgb"], lambda img: (img, quantize.quantize(img, availableColors)),
+                                                           metrics.ssim),
+    "changeColorPaletteGrayscale" : (["grayscale"],        grayscaleToHSVLUT,
+                                                           colormapping.changeColorPaletteGrayscale),
+    "changeColorPaletteRGB"       : (["rgb"],              rgbToHSVLUT,
+                                                           colormapping.changeColorPaletteRGB),
+    "contrast_boost"              : (["grayscale", "rgb"], lambda img: (img, 5),
+                                                           contrast.contrast_boost),
+    "brightness_boost"            : (["grayscale", "rgb"], lambda img: (img, 30),
+                                                           brightness.brightness_boost),
+    "pipeline"                    : (["grayscale", "rgb"], pipelineArguments,
+                                                           main.process),
+}
+
+
+# Command lines of main.py whose start up time is measured. Each one runs in a new process on a tiny image, so the time is
+# dominated by starting Python and importing the effects, which is what matters when processing lots of small images from a script.
+startupCommands = {
+    "startup:help"      : ["--help"],
+    "startup:brightness": ["-br", "30"],
+    "startup:dithering" : ["-q", "4", "-d", "floyd-steinberg"],
+    "startup:canny"     : ["-g", "-e", "canny"],
+}
+
+# The size of the image used by the start up benchmarks, in megapixels
+startupMegapixels = 0.01
+
+
+def timeStartup(arguments: list, repeat: int):
+    """Times a run of main.py in a new process. Returns the best time out of `repeat` runs and the peak RSS of the process.
+    Unlike timeEffect(), the memory is the whole resident memory of the process (Python itself, the modules and the image).
+    """
+    bestTime   = float("inf")
+    peakMemory = 0
+    for _ in range(repeat):
+        start   = time.perf_counter()
+        process = subprocess.Popen([sys.executable, "main.py"] + arguments, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                   cwd=os.path.dirname(os.path.abspath(__file__)))
+
+        # os.wait4() also gives the resource usage of that specific process
+        _, status, usage = os.wait4(process.pid, 0)
+        bestTime = min(bestTime, time.perf_counter() - start)
+
+        process.returncode = os.waitstatus_to_exitcode(status)
+        if process.returncode != 0:
+            raise RuntimeError(f"main.py {' '.join(arguments)} failed with exit code {process.returncode}")
+
+        # ru_maxrss is in KiB on Linux, but in bytes on macOS
+        peakMemory = max(peakMemory, usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss * 1024)
+
+    return bestTime, peakMemory
+
+
+def runStartup(effects: list, repeat: int) -> list:
+    """Runs the start up benchmarks in `effects` and returns their results.
+    """
+    import include.utils.imageio as imageio
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        inputPath  = os.path.join(directory, "input.png")
+        outputPath = os.path.join(directory, "output.png")
+        imageio.saveImage(synthetic.makeImage(startupMegapixels, 3), inputPath, 6, False)
+
+        for effect in effects:
+            arguments = startupCommands[effect]
+            if arguments != ["--help"]:
+                arguments = ["-i", inputPath, "-o", outputPath] + arguments
+
+            seconds, peakMemory = timeStartup(arguments, repeat)
+
+            result = {
+                "effect"     : effect,
+                "mode"       : "rgb",
+                "megapixels" : startupMegapixels,
+                "seconds"    : seconds,
+                "mpPerSecond": startupMegapixels / seconds,
+                "peakMemory" : peakMemory,
+            }
+            results.append(result)
+
+            print(f"{effect:<30} {'rgb':<10} {seconds * 1000:>10.1f} ms {peakMemory / 2**20:>18.1f} MiB")
+
+    return results
+
+
+def timeEffect(function, setup, img, repeat: int):
+    """Times an effect. Returns the best time out of `repeat` runs (after an untimed warm-up run) and the peak memory of an extra run done with tracemalloc.
+    The memory is measured in a separate run because tracing the allocations slows the code down.
+    """
+    # An untimed run first, so the lazily built lookup tables, the compiled kernels and the first touch of the
+    # memory aren't counted in the first timed run
+    function(*setup(img))
+
+    bestTime = float("inf")
+    for _ in range(repeat):
+        # Some effects (changeColorPaletteRGB) modify their input, so every run gets fresh arguments
+        arguments = setup(img)
+
+        start = time.perf_counter()
+        function(*arguments)
+        bestTime = min(bestTime, time.perf_counter() - start)
+
+    arguments = setup(img)
+    profiler  = profiling.Profiler(traceMemory=True)
+    with profiler.stage("memory"):
+        function(*arguments)
+
+    return bestTime, profiler.records[0]["peakMemory"]
+
+
+def machineInfo() -> dict:
+    return {
+        "platform" : platform.platform(),
+        "processor": platform.processor(),
+        "cpuCount" : os.cpu_count(),
+        "python"   : platform.python_version(),
+        "numpy"    : np.__version__,
+    }
+
+
+def run(args):
+    effects = args.effects.split(",") if args.effects is not None else list(benchmarks.keys()) + list(startupCommands.keys())
+    sizes   = [float(size) for size in args.sizes.split(",")]
+
+    for effect in effects:
+        if effect not in benchmarks and effect not in startupCommands:
+            raise ValueError(f"Unknown effect '{effect}'. Choose from: {', '.join(list(benchmarks.keys()) + list(startupCommands.keys()))}")
+
+    results = runStartup([effect for effect in effects if effect in startupCommands], args.repeat)
+    effects = [effect for effect in effects if effect in benchmarks]
+
+    for megapixels in sizes:
+        for mode, nChannels in [("grayscale", 1), ("rgb", 3)]:
+            img = synthetic.makeImage(megapixels, nChannels)
+
+            for effect in effects:
+                modes, setup, function = benchmarks[effect]
+                if mode not in modes:
+                    continue
+
+                seconds, peakMemory = timeEffect(function, setup, img, args.repeat)
+
+                result = {
+                    "effect"     : effect,
+                    "mode"       : mode,
+                    "megapixels" : megapixels,
+                    "seconds"    : seconds,
+                    "mpPerSecond": img.shape[0] * img.shape[1] / 1e6 / seconds,
+                    "peakMemory" : peakMemory,
+                }
+                results.append(result)
+
+                print(f"{effect:<30} {mode:<10} {megapixels:>7.2f} MP {result['mpPerSecond']:>10.2f} MP/s {peakMemory / 2**20:>10.1f} MiB")
+
+            del img
+
+    report = {"machine": machineInfo(), "results": results}
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
+
+    return report
+
+
+def compare(args) -> int:
+    """Compares two benchmark runs. Returns the number of regressions.
+    """
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+
+    # Match the results of both runs by effect, mode and size
+    def key(result):
+        return (result["effect"], result["mode"], result["megapixels"])
+
+    baselineResults = {key(result): result for result in baseline["results"]}
+    threshold       = args.threshold / 100
+
+    regressions = 0
+    for result in current["results"]:
+        if key(result) not in baselineResults:
+            continue
+
+        old = baselineResults[key(result)]
+
+        speedChange  = result["mpPerSecond"] / old["mpPerSecond"] - 1
+        memoryChange = result["peakMemory"]  / max(old["peakMemory"], 1) - 1
+
+        flags = []
+        if speedChange < -threshold:
+            flags.append("SLOWER")
+        if memoryChange > threshold:
+            flags.append("MORE MEMORY")
+
+        regressions += len(flags) > 0
+
+        print(f"{result['effect']:<30} {result['mode']:<10} {result['megapixels']:>7.2f} MP {speedChange:>+8.1%} speed {memoryChange:>+8.1%} memory  {' '.join(flags)}")
+
+    print(f"\n{regressions} regression(s) found")
+
+    return regressions
+
+
+def verify(args) -> int:
+    """Checks every backend against the Numpy reference. Returns the number of backends that don't match it.
+    """
+    failures = 0
+    for operation in backends.registry:
+        for backendName, result in backends.verify(operation).items():
+            failures += not result["ok"]
+
+            print(f"{operation:<20} {backendName:<10} {result['difference']:>12.6f} {'OK' if result['ok'] else 'MISMATCH'}")
+
+    return failures
+
+
+def autotune(args):
+    operations = args.operations.split(",") if args.operations is not None else None
+    sizes      = [float(size) for size in args.sizes.split(",")]
+
+    choices = backends.autotune(operations, sizes, args.repeat)
+
+    for operation, dtypes in choices.items():
+        for dtype, buckets in dtypes.items():
+            for bucket, backendName in sorted(buckets.items(), key=lambda item: int(item[0])):
+                print(f"{operation:<20} {dtype:<10} ~2^{bucket} pixels: {backendName}")
+
+    print(f"\nSaved in {backends.autotunePath}")
+
+
+def make_parser():
+    parser      = ArgumentParser(description="Benchmarks the effects in Image Studio")
+    subparsers  = parser.add_subparsers(dest="command", required=True)
+
+    runParser = subparsers.add_parser("run", help="Runs the benchmarks.")
+    runParser.add_argument('--sizes', type=str, default="0.25,1,4,16",
+                           help="Comma-separated list of image sizes in megapixels. Default = 0.25,1,4,16. Up to 100 MP works, but needs a lot of RAM.")
+    runParser.add_argument('--effects', type=str, default=None,
+                           help=f"Comma-separated list of effects to benchmark. Default = all of them ({', '.join(list(benchmarks.keys()) + list(startupCommands.keys()))}).")
+    runParser.add_argument('--repeat', type=int, default=3,
+                           help="How many times each benchmark runs. The best time is kept. Default = 3.")
+    runParser.add_argument('--output', '-o', type=str, default=None,
+                           help="Saves the results in this JSON file.")
+
+    compareParser = subparsers.add_parser("compare", help="Compares two benchmark runs and flags the regressions.")
+    compareParser.add_argument('baseline', type=str, help="The JSON file of the baseline run.")
+    compareParser.add_argument('current',  type=str, help="The JSON file of the new run.")
+    compareParser.add_argument('--threshold', type=float, default=10,
+                               help="How much slower (or how much more memory), in percent, counts as a regression. Default = 10.")
+
+    subparsers.add_parser("verify", help="Checks every backend against the Numpy reference implementation.")
+
+    autotuneParser = subparsers.add_parser("autotune", help="Finds the fastest backend for each operation on this machine and saves the choice.")
+    autotuneParser.add_argument('--operations', type=str, default=None,
+                                help=f"Comma-separated list of operations to autotune. Default = all of them ({', '.join(backends.registry.keys())}).")
+    autotuneParser.add_argument('--sizes', type=str, default="0.06,0.25,1,4",
+                                help="Comma-separated list of image sizes in megapixels. Default = 0.06,0.25,1,4.")
+    autotuneParser.add_argument('--repeat', type=int, default=3,
+                                help="How many times each backend runs. The best time is kept. Default = 3.")
+
+    return parser
+
+
+if __name__ == '__main__':
+    args = make_parser().parse_args()
+
+    if args.command == "run":
+        run(args)
+    elif args.command == "compare":
+        sys.exit(1 if compare(args) > 0 else 0)
+    elif args.command == "verify":
+        sys.exit(1 if verify(args) > 0 else 0)
+    elif args.command == "autotune":
+        autotune(args)
@@ -1,5 +1,8 @@
 import numpy as np
 
+import include.effects.blur.denoise as denoise
+import include.utils.backends as backends
+import include.utils.colormodel as colormodel
 import include.utils.convolve2d as convolve2d
 import include.utils.kernels as kernels
 
@@ -11,11 +14,162 @@ blurKernels = {
                 "gaussian5x5": kernels.gaussianBlur5x5
             }
 
+# Below this sigma, the Gaussian kernel is small enough (13 elements or less) that a regular separable convolution is cheap.
+# The recursive filter is also not very accurate with small sigmas.
+recursiveSigmaThreshold = 2.0
+
+# The sigma used by the "gaussian" and "bilateral" filters when none is given
+defaultSigmas = {
+                "gaussian":  1.0,
+                "bilateral": 8.0
+            }
+
+
+def blur(img: np.typing.NDArray, kernelName: str, sigma: float = None, radius: int = 2, sigmaRange: float = 30, linear: bool = False,
+         out: np.typing.NDArray = None) -> np.typing.NDArray:
+    """Blurs the image.
+
+    Args:
+        img (np.typing.NDArray): The image. Must be in the format (H, W, C)
+        kernelName (str)       : One of the kernels in blurKernels, "gaussian" for a Gaussian blur with an arbitrary sigma,
+                                 or one of the edge-preserving filters in denoise.py ("median" or "bilateral").
+        sigma (float)          : The spatial sigma of the "gaussian" (default 1) and "bilateral" (default 8) filters.
+        radius (int)           : The radius of the "median" filter.
+        sigmaRange (float)     : The range sigma of the "bilateral" filter.
+        linear (bool)          : Averages the pixels in linear light instead of sRGB, which avoids dark halos around bright edges.
+                                 The median and bilateral filters don't average colors across edges, so they ignore this.
+        out (np.typing.NDArray): Where to write the result. Must be np.uint8 with the same shape as img, and can't be img itself,
+                                 since every blurred pixel needs the original pixels around it. By default, a new array is created.
+
+    Returns:
+        np.typing.NDArray: The blurred image.
+    """
+    if linear and kernelName not in ("median", "bilateral"):
+        return linearBlur(img, kernelName, sigma, out)
+
+    if kernelName == "gaussian":
+        return gaussianBlur(img, sigma if sigma is not None else defaultSigmas["gaussian"], out)
+
+    if kernelName == "median":
+        return denoise.medianFilter(img, radius, out)
+
+    if kernelName == "bilateral":
+        return denoise.bilateralFilter(img, sigma if sigma is not None else defaultSigmas["bilateral"], sigmaRange, out)
 
-def blur(img: np.typing.NDArray, kernelName: str) -> np.typing.NDArray:
     kernel = blurKernels[kernelName]
 
-    img    = np.stack([convolve2d.convolve2d(img[..., channel], kernel) for channel in range(img.shape[-1])], axis=2)
-    img    = img.astype(np.uint8)
+    if out is None:
+        out = np.empty(img.shape, dtype=np.uint8)
+
+    # Each channel is cast to np.uint8 straight into its place in the result
+    for channel in range(img.shape[-1]):
+        out[..., channel] = convolve2d.convolve2d(img[..., channel], kernel)
+
+    return out
+
+
+def linearBlur(img: np.typing.NDArray, kernelName: str, sigma: float = None, out: np.typing.NDArray = None) -> np.typing.NDArray:
+    """Same as blur(), but the image is converted to linear light before blurring and back to sRGB afterwards.
+    Only works with the kernels in blurKernels and with "gaussian".
+    """
+    img = colormodel.srgbToLinear(img)
+
+    if kernelName == "gaussian":
+        img = gaussianFilter(img, sigma if sigma is not None else defaultSigmas["gaussian"])
+    else:
+        kernel = blurKernels[kernelName]
+        img    = np.stack([convolve2d.convolve2d(img[..., channel], kernel) for channel in range(img.shape[-1])], axis=2)
+
+    return colormodel.linearToSrgb(img, out)
+
+
+def gaussianBlur(img: np.typing.NDArray, sigma: float, out: np.typing.NDArray = None) -> np.typing.NDArray:
+    """Gaussian blur (https://en.wikipedia.org/wiki/Gaussian_blur) with an arbitrary sigma.
+
+    Small sigmas use a separable convolution with a generated kernel. Larger sigmas use a recursive filter
+    (see recursive_gaussian.pyx), whose cost per pixel is the same no matter how large sigma is.
+
+    Args:
+        img (np.typing.NDArray): The image. Must be in the format (H, W, C)
+        sigma (float)          : The standard deviation of the Gaussian, in pixels.
+        out (np.typing.NDArray): Where to write the result. Must be np.uint8 with the same shape as img. By default, a new array is created.
+
+    Returns:
+        np.typing.NDArray: The blurred image.
+    """
+    img = gaussianFilter(img, sigma)
+
+    # The np.float32 result is rounded in place, so the only other full size array is 'out'
+    np.round(img, out=img)
+    np.clip(img, 0, 255, out=img)
+
+    if out is None:
+        return img.astype(np.uint8)
+
+    out[...] = img
+
+    return out
+
+
+def equivalentSigma(kernelName: str) -> float:
+    """The standard deviation of one of the kernels in blurKernels, along the rows (they are all symmetric). A Gaussian blur
+    with this sigma blurs by the same amount, which is how --preview shrinks the fixed size kernels.
+    """
+    weights = blurKernels[kernelName].sum(axis=0) / blurKernels[kernelName].sum()
+    x       = np.arange(len(weights)) - len(weights) // 2
+
+    return float(np.sqrt(np.sum(weights * x ** 2)))
+
+
+def gaussianFilter(img: np.typing.NDArray, sigma: float) -> np.typing.NDArray:
+    """Same as gaussianBlur(), but returns the np.float32 result without rounding it back to np.uint8.
+    This is useful when the blur is only the first step of something else, like Canny edge detection.
+    """
+    if sigma < recursiveSigmaThreshold:
+        kernel = kernels.gaussianKernel1d(float(sigma))
+        return np.stack([convolve2d.convolveSeparable(img[..., channel], kernel, "edge") for channel in range(img.shape[-1])], axis=2)
+
+    return backends.dispatch("recursiveGaussian", img.astype(np.float32), float(sigma))
+
+
+def recursiveGaussianNumpy(img: np.typing.NDArray, sigma: float) -> np.typing.NDArray:
+    """
+    The reference implementation of the recursive Gaussian filter in recursive_gaussian.pyx.
+    Every line is still filtered sequentially, but all the rows (or all the columns) are filtered at the same time.
+
+    Args:
+        img (np.typing.NDArray): The image. Must be np.float32 in the format (H, W, C).
+        sigma (float)          : The standard deviation of the Gaussian. Should be at least 0.5.
+
+    Returns:
+        np.typing.NDArray (np.float32): The blurred image.
+    """
+    B, b1, b2, b3 = kernels.youngVanVlietCoefficients(sigma)
+
+    out = img.astype(np.float32)
+
+    def filterLines(lines):
+        # lines is a view with the filtering direction in the first axis, so lines[idx] are the idx-th pixels of every line.
+        # Forward pass
+        w1 = lines[0].astype(np.float64)
+        w2 = w1
+        w3 = w1
+        for idx in range(lines.shape[0]):
+            current = B * lines[idx] + b1 * w1 + b2 * w2 + b3 * w3
+            lines[idx] = current
+            w1, w2, w3 = current, w1, w2
+
+        # Backward pass
+        w1 = lines[-1].astype(np.float64)
+        w2 = w1
+        w3 = w1
+        for idx in range(lines.shape[0] - 1, -1, -1):
+            current = B * lines[idx] + b1 * w1 + b2 * w2 + b3 * w3
+            lines[idx] = current
+            w1, w2, w3 = current, w1, w2
+
+    # Filter the rows (the direction is the columns) and then the columns (the direction is the rows)
+    filterLines(out.transpose(1, 0, 2))
+    filterLines(out)
 
-    return img
\ No newline at end of file
+    return out
@@ -0,0 +1,156 @@
+"""
+Denoise.py has edge-preserving filters. Unlike the blurs in blur.py, these remove noise without smearing the edges,
+which is what the edge detection algorithms look for.
+"""
+
+import numpy as np
+
+import include.utils.backends as backends
+import include.utils.buffers as buffers
+
+
+def medianFilter(img: np.typing.NDArray, radius: int, out: np.typing.NDArray = None) -> np.typing.NDArray:
+    """
+    Median filter (https://en.wikipedia.org/wiki/Median_filter) with a square (2 * radius + 1) x (2 * radius + 1) window.
+    The backend that does the actual work is chosen by backends.dispatch(). Normally that's the constant-time
+    Cython implementation in median.pyx.
+
+    Args:
+        img (np.typing.NDArray): The image. Must be np.uint8 in the format (H, W, C).
+        radius (int)           : The radius of the window.
+        out (np.typing.NDArray): Where to write the result. Must be np.uint8 with the same shape as img, and can't be img itself.
+                                 By default, a new array is created.
+
+    Returns:
+        np.typing.NDArray (np.uint8): The filtered image.
+    """
+    return backends.dispatch("medianFilter", img, radius, out)
+
+
+def medianFilterNumpy(img: np.typing.NDArray, radius: int, out: np.typing.NDArray = None) -> np.typing.NDArray:
+    """
+    The reference implementation of the median filter. It creates a sliding window view of the image and takes the
+    median of each window, which needs (2 * radius + 1)^2 floats per pixel, so it's only usable with small images.
+
+    Args:
+        img (np.typing.NDArray): The image. Must be np.uint8 in the format (H, W, C).
+        radius (int)           : The radius of the window.
+        out (np.typing.NDArray): Where to write the result. Must be np.uint8 with the same shape as img.
+
+    Returns:
+        np.typing.NDArray (np.uint8): The filtered image.
+    """
+    windowSize = 2 * radius + 1
+
+    img     = np.pad(img, ((radius, radius), (radius, radius), (0, 0)), mode="edge")
+    patches = np.lib.stride_tricks.sliding_window_view(img, (windowSize, windowSize), axis=(0, 1))
+
+    return buffers.writeInto(np.median(patches, axis=(-2, -1)).astype(np.uint8), out)
+
+
+def bilateralFilter(img: np.typing.NDArray, sigmaSpatial: float, sigmaRange: float, out: np.typing.NDArray = None) -> np.typing.NDArray:
+    """
+    Bilateral filter (https://en.wikipedia.org/wiki/Bilateral_filter) using a bilateral grid
+    (Chen, Paris and Durand, https://doi.org/10.1145/1276377.1276506).
+
+    A bilateral filter is a Gaussian blur where each neighbour is also weighted by how similar its value is to the center pixel,
+    so pixels on the other side of an edge barely contribute. Doing that directly costs O(radius^2) per pixel. Instead, we think of
+    the image as a 3D space (row, column, value) and:
+
+        1. Splat: Every pixel is added to the nearest cell of a coarse 3D grid.
+        2. Blur : The grid is blurred with a [1, 2, 1] / 4 kernel along each of the 3 axes.
+        3. Slice: The value of each pixel is read back from the grid, with trilinear interpolation.
+
+    Each of the 3 steps spreads a pixel a bit. Measured in cells, the variances are 1/12 (rounding to the nearest cell),
+    1/2 (the kernel) and 1/6 (the interpolation), so 3/4 in total. That's why each cell is 2 / sqrt(3) sigmas wide, in pixels
+    and in values: the whole thing then blurs by about one sigma, like a bilateral filter with the given sigmas.
+
+    The grid is much smaller than the image, so the cost per pixel doesn't depend on the sigmas. Each channel is filtered separately.
+
+    Args:
+        img (np.typing.NDArray): The image. Must be np.uint8 in the format (H, W, C).
+        sigmaSpatial (float)   : How far the filter reaches, in pixels.
+        sigmaRange (float)     : How different two values can be and still get mixed together, in the [0, 255] range.
+        out (np.typing.NDArray): Where to write the result. Must be np.uint8 with the same shape as img. It can be img itself,
+                                 since every channel is splatted into the grid before it's written. By default, a new array is created.
+
+    Returns:
+        np.typing.NDArray (np.uint8): The filtered image.
+    """
+    H, W, _ = img.shape
+
+    # The size of the cells of the grid, in pixels and in values (see the docstring)
+    cellSize  = sigmaSpatial * 2 / np.sqrt(3)
+    cellRange = sigmaRange   * 2 / np.sqrt(3)
+
+    # The position of every pixel in the grid. The +1 leaves an empty cell on each side,
+    # so the blur and the trilinear interpolation never go out of bounds.
+    gridRows    = np.arange(H, dtype=np.float32) / np.float32(cellSize) + 1
+    gridColumns = np.arange(W, dtype=np.float32) / np.float32(cellSize) + 1
+
+    gridShape = (int(np.ceil((H - 1) / cellSize)) + 3,
+                 int(np.ceil((W - 1) / cellSize)) + 3,
+                 int(np.ceil(255 / cellRange)) + 3)
+
+    # Integer and fractional parts of the rows and columns. These are the same for every channel.
+    rowIdx    = np.floor(gridRows).astype(np.int64)
+    columnIdx = np.floor(gridColumns).astype(np.int64)
+    rowFrac    = (gridRows    - rowIdx).reshape(-1, 1)
+    columnFrac = (gridColumns - columnIdx).reshape(1, -1)
+
+    # Splat with the nearest cell
+    nearestRows    = np.rint(gridRows).astype(np.int64).reshape(-1, 1)
+    nearestColumns = np.rint(gridColumns).astype(np.int64).reshape(1, -1)
+
+    def blurGrid(grid):
+        # A [1, 2, 1] / 4 kernel along each of the 3 axes
+        for axis in range(3):
+            grid    = np.moveaxis(grid, axis, 0)
+            blurred = grid.copy()
+            blurred[1:-1] = (grid[:-2] + 2 * grid[1:-1] + grid[2:]) / 4
+            grid = np.moveaxis(blurred, 0, axis)
+
+        return grid
+
+    if out is None:
+        out = np.empty_like(img)
+
+    for channel in range(img.shape[-1]):
+        values      = img[..., channel].astype(np.float32)
+        gridValues  = values / np.float32(cellRange) + 1
+
+        nearestDepths = np.rint(gridValues).astype(np.int64)
+        cell = np.ravel_multi_index((np.broadcast_to(nearestRows, (H, W)), np.broadcast_to(nearestColumns, (H, W)), nearestDepths), gridShape).ravel()
+
+        # Each cell stores the sum of the values that fell in it and how many of them there were
+        nCells     = gridShape[0] * gridShape[1] * gridShape[2]
+        gridSum    = np.bincount(cell, weights=values.ravel(), minlength=nCells).reshape(gridShape)
+        gridWeight = np.bincount(cell, minlength=nCells).astype(np.float64).reshape(gridShape)
+
+        gridSum    = blurGrid(gridSum)
+        gridWeight = blurGrid(gridWeight)
+
+        # Slice the grid. Trilinear interpolation is the weighted sum of the 8 cells around each pixel.
+        depthIdx  = np.floor(gridValues).astype(np.int64)
+        depthFrac = gridValues - depthIdx
+
+        numerator   = np.zeros((H, W), dtype=np.float64)
+        denominator = np.zeros((H, W), dtype=np.float64)
+        for rowOffset in (0, 1):
+            rowWeight = rowFrac if rowOffset else 1 - rowFrac
+            for columnOffset in (0, 1):
+                columnWeight = columnFrac if columnOffset else 1 - columnFrac
+                for depthOffset in (0, 1):
+                    depthWeight = depthFrac if depthOffset else 1 - depthFrac
+
+                    weight = rowWeight * columnWeight * depthWeight
+                    rows    = (rowIdx    + rowOffset).reshape(-1, 1)
+                    columns = (columnIdx + columnOffset).reshape(1, -1)
+                    depths  = depthIdx + depthOffset
+
+                    numerator   += weight * gridSum[rows, columns, depths]
+                    denominator += weight * gridWeight[rows, columns, depths]
+
+        out[..., channel] = np.clip(np.rint(numerator / np.maximum(denominator, 1e-8)), 0, 255).astype(np.uint8)
+
+    return out
@@ -0,0 +1,162 @@
+# cython: boundscheck=False, wraparound=False, nonecheck=False, cdivision=True
+import numpy as np
+cimport numpy as np
+
+from cython.parallel import prange
+from libc.stdlib cimport calloc, free
+from libc.string cimport memset
+
+
+cdef inline Py_ssize_t clamp(Py_ssize_t value, Py_ssize_t low, Py_ssize_t high) noexcept nogil:
+    if value < low:
+        return low
+    if value > high:
+        return high
+
+    return value
+
+
+# Filters the rows [startRow, endRow) of one channel of the image. Returns 1 if the histograms couldn't be allocated, 0 otherwise.
+cdef int medianStripe(np.uint8_t *src, np.uint8_t *dst, Py_ssize_t H, Py_ssize_t W, Py_ssize_t C,
+                       Py_ssize_t channel, Py_ssize_t startRow, Py_ssize_t endRow, Py_ssize_t radius) noexcept nogil:
+
+    # One 256-bin histogram per column, with the pixels of that column that are inside the window.
+    # There's also a coarse histogram with 16 bins for each column, where each bin is the sum of 16 bins of the fine one.
+    cdef unsigned short *columnHist   = <unsigned short *> calloc(W * 256, sizeof(unsigned short))
+    cdef unsigned short *columnCoarse = <unsigned short *> calloc(W * 16,  sizeof(unsigned short))
+
+    # The histogram of the whole window
+    cdef int windowHist[256]
+    cdef int windowCoarse[16]
+
+    cdef Py_ssize_t row, column, offset, bin, coarseBin, addedColumn, removedColumn, rowIn, rowOut
+    cdef int count
+    cdef np.uint8_t value
+
+    # The median is the element in this position when all the pixels in the window are sorted
+    cdef int half = ((2 * radius + 1) * (2 * radius + 1)) // 2
+
+    if columnHist == NULL or columnCoarse == NULL:
+        free(columnHist)
+        free(columnCoarse)
+        return 1
+
+    # Fill the column histograms with the rows around startRow. The rows outside the image repeat the first/last row.
+    for offset in range(-radius, radius + 1):
+        row = clamp(startRow + offset, 0, H - 1)
+        for column in range(W):
+            value = src[(row * W + column) * C + channel]
+            columnHist[column * 256 + value] += 1
+            columnCoarse[column * 16 + (value >> 4)] += 1
+
+    for row in range(startRow, endRow):
+        # Slide every column histogram one row down: the top row leaves the window and a new row enters at the bottom
+        if row > startRow:
+            rowOut = clamp(row - radius - 1, 0, H - 1)
+            rowIn  = clamp(row + radius,     0, H - 1)
+            for column in range(W):
+                value = src[(rowOut * W + column) * C + channel]
+                columnHist[column * 256 + value] -= 1
+                columnCoarse[column * 16 + (value >> 4)] -= 1
+
+                value = src[(rowIn * W + column) * C + channel]
+                columnHist[column * 256 + value] += 1
+                columnCoarse[column * 16 + (value >> 4)] += 1
+
+        # The window histogram of the first pixel in the row is the sum of the column histograms around it
+        memset(windowHist,   0, 256 * sizeof(int))
+        memset(windowCoarse, 0, 16  * sizeof(int))
+        for offset in range(-radius, radius + 1):
+            column = clamp(offset, 0, W - 1)
+            for bin in range(256):
+                windowHist[bin] += columnHist[column * 256 + bin]
+            for coarseBin in range(16):
+                windowCoarse[coarseBin] += columnCoarse[column * 16 + coarseBin]
+
+        for column in range(W):
+            # Find the median. First find the coarse bin that contains it, then the exact bin inside of it.
+            count     = 0
+            coarseBin = 0
+            while count + windowCoarse[coarseBin] <= half:
+                count += windowCoarse[coarseBin]
+                coarseBin = coarseBin + 1
+
+            bin = coarseBin * 16
+            while count + windowHist[bin] <= half:
+                count += windowHist[bin]
+                bin = bin + 1
+
+            dst[(row * W + column) * C + channel] = <np.uint8_t> bin
+
+            # Slide the window one column to the right: add the column histogram that enters the window and
+            # subtract the one that leaves it. This is the same amount of work no matter how big the radius is.
+            if column + 1 < W:
+                addedColumn   = clamp(column + radius + 1, 0, W - 1)
+                removedColumn = clamp(column - radius,     0, W - 1)
+                for bin in range(256):
+                    windowHist[bin] += <int> columnHist[addedColumn * 256 + bin] - <int> columnHist[removedColumn * 256 + bin]
+                for coarseBin in range(16):
+                    windowCoarse[coarseBin] += <int> columnCoarse[addedColumn * 16 + coarseBin] - <int> columnCoarse[removedColumn * 16 + coarseBin]
+
+    free(columnHist)
+    free(columnCoarse)
+
+    return 0
+
+
+def medianFilter(np.ndarray[np.uint8_t, ndim=3] img, int radius, np.ndarray out=None):
+    """
+    Median filter (https://en.wikipedia.org/wiki/Median_filter) with a square (2 * radius + 1) x (2 * radius + 1) window.
+
+    This is the constant-time algorithm by Perreault and Hébert (https://doi.org/10.1109/TIP.2007.902329). Since the image is
+    np.uint8, the pixels inside the window can be stored in a 256-bin histogram, and the median is found by walking through it.
+    We also keep one histogram per column of the image. When the window moves one pixel to the right, one column histogram is added
+    to the window histogram and another one is subtracted, and when we move to the next row, every column histogram only loses one
+    pixel and gains another. None of this depends on the radius, so the cost per pixel is constant.
+
+    The image is split into horizontal stripes, and every stripe of every channel is filtered in parallel.
+
+    Args:
+        img (np.typing.NDArray): The image. Must be np.uint8 in the format (H, W, C).
+        radius (int)           : The radius of the window.
+        out (np.typing.NDArray): Where to write the result. Must be np.uint8 with the same shape as img, and can't be img itself.
+                                 By default, a new array is created.
+
+    Returns:
+        np.typing.NDArray (np.uint8): The filtered image.
+    """
+    cdef np.ndarray[np.uint8_t, ndim=3] src = np.ascontiguousarray(img)
+
+    # The stripes are written straight into 'out', unless it isn't contiguous
+    cdef bint intoOut = out is not None and out.flags.c_contiguous
+    cdef np.ndarray[np.uint8_t, ndim=3] dst = out if intoOut else np.empty_like(src)
+
+    cdef Py_ssize_t H = src.shape[0]
+    cdef Py_ssize_t W = src.shape[1]
+    cdef Py_ssize_t C = src.shape[2]
+
+    # Every stripe has to fill its column histograms from scratch, which costs 2 * radius + 1 rows.
+    # Making the stripes a lot taller than that keeps this overhead small.
+    cdef Py_ssize_t stripeHeight = max(64, 8 * radius)
+    cdef Py_ssize_t nStripes     = (H + stripeHeight - 1) // stripeHeight
+    cdef Py_ssize_t task, stripe, channel
+
+    # The stripes can't raise an exception without the GIL, so they count how many of them ran out of memory instead
+    cdef int nFailed = 0
+
+    cdef np.uint8_t *srcPtr = &src[0, 0, 0]
+    cdef np.uint8_t *dstPtr = &dst[0, 0, 0]
+
+    for task in prange(nStripes * C, nogil=True, schedule="dynamic"):
+        stripe  = task // C
+        channel = task % C
+        nFailed += medianStripe(srcPtr, dstPtr, H, W, C, channel, stripe * stripeHeight, min(H, (stripe + 1) * stripeHeight), radius)
+
+    if nFailed > 0:
+        raise MemoryError(f"Couldn't allocate the column histograms of the median filter in {nFailed} stripe(s)")
+
+    if out is not None and not intoOut:
+        out[...] = dst
+        return out
+
+    return dst
@@ -0,0 +1,83 @@
+# cython: boundscheck=False, wraparound=False, nonecheck=False, cdivision=True
+import numpy as np
+cimport numpy as np
+
+from cython.parallel import prange
+
+import importlib
+
+# 'include' is a reserved word in Cython, so the usual 'import include.utils.kernels as kernels' doesn't compile
+kernels = importlib.import_module("include.utils.kernels")
+
+
+# Runs the Young-van Vliet recursive filter in place on a single line of pixels.
+# The line starts at 'line' and has 'size' pixels that are 'stride' floats apart from each other.
+cdef inline void filterLine(float *line, Py_ssize_t size, Py_ssize_t stride,
+                            double B, double b1, double b2, double b3) noexcept nogil:
+    cdef Py_ssize_t idx
+    cdef double w1, w2, w3, current
+
+    # Forward pass. The borders are treated as if the first pixel repeated forever to the left.
+    w1 = line[0]
+    w2 = w1
+    w3 = w1
+    for idx in range(size):
+        current = B * line[idx * stride] + b1 * w1 + b2 * w2 + b3 * w3
+        line[idx * stride] = <float> current
+        w3 = w2
+        w2 = w1
+        w1 = current
+
+    # Backward pass. Same thing, but now the last pixel repeats forever to the right.
+    w1 = line[(size - 1) * stride]
+    w2 = w1
+    w3 = w1
+    for idx in range(size - 1, -1, -1):
+        current = B * line[idx * stride] + b1 * w1 + b2 * w2 + b3 * w3
+        line[idx * stride] = <float> current
+        w3 = w2
+        w2 = w1
+        w1 = current
+
+
+def recursiveGaussian(np.ndarray[np.float32_t, ndim=3] img, double sigma):
+    """
+    Gaussian blur with an arbitrary sigma using the recursive filter by Young and van Vliet
+    (https://doi.org/10.1016/0165-1684(95)00020-E).
+
+    Instead of convolving the image with a kernel that grows with sigma, the recursive filter computes each pixel from the
+    input pixel and the last 3 pixels it already computed. Running it forwards and then backwards over every line approximates
+    a Gaussian, and the cost per pixel is the same no matter how big sigma is.
+
+    The rows are all independent of each other, so they are filtered in parallel. Then the same is done with the columns.
+
+    Args:
+        img (np.typing.NDArray): The image. Must be np.float32 in the format (H, W, C).
+        sigma (float)          : The standard deviation of the Gaussian. Should be at least 0.5.
+
+    Returns:
+        np.typing.NDArray (np.float32): The blurred image.
+    """
+    cdef double B, b1, b2, b3
+    B, b1, b2, b3 = kernels.youngVanVlietCoefficients(sigma)
+
+    cdef np.ndarray[np.float32_t, ndim=3] out = np.ascontiguousarray(img, dtype=np.float32).copy()
+
+    cdef Py_ssize_t H = out.shape[0]
+    cdef Py_ssize_t W = out.shape[1]
+    cdef Py_ssize_t C = out.shape[2]
+    cdef Py_ssize_t row, column, channel
+
+    cdef float *outPtr = &out[0, 0, 0]
+
+    # Filter every row. Each pixel of a row is C floats away from the next one.
+    for row in prange(H, nogil=True):
+        for channel in range(C):
+            filterLine(outPtr + row * W * C + channel, W, C, B, b1, b2, b3)
+
+    # Filter every column. Each pixel of a column is W * C floats away from the next one.
+    for column in prange(W, nogil=True):
+        for channel in range(C):
+            filterLine(outPtr + column * C + channel, H, W * C, B, b1, b2, b3)
+
+    return out
@@ -0,0 +1,81 @@
+"""
+Sharpen.py sharpens images with an unsharp mask (https://en.wikipedia.org/wiki/Unsharp_masking). The name is a bit confusing,
+but the idea is simple: blurring the image removes its fine details, so img - blurred (a high-pass filter of the image) has only
+the fine details. Adding a bit more of them back to the image makes the edges stand out.
+"""
+
+import numpy as np
+
+import include.effects.blur.blur as blur
+import include.utils.colormodel as colormodel
+
+
+# How many pixels are combined at a time by unsharpMask(). The subtraction, the threshold and the scaled addition all go through
+# the same few rows before moving on to the next ones, so the temporaries stay small and in the cache.
+sharpenChunk = 2**16
+
+
+def unsharpMask(img: np.typing.NDArray, amount: float, radius: float = 1.0, threshold: float = 0, linear: bool = False,
+                out: np.typing.NDArray = None) -> np.typing.NDArray:
+    """Sharpens the image with an unsharp mask:
+
+        sharpened = img + amount * (img - blurred)
+
+    Pixels where |img - blurred| is smaller than the threshold are left as they are, so the noise and the film grain in
+    flat areas aren't sharpened along with the edges.
+
+    The blur is blur.gaussianFilter(), so small radii use the separable convolution and large ones the recursive filter, whose
+    cost doesn't depend on the radius. The image is sharpened one channel at a time. Each channel is blurred into a np.float32
+    array, and then the subtraction, the threshold and the scaled addition are done in a single pass, a few rows at a time,
+    writing straight into the np.uint8 result. So besides the result, the only full size array is the blurred channel.
+
+    Args:
+        img (np.typing.NDArray): The np.uint8 image. Must be in the format (H, W, C)
+        amount (float)         : How much of the details is added back. 1 doubles the contrast of the fine details. Must be greater than 0.
+        radius (float)         : The sigma of the Gaussian blur, in pixels. Bigger radii sharpen bigger details. Default = 1.
+        threshold (float)      : How different (in the [0, 255] range) a pixel must be from its blurred version to be sharpened. Default = 0.
+        linear (bool)          : Blurs and sharpens in linear light instead of sRGB, so the halos around the edges are as strong on
+                                 the bright side as on the dark side. The threshold is also compared in linear light.
+        out (np.typing.NDArray): Where to write the result. Must be np.uint8 with the same shape as img. It can be img itself,
+                                 to sharpen it in place. By default, a new array is created.
+
+    Returns:
+        np.typing.NDArray (np.uint8): The sharpened image.
+    """
+    if out is None:
+        out = np.empty(img.shape, dtype=np.uint8)
+
+    H, W, C = img.shape
+    nRows   = max(1, sharpenChunk // max(1, W))
+
+    # In linear light, the values are kept in the [0, 255] range, so the amount and the threshold mean the same thing in both cases
+    decodeTable = colormodel.srgbDecodeTable() * np.float32(255) if linear else None
+
+    for channel in range(C):
+        if linear:
+            original = decodeTable[img[..., channel]]
+        else:
+            original = img[..., channel]
+
+        # The whole channel is blurred before anything is written, so 'out' can be the image itself
+        blurred = blur.gaussianFilter(original[..., np.newaxis], radius)[..., 0]
+
+        for start in range(0, H, nRows):
+            originalRows = original[start : start + nRows].astype(np.float32)
+
+            # The details of these rows. They are written over the blurred rows, which aren't needed anymore
+            details = np.subtract(originalRows, blurred[start : start + nRows], out=blurred[start : start + nRows])
+            if threshold > 0:
+                details[np.abs(details) < threshold] = 0
+
+            details *= np.float32(amount)
+            details += originalRows
+
+            if linear:
+                out[start : start + nRows, :, channel] = colormodel.linearToSrgb(details / np.float32(255))
+            else:
+                np.clip(details, 0, 255, out=details)
+                np.rint(details, out=details)
+                out[start : start + nRows, :, channel] = details
+
+    return out
@@ -1,18 +1,30 @@
 import numpy as np
 
 
-def brightness_boost(img: np.typing.NDArray, boost: int) -> np.typing.NDArray:
+def brightness_boost(img: np.typing.NDArray, boost: int, out: np.typing.NDArray = None) -> np.typing.NDArray:
     """Boosts the brightness in RGB images
 
+    The image is np.uint8, so adding the boost and clipping to [0, 255] is the same as clipping first to [0, 255 - boost]
+    (or to [-boost, 255] when darkening) and then adding it. That way the math never leaves np.uint8, and there's no need
+    for a np.int16 copy of the image.
+
     Args:
         img (np.typing.NDArray): The image (must be numpy array)
         boost (int): The boost percentage. Must be between -255 and 255
+        out (np.typing.NDArray): Where to write the result. Must be np.uint8 with the same shape as img. It can be img itself,
+                                 to boost the brightness in place. By default, a new array is created.
 
     Returns:
         img: The image with boosted brightness
     """
-    img = img.copy().astype(np.int16)
+    if img.dtype != np.uint8:
+        img = np.clip(img.astype(np.int16), 0, 255).astype(np.uint8)
 
-    img = (img + boost).clip(0, 255).astype(np.uint8)
+    if boost >= 0:
+        out  = np.minimum(img, 255 - boost, out=out)
+        out += np.uint8(boost)
+    else:
+        out  = np.maximum(img, -boost, out=out)
+        out -= np.uint8(-boost)
 
-    return img
\ No newline at end of file
+    return out
@@ -1,38 +1,114 @@
 import numpy as np
 
+import include.utils.buffers as buffers
+import include.utils.colormodel as colormodel
 
-def contrast_boost(img: np.typing.NDArray, boost: float) -> np.typing.NDArray:
+
+# How many pixels are counted at a time by channelHistogram(). np.bincount() converts its input to 64-bit integers,
+# so counting in chunks keeps that copy small.
+histogramChunk = 2**20
+
+
+def contrast_boost(img: np.typing.NDArray, boost: float, linear: bool = False, out: np.typing.NDArray = None) -> np.typing.NDArray:
     """Boosts the contrast in RGB images
 
+    Every channel is stretched so its boost / 2 % darkest values become 0 and its boost / 2 % brightest values become 255.
+    Since the image is np.uint8, the new value of a pixel only depends on its old value (and on its channel), so the stretch is
+    computed once for each of the 256 values and applied with a lookup. The percentiles come from the histogram of the channel,
+    so there's no need for a np.float32 copy of the image either.
+
     Args:
-        img (np.typing.NDArray): The image (must be numpy array)
+        img (np.typing.NDArray): The np.uint8 image (must be numpy array)
         boost (int): The boost percentage. Must be between 0 and 100
+        linear (bool): Stretches the midtones in linear light instead of sRGB.
+        out (np.typing.NDArray): Where to write the result. Must be np.uint8 with the same shape as img. It can be img itself,
+                                 to boost the contrast in place. By default, a new array is created.
 
     Returns:
         img: The image with boosted contrast
     """
-    img = img.copy().astype(np.float32)
+    img = np.asarray(img)
+    if img.dtype != np.uint8:
+        img = np.clip(img, 0, 255).astype(np.uint8)
+
+    if out is None:
+        out = np.empty_like(img)
+
+    # The value that each of the 256 np.uint8 values has while stretching. In linear light it's in the same [0, 255] range
+    # as the regular image, so the rest of the function doesn't change
+    if linear:
+        values = colormodel.srgbDecodeTable() * np.float32(255)
+    else:
+        values = np.arange(256, dtype=np.float32)
 
     # Divided by two because the boost is divided between the lowtones and hightones.
     # For example, if boost = 5%, 2.5% goes to the lowtones and 2.5% to the hightones. This way, the boost can be
     # from 0 to 100. If I didn't divide by two, if boost = 100, then the lowtones and hightones would overlap XD.
     boost = boost / 2
-    
+
     for channel in range(img.shape[-1]):
-        lowtones  = np.percentile(img[..., channel], boost)
-        hightones = np.percentile(img[..., channel], 100-boost)
+        cumulativeCount = np.cumsum(channelHistogram(img[..., channel]))
+
+        lowtones  = histogramPercentile(cumulativeCount, values, boost)
+        hightones = histogramPercentile(cumulativeCount, values, 100-boost)
+
+        # The hightones become 255 and the lowtones 0. The midtones are scaled to [0, 255]. Only the values strictly between
+        # the lowtones and the hightones are midtones, so the division is never by 0.
+        LUT = np.where(values >= hightones, np.float32(255), np.float32(0))
+        midtones_mask = (values > lowtones) & (values < hightones)
+        LUT[midtones_mask] = (values[midtones_mask] - lowtones) / (hightones - lowtones) * 255
+
+        if linear:
+            LUT = colormodel.linearToSrgb(LUT / np.float32(255))
+        else:
+            LUT = LUT.clip(0, 255).astype(np.uint8)
+
+        buffers.lookup(LUT, img[..., channel], out[..., channel])
+
+    return out
 
-        lowtones_mask  = img[..., channel] <= lowtones
-        hightones_mask = img[..., channel] >= hightones
 
-        img[..., channel][lowtones_mask]  = 0
-        img[..., channel][hightones_mask] = 255
+def channelHistogram(channel: np.typing.NDArray) -> np.typing.NDArray:
+    """How many times each of the 256 values appears in a np.uint8 channel.
+    """
+    channel   = channel.reshape(-1)
+    histogram = np.zeros(256, dtype=np.int64)
+    for start in range(0, channel.shape[0], histogramChunk):
+        histogram += np.bincount(channel[start : start + histogramChunk], minlength=256)
+
+    return histogram
+
+
+def histogramPercentile(cumulativeCount: np.typing.NDArray, values: np.typing.NDArray, percentile: float) -> np.float32:
+    """
+    The same as np.percentile(values[channel], percentile), but from the histogram of the channel instead of the channel itself.
+    The k-th smallest pixel is the first value whose cumulative count is bigger than k, so the two pixels around the percentile
+    are found with a binary search. They are then interpolated exactly like np.percentile() does for np.float32 arrays
+    (the default 'linear' method, in np.float32), so the result is bit for bit the same.
+
+    Args:
+        cumulativeCount (np.typing.NDArray): The cumulative histogram of the np.uint8 channel.
+        values (np.typing.NDArray)         : The np.float32 value of each of the 256 np.uint8 values.
+        percentile (float)                 : The percentile, between 0 and 100.
+
+    Returns:
+        np.float32: The percentile.
+    """
+    nPixels = int(cumulativeCount[-1])
+
+    position = (nPixels - 1) * np.true_divide(percentile, np.float32(100))
+    if position >= nPixels - 1:
+        previous = nPixels - 1
+    else:
+        previous = int(np.floor(position))
+    following = min(previous + 1, nPixels - 1)
 
-        midtones_mask = ~(lowtones_mask | hightones_mask)
+    gamma = np.float32(position - np.floor(position))
+    low   = values[np.searchsorted(cumulativeCount, previous, "right")]
+    high  = values[np.searchsorted(cumulativeCount, following, "right")]
 
-        img[..., channel][midtones_mask] = (img[..., channel][midtones_mask] - lowtones) / (hightones - lowtones) * 255
-        
-    
-    img = img.clip(0, 255).astype(np.uint8)
+    difference = high - low
+    if gamma >= 0.5:
+        return high - difference * (1 - gamma)
 
-    return img
\ No newline at end of file
+    return low + difference * gamma
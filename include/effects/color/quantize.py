@@ -1,5 +1,17 @@
+import functools
+
 import numpy as np
 
+import include.utils.backends as backends
+import include.utils.buffers as buffers
+import include.utils.colormodel as colormodel
+
+
+# Finding the nearest color in CIELAB can't be done one channel at a time, so the nearest color is precomputed for a
+# grid of 2^labGridBits x 2^labGridBits x 2^labGridBits RGB colors. Each pixel uses the grid cell it falls in.
+labGridBits = 6
+
+
 def nearestColor(pixelColor: np.typing.NDArray, availableColors: np.typing.NDArray) -> np.typing.NDArray:
     """
     Given a list of available colors, picks the one closest to pixelColor
@@ -24,7 +36,178 @@ def nearestColor(pixelColor: np.typing.NDArray, availableColors: np.typing.NDArr
                 )
 
 
-def quantize(img: np.typing.NDArray, availableColors: np.typing.NDArray) -> np.typing.NDArray:
+def quantize(img: np.typing.NDArray, availableColors: np.typing.NDArray, linear: bool = False, lab: bool = False,
+             out: np.typing.NDArray = None) -> np.typing.NDArray:
+    """Quantizes the image into an arbitrary number of colors. The backend that does the actual work
+    is chosen by backends.dispatch().
+
+    Args:
+        img (np.typing.NDArray)             : The image array. Must be in the format (H, W, C)
+        availableColors (np.typing.NDArray) : A list containing the colors available. Should start at 0 and 
+                                                the last element should be 255.
+        linear (bool)                       : Picks the nearest color in linear light instead of sRGB. The image must be np.uint8.
+        lab (bool)                          : Picks the nearest color in CIELAB. See quantizeLab().
+        out (np.typing.NDArray)             : Where to write the quantized image. Must be np.uint8 with the same shape as img.
+                                              It can be img itself. By default, a new array is created.
+    Returns:
+        np.typing.NDArray (np.uint8): The quantized image
+    """
+    if lab:
+        return buffers.writeInto(quantizeLab(img, availableColors), out)
+
+    # A np.uint8 image is always quantized with a lookup table (that's also what dispatch() picks for it), written straight into out
+    if linear or (out is not None and img.dtype == np.uint8):
+        return buffers.lookup(quantizationTable(np.asarray(availableColors, dtype=np.uint8).tobytes(), "linear" if linear else "srgb"), img, out)
+
+    return buffers.writeInto(backends.dispatch("quantize", img, availableColors), out)
+
+
+def quantizeLUT(img: np.typing.NDArray, availableColors: np.typing.NDArray) -> np.typing.NDArray:
+    """Quantizes a np.uint8 image using a lookup table.
+    Since there are only 256 possible values in a np.uint8 image, we can find the nearest color of each of them
+    just once, and then quantizing the image is a single lookup per pixel instead of a binary search.
+
+    Args:
+        img (np.typing.NDArray)             : The image array. Must be np.uint8 in the format (H, W, C)
+        availableColors (np.typing.NDArray) : A list containing the colors available. Should start at 0 and 
+                                                the last element should be 255.
+    Returns:
+        np.typing.NDArray (np.uint8): The quantized image
+    """
+    LUT = quantizationTable(np.asarray(availableColors, dtype=np.uint8).tobytes())
+
+    return LUT[img]
+
+
+@functools.lru_cache(maxsize=16)
+def quantizationTable(availableColors: bytes, space: str = "srgb") -> np.typing.NDArray:
+    """The lookup table used by quantizeLUT(). It maps each of the 256 possible np.uint8 values to the nearest available color.
+    The tables are cached, so animations (and anything else that quantizes many images with the same colors) only build them once.
+
+    Args:
+        availableColors (bytes): The available colors as the bytes of a np.uint8 array, since arrays can't be used as cache keys.
+        space (str)            : Where the distance to each color is measured. "srgb", "linear" (linear light) or
+                                 "lab" (the L channel of CIELAB, for grayscale images).
+
+    Returns:
+        np.typing.NDArray (np.uint8): The lookup table.
+    """
+    availableColors = np.frombuffer(availableColors, dtype=np.uint8)
+
+    if space != "srgb":
+        values = grayTransferTable(space)
+
+        # Only 256 x len(availableColors) distances, so there's no need for anything smarter than an argmin
+        distance = np.abs(values.reshape(-1, 1) - values[availableColors].reshape(1, -1))
+        LUT      = availableColors[np.argmin(distance, axis=1)]
+    else:
+        LUT = nearestColor(np.arange(256, dtype=np.uint8), availableColors).astype(np.uint8)
+
+    # The table is cached, so make sure nobody changes it by accident
+    LUT.flags.writeable = False
+
+    return LUT
+
+
+@functools.lru_cache(maxsize=None)
+def grayTransferTable(space: str) -> np.typing.NDArray:
+    """The value of each of the 256 gray levels in linear light or in CIELAB (its L channel), scaled to the range [0, 255].
+    Grayscale images are quantized and dithered in those spaces by working with these values instead of the original ones.
+
+    Args:
+        space (str): "linear" or "lab".
+
+    Returns:
+        np.typing.NDArray (np.float32): The 256 values.
+    """
+    if space == "linear":
+        values = colormodel.srgbDecodeTable() * np.float32(255)
+    else:
+        gray   = np.repeat(np.arange(256, dtype=np.uint8).reshape(1, -1, 1), repeats=3, axis=2)
+        values = colormodel.rgb2labNumpy(gray)[0, :, 0] * np.float32(2.55)
+
+    values = values.astype(np.float32)
+    values.flags.writeable = False
+
+    return values
+
+
+@functools.lru_cache(maxsize=16)
+def labPalette(availableColors: bytes) -> tuple:
+    """Finds the nearest color in CIELAB for every cell of the RGB grid used by quantizeLab(). The palette is every combination of
+    availableColors across the 3 channels (in the same order as paletteIndices()), since those are the colors a quantized RGB image can have.
+
+    The grid has 2^(3 * labGridBits) cells and the palette usually has a few dozen colors, so this is millions of distances.
+    It only has to be done once for each set of colors, which is why it's cached.
+
+    Args:
+        availableColors (bytes): The available colors as the bytes of a np.uint8 array.
+
+    Returns:
+        tuple: (nearestIdx, palette). nearestIdx is a flat np.uint16 array with the index of the nearest palette color of each grid cell,
+        and palette is the (nColors, 3) np.uint8 palette.
+    """
+    availableColors = np.frombuffer(availableColors, dtype=np.uint8)
+
+    palette    = np.stack(np.meshgrid(availableColors, availableColors, availableColors, indexing="ij"), axis=-1).reshape(-1, 3)
+    paletteLab = colormodel.rgb2lab(palette.reshape(1, -1, 3))[0]
+
+    # The center of each grid cell
+    cellSize = 2 ** (8 - labGridBits)
+    centers  = (np.arange(2 ** labGridBits) * cellSize + cellSize // 2).astype(np.uint8)
+    grid     = np.stack(np.meshgrid(centers, centers, centers, indexing="ij"), axis=-1).reshape(1, -1, 3)
+    gridLab  = colormodel.rgb2lab(grid)[0]
+
+    # |cell - color|^2 = |cell|^2 - 2 cell . color + |color|^2, and |cell|^2 is the same for every color, so the nearest color is
+    # the one with the smallest |color|^2 - 2 cell . color. That's a matrix multiplication, done a chunk of cells at a time to keep
+    # the memory usage small.
+    paletteNorm = np.sum(paletteLab ** 2, axis=1)
+    nearestIdx  = np.empty(len(gridLab), dtype=np.uint16)
+    chunkSize   = 2**15
+    for start in range(0, len(gridLab), chunkSize):
+        distance = paletteNorm - 2 * (gridLab[start : start + chunkSize] @ paletteLab.T)
+        nearestIdx[start : start + chunkSize] = np.argmin(distance, axis=1)
+
+    nearestIdx.flags.writeable = False
+    palette.flags.writeable    = False
+
+    return nearestIdx, palette
+
+
+def labGridIndex(img: np.typing.NDArray) -> np.typing.NDArray:
+    """The index of the cell of the labPalette() grid that each pixel of a np.uint8 RGB image falls in.
+    """
+    shift = 8 - labGridBits
+
+    idx = (img[..., 0] >> shift).astype(np.uint32) << (2 * labGridBits)
+    idx |= (img[..., 1] >> shift).astype(np.uint32) << labGridBits
+    idx |= (img[..., 2] >> shift).astype(np.uint32)
+
+    return idx
+
+
+def quantizeLab(img: np.typing.NDArray, availableColors: np.typing.NDArray) -> np.typing.NDArray:
+    """Quantizes the image by picking the nearest color in CIELAB. Grayscale images compare the L channel of each gray level,
+    and RGB images pick the nearest of all the combinations of availableColors across the 3 channels. Both are lookups in
+    precomputed tables, so this costs about the same as quantizeLUT().
+
+    Args:
+        img (np.typing.NDArray)             : The np.uint8 image. Must be in the format (..., C), with C = 1 or 3.
+        availableColors (np.typing.NDArray) : A list containing the colors available.
+    Returns:
+        np.typing.NDArray (np.uint8): The quantized image
+    """
+    colorsKey = np.asarray(availableColors, dtype=np.uint8).tobytes()
+
+    if img.shape[-1] == 1:
+        return quantizationTable(colorsKey, "lab")[img]
+
+    nearestIdx, palette = labPalette(colorsKey)
+
+    return palette[nearestIdx[labGridIndex(img)]]
+
+
+def quantizeNumpy(img: np.typing.NDArray, availableColors: np.typing.NDArray) -> np.typing.NDArray:
     """Quantizes the image into an arbitrary number of colors.
 
     Args:
@@ -45,4 +228,51 @@ def quantize(img: np.typing.NDArray, availableColors: np.typing.NDArray) -> np.t
     img  = np.stack([nearestColor(img[:, channel], availableColors) for channel in range(img.shape[-1])], axis=1)
     
     # Reshape the image back into the original shape
-    return img.reshape(originalImgShape).astype(np.uint8)
\ No newline at end of file
+    return img.reshape(originalImgShape).astype(np.uint8)
+
+def paletteIndices(img: np.typing.NDArray, availableColors: np.typing.NDArray):
+    """
+    Given an image that was already quantized (or dithered) with availableColors, computes the palette index of every pixel.
+    This lets us save the image as an indexed image instead of a full RGB image.
+
+    In a grayscale image the palette is just availableColors. In an RGB image, the palette is every combination of
+    availableColors across the 3 channels that actually shows up in the image.
+
+    Args:
+        img (np.typing.NDArray)             : The quantized image. Must be in the format (H, W, C)
+        availableColors (np.typing.NDArray) : The colors that were used to quantize the image.
+
+    Returns:
+        tuple: (indices, palette). indices is a (H, W) np.uint8 array and palette is a (nColors, C) np.uint8 array.
+        If there are more than 256 colors in the image, returns (None, None).
+    """
+    nColors   = len(availableColors)
+    nChannels = img.shape[-1]
+    nCombinations = nColors ** nChannels
+
+    # Too many combinations to count them with a bincount. The caller can still fall back to imageio.toIndexed()
+    if nCombinations > 0xFFFF:
+        return None, None
+
+    # Maps each possible pixel value to its position in availableColors. Since the image is quantized,
+    # every pixel value is guaranteed to be in availableColors.
+    colorPosition = np.zeros(256, dtype=np.uint16)
+    colorPosition[availableColors] = np.arange(nColors)
+
+    # Combine the positions in each channel into a single number, like digits in base nColors.
+    combinedIdx = np.zeros(img.shape[:2], dtype=np.uint16)
+    for channel in range(nChannels):
+        combinedIdx = combinedIdx * nColors + colorPosition[img[..., channel]]
+
+    # Only keep the combinations that are actually used in the image
+    usedCombinations = np.flatnonzero(np.bincount(combinedIdx.ravel(), minlength=nCombinations))
+    if len(usedCombinations) > 256:
+        return None, None
+
+    remap = np.zeros(nCombinations, dtype=np.uint8)
+    remap[usedCombinations] = np.arange(len(usedCombinations))
+
+    # Decode each used combination back into its color in each channel.
+    palette = np.stack([availableColors[(usedCombinations // nColors ** (nChannels - 1 - channel)) % nColors] for channel in range(nChannels)], axis=1)
+
+    return remap[combinedIdx], palette.astype(np.uint8)
@@ -0,0 +1,173 @@
+import numpy as np
+
+import include.effects.color.quantize as quantize
+import include.utils.backends as backends
+import include.utils.buffers as buffers
+
+
+def floydSteinberg(img: np.typing.NDArray, availableColors: np.typing.NDArray, linear: bool = False, lab: bool = False,
+                   out: np.typing.NDArray = None) -> np.typing.NDArray:
+    """
+    Applies Floyd-Steinberg dithering (https://en.wikipedia.org/wiki/Floyd%E2%80%93Steinberg_dithering) to the image.
+    The backend that does the actual work is chosen by backends.dispatch(). Normally that's the Cython implementation in
+    floyd_steinberg.pyx, but if it wasn't compiled this falls back to floydSteinbergNumpy().
+
+    Args:
+        img (np.typing.NDArray)             : The image array. Must be in the format (H, W, C)
+        availableColors (np.typing.NDArray) : A list containing the colors available. Should start at 0 and
+                                                the last element should be 255.
+        linear (bool)                       : Picks the nearest color and spreads the error in linear light instead of sRGB.
+                                              Otherwise, the dark parts of the image end up brighter than they should.
+        lab (bool)                          : Picks the nearest color in CIELAB. In RGB images, the channels are no longer
+                                              dithered separately: each pixel picks the closest combination of availableColors
+                                              and the error of all 3 channels is spread together. See floydSteinbergPalette().
+        out (np.typing.NDArray)             : Where to write the result. Must be np.uint8 with the same shape as img. It can be img itself.
+                                              By default, a new array is created.
+
+    Returns:
+        np.typing.NDArray (np.uint8): The quantized image
+    """
+    if lab and img.shape[-1] == 3:
+        nearestIdx, palette = quantize.labPalette(np.asarray(availableColors, dtype=np.uint8).tobytes())
+
+        return backends.dispatch("floydSteinbergPalette", img, nearestIdx, palette, out)
+
+    if lab:
+        return floydSteinbergTransformed(img, availableColors, "lab", out)
+
+    if linear:
+        return floydSteinbergTransformed(img, availableColors, "linear", out)
+
+    return backends.dispatch("floydSteinberg", img, availableColors, out)
+
+
+def floydSteinbergTransformed(img: np.typing.NDArray, availableColors: np.typing.NDArray, space: str,
+                              out: np.typing.NDArray = None) -> np.typing.NDArray:
+    """Floyd-Steinberg dithering in linear light or in the L channel of CIELAB (see quantize.grayTransferTable()). The image and the
+    available colors are converted to that space (scaled to the same [0, 255] range), dithered, and converted back.
+    """
+    values          = quantize.grayTransferTable(space)
+    convertedColors = values[availableColors]
+
+    # values[img] is already a new array, so it's dithered in place
+    dithered = values[img]
+    dithered = backends.dispatch("floydSteinberg", dithered, convertedColors, dithered)
+
+    if out is None:
+        out = np.empty(img.shape, dtype=availableColors.dtype)
+
+    # Every dithered pixel is exactly one of convertedColors, so finding its position gives back the sRGB color.
+    # np.searchsorted() returns 64-bit indices, so it's done a few rows at a time
+    nRows = max(1, buffers.lookupChunk // max(1, dithered[0].size)) if len(dithered) else 1
+    for start in range(0, len(dithered), nRows):
+        colorIdx = np.clip(np.searchsorted(convertedColors, dithered[start : start + nRows]), 0, len(availableColors) - 1)
+        out[start : start + nRows] = availableColors[colorIdx]
+
+    return out
+
+
+def floydSteinbergPaletteNumpy(img: np.typing.NDArray, nearestIdx: np.typing.NDArray, palette: np.typing.NDArray,
+                               out: np.typing.NDArray = None) -> np.typing.NDArray:
+    """
+    The reference implementation of Floyd-Steinberg dithering with an arbitrary palette of RGB colors. The nearest palette color of each pixel
+    is looked up in nearestIdx, a grid of RGB colors (see quantize.labPalette()), and the error of the 3 channels is spread to the neighbours.
+    Goes through every pixel in Python, so it's only usable on really small images.
+
+    Args:
+        img (np.typing.NDArray)       : The np.uint8 RGB image in the format (H, W, 3).
+        nearestIdx (np.typing.NDArray): The index of the nearest palette color of each cell of the RGB grid.
+        palette (np.typing.NDArray)   : The (nColors, 3) np.uint8 palette.
+        out (np.typing.NDArray)       : Where to write the result. By default, a new array is created.
+
+    Returns:
+        np.typing.NDArray (np.uint8): The dithered image.
+    """
+    H, W, _ = img.shape
+
+    shift = 8 - quantize.labGridBits
+
+    w0 = np.float32(7.0 / 16.0)
+    w1 = np.float32(3.0 / 16.0)
+    w2 = np.float32(5.0 / 16.0)
+    w3 = np.float32(1.0 / 16.0)
+
+    result  = img.astype(np.float32)
+    colors  = palette.astype(np.float32)
+
+    for row in range(H):
+        for column in range(W):
+            originalColor = result[row, column].copy()
+
+            # The float is truncated to find the grid cell, exactly like in the Cython version
+            cell = originalColor.astype(np.int32) >> shift
+            idx  = nearestIdx[(cell[0] << (2 * quantize.labGridBits)) | (cell[1] << quantize.labGridBits) | cell[2]]
+
+            result[row, column] = colors[idx]
+            error = originalColor - result[row, column]
+
+            if column + 1 < W:
+                result[row, column+1] = np.clip(result[row, column+1] + error * w0, 0, 255)
+
+            if row + 1 < H:
+                result[row+1, column] = np.clip(result[row+1, column] + error * w2, 0, 255)
+
+                if column - 1 >= 0:
+                    result[row+1, column-1] = np.clip(result[row+1, column-1] + error * w1, 0, 255)
+                if column + 1 < W:
+                    result[row+1, column+1] = np.clip(result[row+1, column+1] + error * w3, 0, 255)
+
+    return buffers.writeInto(result.astype(np.uint8), out)
+
+
+def floydSteinbergNumpy(img: np.typing.NDArray, availableColors: np.typing.NDArray, out: np.typing.NDArray = None) -> np.typing.NDArray:
+    """
+    The reference implementation of Floyd-Steinberg dithering. It does exactly the same thing as the Cython version
+    (including the float32 math), so both can be compared. The only thing that is vectorized are the channels, so this
+    goes through every pixel in Python and is WAY too slow for anything but tiny images.
+
+    Args:
+        img (np.typing.NDArray)             : The image array. Must be in the format (H, W, C)
+        availableColors (np.typing.NDArray) : A list containing the colors available. Should start at 0 and
+                                                the last element should be 255.
+        out (np.typing.NDArray)             : Where to write the result. By default, a new array is created.
+
+    Returns:
+        np.typing.NDArray (np.uint8): The quantized image
+    """
+    H, W, _ = img.shape
+
+    # The predefined Floyd-Steinberg weights
+    w0 = np.float32(7.0 / 16.0)
+    w1 = np.float32(3.0 / 16.0)
+    w2 = np.float32(5.0 / 16.0)
+    w3 = np.float32(1.0 / 16.0)
+
+    result = img.astype(np.float32)
+    colors = availableColors.astype(np.float32)
+
+    for row in range(H):
+        for column in range(W):
+            originalColor = result[row, column].copy()
+
+            # Quantize the pixel. Just like in the Cython version, ties go to the brighter color.
+            candidate2Idx = np.clip(np.searchsorted(colors, originalColor, "left"), 1, len(colors) - 1)
+            candidate1    = colors[candidate2Idx - 1]
+            candidate2    = colors[candidate2Idx]
+            result[row, column] = np.where(np.abs(originalColor - candidate1) < np.abs(originalColor - candidate2), candidate1, candidate2)
+
+            # Calculate the quantization error
+            error = originalColor - result[row, column]
+
+            # Distribute the residuals
+            if column + 1 < W:
+                result[row, column+1] = np.clip(result[row, column+1] + error * w0, 0, 255)
+
+            if row + 1 < H:
+                result[row+1, column] = np.clip(result[row+1, column] + error * w2, 0, 255)
+
+                if column - 1 >= 0:
+                    result[row+1, column-1] = np.clip(result[row+1, column-1] + error * w1, 0, 255)
+                if column + 1 < W:
+                    result[row+1, column+1] = np.clip(result[row+1, column+1] + error * w3, 0, 255)
+
+    return buffers.writeInto(result.astype(img.dtype), out)
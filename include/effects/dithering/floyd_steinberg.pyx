@@ -15,7 +15,7 @@ cdef inline float clip(float value, float min, float max) nogil:
 
 # Given a list of available colors, find the one that 'color' is the nearest to.
 cdef inline float nearestColor(float color,
-                               np.uint8_t *availableColors,
+                               float *availableColors,
                                int availableColorsSize) nogil:
 
     # Binary search to find the nearest available
@@ -43,8 +43,73 @@ cdef inline float nearestColor(float color,
         return availableColors[low]
 
 
-def floydSteinberg(np.ndarray[np.uint8_t, ndim=3] img, 
-                   np.ndarray[np.uint8_t, ndim=1] availableColors):
+ctypedef fused pixel_t:
+    np.uint8_t
+    np.float32_t
+
+
+# Dithers the whole image, one channel per thread. 'rows' has 2 rows of floats per channel: the row being dithered
+# and the one below it, which receives the errors. That's all the float memory Floyd-Steinberg really needs.
+cdef void ditherChannels(const pixel_t[:, :, :] img,
+                         pixel_t[:, :, :] out,
+                         float[:, :, ::1] rows,
+                         float *availableColors,
+                         int availableColorsSize) noexcept nogil:
+    cdef int H = img.shape[0]
+    cdef int W = img.shape[1]
+    cdef int C = img.shape[2]
+
+    # The predefined Floyd-Steinberg weights
+    cdef float w0 = 7.0 / 16.0
+    cdef float w1 = 3.0 / 16.0
+    cdef float w2 = 5.0 / 16.0
+    cdef float w3 = 1.0 / 16.0
+
+    cdef float originalColor, newColor, error
+    cdef int row, column, channel, current, below
+
+    # Running all the channels in parallel in pure C requires not using the Python Global Interpreter Lock
+    for channel in prange(C, nogil=True):
+        for column in range(W):
+            rows[channel, 0, column] = img[0, column, channel]
+
+        for row in range(H):
+            current = row & 1
+            below   = 1 - current
+
+            # The row below is read before anything is written to this row of 'out', so 'out' can be the image itself
+            if row + 1 < H:
+                for column in range(W):
+                    rows[channel, below, column] = img[row+1, column, channel]
+
+            for column in range(W):
+                originalColor = rows[channel, current, column]
+
+                # Quantize the pixel
+                newColor = nearestColor(originalColor, availableColors, availableColorsSize)
+                out[row, column, channel] = <pixel_t> newColor
+
+                # Calculate the quantization error (difference between original color and new color)
+                error = originalColor - newColor
+
+                # Distribute the residuals. We clip the values so residuals are always in the [0, 255] range
+                if column + 1 < W:
+                    # Update pixel to the right
+                    rows[channel, current, column+1] = clip(rows[channel, current, column+1] + error * w0, 0, 255)
+
+                if row + 1 < H:
+                    # Update pixel below
+                    rows[channel, below, column] = clip(rows[channel, below, column] + error * w2, 0, 255)
+
+                    if column - 1 >= 0:
+                        # Update pixel below and to the left
+                        rows[channel, below, column-1] = clip(rows[channel, below, column-1] + error * w1, 0, 255)
+                    if column + 1 < W:
+                        # Update pixel to the right
+                        rows[channel, below, column+1] = clip(rows[channel, below, column+1] + error * w3, 0, 255)
+
+
+def floydSteinberg(np.ndarray img, np.ndarray availableColors, np.ndarray out = None):
     """
     Floyd-Steinberg Dithering unfortunately cannot be easily run in parallel because 
     distributing the quantization error has local dependencies with neighboring pixels :(
@@ -67,63 +132,132 @@ def floydSteinberg(np.ndarray[np.uint8_t, ndim=3] img,
                 For example, if the error for the current pixel is 42, we will add 7/16 x 42 to the value of the pixel on its
                 right
 
+    The errors only ever reach the current row and the one below it, so instead of a np.float32 copy of the whole image
+    only those 2 rows are kept in floats, and each quantized pixel is written straight into the result.
+
+    The image is usually np.uint8, but it can also be np.float32 in the [0, 255] range (that's how dithering in linear light works,
+    see error_diffusion.py). The result has the same dtype as the image.
+
     Args:
         img (np.typing.NDArray)             : The image array. Must be in the format (H, W, C)
-        availableColors (np.typing.NDArray) : A list containing the colors available. Should start at 0 and 
+        availableColors (np.typing.NDArray) : A sorted list containing the colors available. Should start at 0 and 
                                                 the last element should be 255.
+        out (np.typing.NDArray)             : Where to write the result. Must have the same shape and dtype as img, and it can be img itself.
+                                              By default, a new array is created.
 
     Returns:
-        np.typing.NDArray (np.uint8): The quantized image
+        np.typing.NDArray: The quantized image
+    """
+    dtype = img.dtype
+    if dtype != np.uint8 and dtype != np.float32:
+        img = np.asarray(img, dtype=np.float32)
+
+    result = out
+    if result is None or result.dtype != img.dtype:
+        result = np.empty_like(img)
+
+    # Convert from a numpy array to a C array + size
+    cdef np.ndarray[np.float32_t, ndim=1] colors = np.ascontiguousarray(availableColors, dtype=np.float32)
+    cdef int availableColorsSize   = colors.shape[0]
+    cdef float *availableColorsPtr = &colors[0]
+
+    cdef np.ndarray[np.float32_t, ndim=3] rows = np.empty((img.shape[2], 2, img.shape[1]), dtype=np.float32)
+
+    if img.shape[0] > 0 and img.shape[1] > 0:
+        if img.dtype == np.uint8:
+            ditherChannels[np.uint8_t](img, result, rows, availableColorsPtr, availableColorsSize)
+        else:
+            ditherChannels[np.float32_t](img, result, rows, availableColorsPtr, availableColorsSize)
+
+    if out is not None and result is not out:
+        out[...] = result
+        return out
+
+    return result.astype(dtype, copy=False)
+
+
+def floydSteinbergPalette(np.ndarray[np.uint8_t, ndim=3] img,
+                          np.ndarray[np.uint16_t, ndim=1] nearestIdx,
+                          np.ndarray[np.uint8_t, ndim=2] palette,
+                          np.ndarray[np.uint8_t, ndim=3] out = None):
+    """
+    Floyd-Steinberg dithering with an arbitrary palette of RGB colors, like the combinations of the available colors picked in CIELAB
+    (see quantize.labPalette()). The channels can't be dithered separately anymore, since the nearest color depends on all 3 of them,
+    so this runs through the whole image in a single thread.
+
+    The nearest palette color of a pixel is looked up in nearestIdx, a grid of RGB colors with 2^gridBits cells per channel,
+    so there's no search at all. Just like floydSteinberg(), only the current row and the one below it are kept in floats.
+
+    Args:
+        img (np.typing.NDArray)       : The np.uint8 RGB image in the format (H, W, 3).
+        nearestIdx (np.typing.NDArray): The index of the nearest palette color of each cell of the RGB grid.
+        palette (np.typing.NDArray)   : The (nColors, 3) np.uint8 palette.
+        out (np.typing.NDArray)       : Where to write the result. Must have the same shape as img, and it can be img itself.
+                                        By default, a new array is created.
+
+    Returns:
+        np.typing.NDArray (np.uint8): The dithered image.
     """
     cdef int H = img.shape[0]
     cdef int W = img.shape[1]
-    cdef int C = img.shape[2]
 
-    # The predefined Floyd-Steinberg weights
+    # The grid has the same number of cells in each channel
+    cdef int gridBits = 0
+    while (1 << (3 * gridBits)) < nearestIdx.shape[0]:
+        gridBits += 1
+    cdef int shift = 8 - gridBits
+
     cdef float w0 = 7.0 / 16.0
     cdef float w1 = 3.0 / 16.0
     cdef float w2 = 5.0 / 16.0
     cdef float w3 = 1.0 / 16.0
 
-    # Create a safety copy and convert to float32 because the quantization errors are often non-integer values.
-    cdef np.ndarray[np.float32_t, ndim=3] out = np.copy(img).astype(np.float32)
+    if out is None:
+        out = np.empty_like(img)
+
+    cdef np.ndarray[np.float32_t, ndim=3] rows   = np.empty((2, W, 3), dtype=np.float32)
+    cdef np.ndarray[np.float32_t, ndim=2] colors = np.ascontiguousarray(palette, dtype=np.float32)
+    cdef np.uint16_t *nearestPtr = &nearestIdx[0]
 
-    # I will not be using Python's Global Interpreter Lock (GIL) for the next part,
-    # and not using the GIL requires declaring all the variables that will be
-    # used in the calculation as C variables.
+    cdef int row, column, channel, idx, current, below
     cdef float originalColor, error
-    cdef int row, column, channel
 
-    # Convert from a numpy array to a C array + size
-    cdef int availableColorsSize        = availableColors.shape[0]
-    cdef np.uint8_t *availableColorsPtr = &availableColors[0]
+    if H == 0 or W == 0:
+        return out
+
+    with nogil:
+        for column in range(W):
+            for channel in range(3):
+                rows[0, column, channel] = img[0, column, channel]
 
-    # Running all the channels in parallel in pure C requires not using the Python Global Interpreter Lock
-    for channel in prange(C, nogil=True):
         for row in range(H):
-            for column in range(W):
-                originalColor = out[row, column, channel]
+            current = row & 1
+            below   = 1 - current
 
-                # Quantize the pixel
-                out[row, column, channel] = nearestColor(originalColor, availableColorsPtr, availableColorsSize)
+            if row + 1 < H:
+                for column in range(W):
+                    for channel in range(3):
+                        rows[below, column, channel] = img[row+1, column, channel]
 
-                # Calculate the quantization error (difference between original color and new color)
-                error = originalColor - out[row, column, channel]
+            for column in range(W):
+                idx = nearestPtr[((<int> rows[current, column, 0] >> shift) << (2 * gridBits)) |
+                                 ((<int> rows[current, column, 1] >> shift) << gridBits) |
+                                  (<int> rows[current, column, 2] >> shift)]
+
+                for channel in range(3):
+                    originalColor = rows[current, column, channel]
+                    out[row, column, channel] = palette[idx, channel]
+                    error = originalColor - colors[idx, channel]
 
-                # Distribute the residuals. We clip the values so residuals are always in the [0, 255] range
-                if column + 1 < W:
-                    # Update pixel to the right
-                    out[row, column+1, channel] = clip(out[row, column+1, channel] + error * w0, 0, 255)
-                
-                if row + 1 < H:
-                    # Update pixel below
-                    out[row+1, column, channel] = clip(out[row+1, column, channel] + error * w2, 0, 255)
-                    
-                    if column - 1 >= 0:
-                        # Update pixel below and to the left
-                        out[row+1, column-1, channel] = clip(out[row+1, column-1, channel] + error * w1, 0, 255)
                     if column + 1 < W:
-                        # Update pixel to the right
-                        out[row+1, column+1, channel] = clip(out[row+1, column+1, channel] + error * w3, 0, 255)
-                
-    return out.astype(np.uint8)
+                        rows[current, column+1, channel] = clip(rows[current, column+1, channel] + error * w0, 0, 255)
+
+                    if row + 1 < H:
+                        rows[below, column, channel] = clip(rows[below, column, channel] + error * w2, 0, 255)
+
+                        if column - 1 >= 0:
+                            rows[below, column-1, channel] = clip(rows[below, column-1, channel] + error * w1, 0, 255)
+                        if column + 1 < W:
+                            rows[below, column+1, channel] = clip(rows[below, column+1, channel] + error * w3, 0, 255)
+
+    return out
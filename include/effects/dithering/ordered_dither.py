@@ -1,64 +1,64 @@
+import functools
+
 import numpy as np
 
+import include.effects.color.quantize as quantize
+import include.utils.buffers as buffers
+import include.utils.colormodel as colormodel
 
-def orderedDithering(img: np.typing.NDArray, filterOption: int, availableColors: np.typing.NDArray):
-    """
-    Applies Ordered Dithering (https://en.wikipedia.org/wiki/Ordered_dithering) to the image. 
 
-    Args:
-        img (np.uint8)                       : The image
-        filterOption (int)                   : The bayer kernel to use. 0 = 4x4 kernel, 1 = 8x8 kernel, 2 = 64x64 kernel.
-        availableColors (np.typing.NDArray): The array of available colors.
+# The precalculated threshold maps. These can theoretically be calculated on-the-fly, but it is much easier to just declare them like this.
+threshold2x2 = np.array([
+                [0.00, 0.50],
+                [0.75, 0.25]
+            ])
 
-    Returns:
-        np.uint8: The dithered image
-    """
+threshold4x4 =  np.array([
+                [0.0000, 0.5000, 0.1250, 0.6250],
+                [0.7500, 0.2500, 0.8750, 0.3750],
+                [0.1875, 0.6875, 0.0625, 0.5625],
+                [0.9375, 0.4375, 0.8125, 0.3125]
+            ])
 
-    originalImgShape = img.shape
 
-    img = img.astype(np.float32)
-    img = img / 255
+threshold8x8 =  np.array([
+                [0.000000, 0.500000, 0.125000, 0.625000, 0.031250, 0.531250, 0.156250, 0.656250],
+                [0.750000, 0.250000, 0.875000, 0.375000, 0.781250, 0.281250, 0.906250, 0.406250],
+                [0.187500, 0.687500, 0.062500, 0.562500, 0.218750, 0.718750, 0.093750, 0.593750],
+                [0.937500, 0.437500, 0.812500, 0.312500, 0.968750, 0.468750, 0.843750, 0.343750],
+                [0.046875, 0.546875, 0.171875, 0.671875, 0.015625, 0.515625, 0.140625, 0.640625],
+                [0.796875, 0.296875, 0.921875, 0.421875, 0.765625, 0.265625, 0.890625, 0.390625],
+                [0.234375, 0.734375, 0.109375, 0.609375, 0.203125, 0.703125, 0.078125, 0.578125],
+                [0.984375, 0.484375, 0.859375, 0.359375, 0.953125, 0.453125, 0.828125, 0.328125]
+            ])
+
+thresholdMaps = [threshold2x2, threshold4x4, threshold8x8]
 
-    # The precalculated threshold maps. These can theoretically be calculated on-the-fly, but it is much easier to just declare them like this.
-    threshold2x2 = np.array([
-                    [0.00, 0.50],
-                    [0.75, 0.25]
-                ])
-    
-    threshold4x4 =  np.array([
-                    [0.0000, 0.5000, 0.1250, 0.6250],
-                    [0.7500, 0.2500, 0.8750, 0.3750],
-                    [0.1875, 0.6875, 0.0625, 0.5625],
-                    [0.9375, 0.4375, 0.8125, 0.3125]
-                ])
-
-
-    threshold8x8 =  np.array([
-                    [0.000000, 0.500000, 0.125000, 0.625000, 0.031250, 0.531250, 0.156250, 0.656250],
-                    [0.750000, 0.250000, 0.875000, 0.375000, 0.781250, 0.281250, 0.906250, 0.406250],
-                    [0.187500, 0.687500, 0.062500, 0.562500, 0.218750, 0.718750, 0.093750, 0.593750],
-                    [0.937500, 0.437500, 0.812500, 0.312500, 0.968750, 0.468750, 0.843750, 0.343750],
-                    [0.046875, 0.546875, 0.171875, 0.671875, 0.015625, 0.515625, 0.140625, 0.640625],
-                    [0.796875, 0.296875, 0.921875, 0.421875, 0.765625, 0.265625, 0.890625, 0.390625],
-                    [0.234375, 0.734375, 0.109375, 0.609375, 0.203125, 0.703125, 0.078125, 0.578125],
-                    [0.984375, 0.484375, 0.859375, 0.359375, 0.953125, 0.453125, 0.828125, 0.328125]
-                ])
-
-    # Get the chosen bayer kernel
-    thresholdMap = [threshold2x2, threshold4x4, threshold8x8][filterOption]
+
+def tiledThresholdMap(shape: tuple, filterOption: int) -> np.typing.NDArray:
+    """Repeats the chosen Bayer threshold map so it covers an image with the given (H, W) shape.
+    """
+    thresholdMap = thresholdMaps[filterOption]
 
     # To vectorize with numpy, we repeat the bayer kernel in a tile pattern so it fully covers the image. This way, we can fully take advantage of vectorization to
     # speed up the code.
-    thresholdMap = np.tile(thresholdMap, (img.shape[0] // len(thresholdMap) + 1, img.shape[1] // len(thresholdMap) + 1) )
-    
+    thresholdMap = np.tile(thresholdMap, (shape[0] // len(thresholdMap) + 1, shape[1] // len(thresholdMap) + 1) )
+
     # Sometimes the tiling can make the bayer map larger than the image. To fix that, we simply "crop" the bayer map to the exact dimensions of the image.
-    thresholdMap = thresholdMap[ : img.shape[0], : img.shape[1]]
+    return thresholdMap[ : shape[0], : shape[1]]
+
 
-    # And now we flatten both the image and the bayer map so they are both in the (H * W, C) format.
-    img = img.reshape(-1, img.shape[-1])
-    thresholdMap = thresholdMap.flatten()
+def ditherPixels(pixels: np.typing.NDArray, thresholds: np.typing.NDArray, availableColors: np.typing.NDArray) -> np.typing.NDArray:
+    """Dithers a list of pixels, each one with its own threshold from the Bayer map.
 
+    Args:
+        pixels (np.typing.NDArray)          : The pixels in the format (N, C), with values in the range [0, 1].
+        thresholds (np.typing.NDArray)      : The (N,) thresholds of each pixel.
+        availableColors (np.typing.NDArray) : The array of available colors.
 
+    Returns:
+        np.typing.NDArray: The dithered pixels in the format (N, C).
+    """
     def ditherPixel(originalGrayscale, availableColors, thresholdMap):
         # The index of the new value for each pixel is their original value + the corresponding bayer matrix value in the X, Y coordinate / len(availableColors).
         # Since precalculatedBayer is the same dimension as the image channel, numpy vectorizes this section for us and it runs really fast!
@@ -82,10 +82,202 @@ def orderedDithering(img: np.typing.NDArray, filterOption: int, availableColors:
         return adjustedGrayscale
 
     if len(availableColors) > 2:
-        img = np.stack([ditherPixel(img[:, channel]       , availableColors, thresholdMap) for channel in range(img.shape[-1])], axis=1)
+        return np.stack([ditherPixel(pixels[:, channel]       , availableColors, thresholds) for channel in range(pixels.shape[-1])], axis=1)
     else:
-        img = np.stack([ditherPixel2Colors(img[:, channel], availableColors, thresholdMap) for channel in range(img.shape[-1])], axis=1)
+        return np.stack([ditherPixel2Colors(pixels[:, channel], availableColors, thresholds) for channel in range(pixels.shape[-1])], axis=1)
 
-    
-    # Now we simply return the image to its original shape.
-    return img.reshape(originalImgShape).astype(np.uint8)
\ No newline at end of file
+
+def ditherPixelsLinear(pixels: np.typing.NDArray, thresholds: np.typing.NDArray, availableColors: np.typing.NDArray) -> np.typing.NDArray:
+    """Same as ditherPixels(), but in linear light. Each pixel is dithered between the two available colors around it, and the
+    threshold is compared to where the pixel is between them in linear light. This way, the average brightness of the dithered
+    pattern matches the brightness of the original pixel.
+
+    The available colors are not evenly spaced in linear light, so finding the colors around a pixel would need a binary search.
+    But the pixels are np.uint8, so the lower color and the position between the 2 colors are computed once for each of the
+    256 values, and dithering a pixel is just 2 lookups and a comparison.
+
+    Args:
+        pixels (np.typing.NDArray)          : The np.uint8 pixels in the format (N, C).
+        thresholds (np.typing.NDArray)      : The (N,) thresholds of each pixel.
+        availableColors (np.typing.NDArray) : The sorted array of available colors.
+
+    Returns:
+        np.typing.NDArray: The dithered pixels in the format (N, C).
+    """
+    decode       = colormodel.srgbDecodeTable()
+    linearColors = decode[availableColors]
+
+    # The index of the available color right below each of the 256 values, and how far the value is from it to the next color (from 0 to 1)
+    lowerIdx = np.clip(np.searchsorted(linearColors, decode, "right") - 1, 0, len(availableColors) - 2)
+    position = (decode - linearColors[lowerIdx]) / (linearColors[lowerIdx + 1] - linearColors[lowerIdx])
+
+    colorIdx = lowerIdx[pixels] + (position[pixels] > thresholds.reshape(-1, 1))
+
+    return availableColors[colorIdx]
+
+
+def ditherPixelsLab(pixels: np.typing.NDArray, thresholds: np.typing.NDArray, availableColors: np.typing.NDArray) -> np.typing.NDArray:
+    """Same as ditherPixels(), but the color of each pixel is picked in CIELAB. The threshold pushes the pixel up or down by up to half
+    the distance between two available colors, and then the nearest color in CIELAB is picked with quantize.quantizeLab().
+
+    Args:
+        pixels (np.typing.NDArray)          : The np.uint8 pixels in the format (N, C).
+        thresholds (np.typing.NDArray)      : The (N,) thresholds of each pixel.
+        availableColors (np.typing.NDArray) : The array of available colors.
+
+    Returns:
+        np.typing.NDArray: The dithered pixels in the format (N, C).
+    """
+    step   = np.float32(255 / (len(availableColors) - 1))
+    offset = (thresholds.astype(np.float32) - np.float32(0.5)) * step
+
+    pixels = np.clip(np.rint(pixels + offset.reshape(-1, 1)), 0, 255).astype(np.uint8)
+
+    return quantize.quantizeLab(pixels, availableColors)
+
+
+def orderedDithering(img: np.typing.NDArray, filterOption: int, availableColors: np.typing.NDArray, linear: bool = False, lab: bool = False,
+                     out: np.typing.NDArray = None):
+    """
+    Applies Ordered Dithering (https://en.wikipedia.org/wiki/Ordered_dithering) to the image. 
+
+    Args:
+        img (np.uint8)                       : The image
+        filterOption (int)                   : The bayer kernel to use. 0 = 2x2 kernel, 1 = 4x4 kernel, 2 = 8x8 kernel.
+        availableColors (np.typing.NDArray): The array of available colors.
+        linear (bool)                        : Dithers in linear light. See ditherPixelsLinear().
+        lab (bool)                           : Picks the colors in CIELAB. See ditherPixelsLab().
+        out (np.typing.NDArray)              : Where to write the dithered image. Must be np.uint8 with the same shape as img.
+                                               By default, a new array is created.
+
+    Returns:
+        np.uint8: The dithered image
+    """
+
+    originalImgShape = img.shape
+
+    if linear or lab:
+        thresholdMap = tiledThresholdMap(img.shape, filterOption).flatten()
+        ditherFunction = ditherPixelsLab if lab else ditherPixelsLinear
+        img = ditherFunction(np.asarray(img).reshape(-1, img.shape[-1]), thresholdMap, availableColors)
+
+        return buffers.writeInto(img.reshape(originalImgShape).astype(np.uint8), out)
+
+    if out is None:
+        out = np.empty(originalImgShape, dtype=np.uint8)
+
+    # Every pixel in the same position of the Bayer tile has the same threshold, and the image only has 256 possible values.
+    # So each position of the tile gets a lookup table with the dithered color of each value, and the pixels in that position
+    # (every N-th row and column) are dithered with a single lookup, without any np.float32 copy of the image.
+    tables   = ditheringTables(filterOption, np.asarray(availableColors, dtype=np.uint8).tobytes())
+    tileSize = len(thresholdMaps[filterOption])
+
+    for row in range(tileSize):
+        for column in range(tileSize):
+            buffers.lookup(tables[row, column], img[row::tileSize, column::tileSize], out[row::tileSize, column::tileSize])
+
+    return out
+
+
+@functools.lru_cache(maxsize=16)
+def ditheringTables(filterOption: int, availableColors: bytes) -> np.typing.NDArray:
+    """The lookup tables used by orderedDithering(). Entry [row, column, value] is the color that ditherPixels() gives to a pixel with
+    that np.uint8 value in that position of the Bayer tile, so the result is exactly the same as dithering the whole image with it.
+
+    Args:
+        filterOption (int)     : The bayer kernel to use. 0 = 2x2 kernel, 1 = 4x4 kernel, 2 = 8x8 kernel.
+        availableColors (bytes): The available colors, as the bytes of a np.uint8 array (so they can be cached).
+
+    Returns:
+        np.typing.NDArray (np.uint8): The (N, N, 256) tables.
+    """
+    availableColors = np.frombuffer(availableColors, dtype=np.uint8)
+    thresholdMap    = thresholdMaps[filterOption]
+
+    # Every one of the 256 values, once for each threshold. The values go through exactly the same math as in ditherPixels()
+    values     = np.tile(np.arange(256, dtype=np.float32) / 255, thresholdMap.size).reshape(-1, 1)
+    thresholds = np.repeat(thresholdMap.flatten(), 256)
+
+    tables = ditherPixels(values, thresholds, availableColors).astype(np.uint8).reshape(thresholdMap.shape + (256,))
+
+    tables.flags.writeable = False
+
+    return tables
+
+
+class TemporalOrderedDithering:
+    """
+    Ordered dithering for animations. Ordered dithering doesn't carry errors from one pixel to the next, so a pixel that
+    has the same color in two frames is dithered exactly the same way. The problem is that videos and GIFs are rarely that clean:
+    compression noise changes the colors by a tiny bit in every frame, and the pixels that are close to a threshold keep
+    flipping between two colors. That's the flicker.
+
+    This class remembers the color each pixel had the last time it was dithered. In the next frame, only the pixels
+    whose color moved by more than 'tolerance' are dithered again, and all the other ones keep their previous output.
+    Besides removing the flicker, that means most of the frame doesn't have to be quantized from scratch.
+    """
+
+    def __init__(self, filterOption: int, availableColors: np.typing.NDArray, tolerance: int, linear: bool = False, lab: bool = False):
+        """
+        Args:
+            filterOption (int)                  : The bayer kernel to use. 0 = 2x2 kernel, 1 = 4x4 kernel, 2 = 8x8 kernel.
+            availableColors (np.typing.NDArray) : The array of available colors.
+            tolerance (int)                     : By how much (in the range [0, 255]) a pixel can change before it is dithered again.
+            linear (bool)                       : Dithers in linear light. See ditherPixelsLinear().
+            lab (bool)                          : Picks the colors in CIELAB. See ditherPixelsLab().
+        """
+        self.filterOption    = filterOption
+        self.availableColors = availableColors
+        self.tolerance       = tolerance
+        self.linear          = linear
+        self.lab             = lab
+
+        self.reference    = None
+        self.output       = None
+        self.thresholdMap = None
+
+    def dither(self, img: np.typing.NDArray, out: np.typing.NDArray = None) -> np.typing.NDArray:
+        """Dithers the next frame of the animation.
+
+        Args:
+            img (np.typing.NDArray): The frame. Must be np.uint8 in the format (H, W, C).
+            out (np.typing.NDArray): Where to write the dithered frame. By default, a new array is created.
+
+        Returns:
+            np.typing.NDArray (np.uint8): The dithered frame.
+        """
+        # The first frame (or a frame with a different size) is dithered from scratch
+        if self.reference is None or self.reference.shape != img.shape:
+            self.reference    = np.array(img, dtype=np.uint8)
+            self.output       = orderedDithering(img, self.filterOption, self.availableColors, self.linear, self.lab)
+            self.thresholdMap = tiledThresholdMap(img.shape, self.filterOption)
+
+            return self.result(out)
+
+        difference = np.abs(img.astype(np.int16) - self.reference.astype(np.int16))
+        changed    = np.any(difference > self.tolerance, axis=-1)
+
+        if changed.any():
+            if self.lab:
+                self.output[changed] = ditherPixelsLab(img[changed], self.thresholdMap[changed], self.availableColors)
+            elif self.linear:
+                self.output[changed] = ditherPixelsLinear(img[changed], self.thresholdMap[changed], self.availableColors).astype(np.uint8)
+            else:
+                pixels = img[changed].astype(np.float32) / 255
+                self.output[changed] = ditherPixels(pixels, self.thresholdMap[changed], self.availableColors).astype(np.uint8)
+
+            # The reference is the color the pixel had when it was dithered, not the color in the previous frame.
+            # Otherwise, a slow fade that changes less than 'tolerance' per frame would never be dithered again.
+            self.reference[changed] = img[changed]
+
+        return self.result(out)
+
+    def result(self, out: np.typing.NDArray = None) -> np.typing.NDArray:
+        """A copy of the dithered frame. The frame itself is kept for the next call to dither(), so it can't be handed out.
+        """
+        if out is None:
+            return self.output.copy()
+
+        out[...] = self.output
+
+        return out
@@ -0,0 +1,237 @@
+import numpy as np
+
+import include.effects.blur.blur as blur
+import include.effects.edge_detection.gradients as gradients
+import include.utils.backends as backends
+import include.utils.convolve2d as convolve2d
+import include.utils.kernels as kernels
+
+
+# The boundaries between the 4 directions of the non-maximum suppression, 22.5 and 67.5 degrees
+tan22 = np.float32(np.tan(np.deg2rad(22.5)))
+tan67 = np.float32(np.tan(np.deg2rad(67.5)))
+
+
+def canny(img: np.typing.NDArray, edgeColor: int, lowThreshold: float = 0.1, highThreshold: float = 0.2, sigma: float = 1.4,
+          out: np.typing.NDArray = None) -> np.typing.NDArray:
+    """
+    Implements Canny edge detection https://en.wikipedia.org/wiki/Canny_edge_detector.
+
+    Works only with grayscale images. If the input image is RGB, the function automatically converts it
+    to grayscale.
+
+    Args:
+        img (np.typing.NDArray): The image.
+
+        edgeColor (int) : The HSV color to use to color the edges. -2 = White edges, -1 = Uses the edge direction
+        in an HSV color wheel (https://i.sstatic.net/UyDZ8.jpg) to automatically get the edge color.
+        Any other number will use the same HSV color wheel to choose a color and then color all
+        edges with that color.
+
+        lowThreshold (float) : Weak edges have a gradient above this fraction of the strongest gradient in the image.
+        highThreshold (float): Strong edges have a gradient of at least this fraction of the strongest gradient in the image.
+        sigma (float)        : The sigma of the Gaussian blur that removes noise before detecting the edges. 0 disables the blur.
+        out (np.typing.NDArray): Where to write the result. Must be np.uint8 in the format (H, W, 3). By default, a new array is created.
+
+    Returns:
+        np.typing.NDArray: The image with the detected edges in RGB format.
+    """
+    edges, blurred = cannyEdges(img, lowThreshold, highThreshold, sigma)
+
+    # Every edge has the same strength, so the color only depends on the direction of the gradient
+    table = gradients.edgeColorTable(edgeColor)
+
+    # White edges, or edges that all have the same color
+    if edgeColor != -1:
+        return np.multiply(edges[..., np.newaxis], table[0], out=out)
+
+    return backends.dispatch("edgeColors", edges, blurred, table, out)
+
+
+def cannyEdges(img: np.typing.NDArray, lowThreshold: float, highThreshold: float, sigma: float):
+    """
+    Finds the edges with Canny edge detection. This is the part of canny() that doesn't color the edges.
+
+    The steps are:
+        1. Blur the image to remove noise.
+        2. Compute the gradient with the Sobel kernels (the same gradient used by sobel.sobel()).
+        3. Non-maximum suppression: only keep the pixels whose gradient is larger than both neighbours along the
+           gradient direction. This makes the edges 1 pixel thick.
+        4. Hysteresis: keep the strong edges, and the weak edges that are connected to a strong edge.
+
+    Every step runs in parallel: the blur is split into tiles (see convolve2d.convolveSeparable()), steps 2 and 3 are done together
+    in two passes over the rows (see suppression.pyx), and the hysteresis fills horizontal stripes of the image (see hysteresis.pyx).
+    The direction of the gradient isn't needed by any of them, so it's only computed by canny(), and only on the edge pixels.
+    Even on a single core, a 24 MP photo takes around 0.8 seconds, and around 1 second with canny() coloring the edges.
+
+    Args:
+        img (np.typing.NDArray): The image.
+        lowThreshold (float)   : Weak edges have a gradient above this fraction of the strongest gradient in the image.
+        highThreshold (float)  : Strong edges have a gradient of at least this fraction of the strongest gradient in the image.
+        sigma (float)          : The sigma of the Gaussian blur. 0 disables the blur.
+
+    Returns:
+        tuple: (edges, blurred). edges is a (H, W) np.uint8 array with 1 on the edges and 0 everywhere else,
+        and blurred is the (H, W) np.float32 grayscale image the gradient was computed from.
+    """
+    img = gradients.toGrayscale(img)
+
+    if sigma > 0:
+        img = blur.gaussianFilter(np.expand_dims(img, axis=2), sigma)[..., 0]
+
+    suppressed = backends.dispatch("nonMaximumSuppression", img)
+
+    # A completely flat image has no edges
+    maxGradient = suppressed.max()
+    if maxGradient == 0:
+        return np.zeros(suppressed.shape, dtype=np.uint8), img
+
+    edges = backends.dispatch("hysteresis", suppressed, np.float32(lowThreshold * maxGradient), np.float32(highThreshold * maxGradient))
+
+    return edges, img
+
+
+def gradientDirectionIdx(horizontalGradients: np.typing.NDArray, verticalGradients: np.typing.NDArray) -> np.typing.NDArray:
+    """
+    Rounds the direction of the gradient (the same angle as in gradients.computeGradients()) to the closest multiple of 45 degrees.
+    Opposite directions are the same, so there are only 4 of them: 0 = 0, 1 = 45, 2 = 90 and 3 = 135 degrees.
+
+    Instead of computing the angle with atan2(), the two gradients are compared with tan(22.5) and tan(67.5), which
+    gives the same result and is a lot cheaper.
+
+    Args:
+        horizontalGradients (np.typing.NDArray): The np.float32 gradients from the kernel that detects horizontal edges.
+        verticalGradients (np.typing.NDArray)  : The np.float32 gradients from the kernel that detects vertical edges.
+
+    Returns:
+        np.typing.NDArray (np.uint8): The index of the direction.
+    """
+    absHorizontal = np.abs(horizontalGradients)
+    absVertical   = np.abs(verticalGradients)
+
+    # 45 degrees when both gradients have the same sign, and 135 degrees when they don't
+    directionIdx = np.where((horizontalGradients > 0) == (verticalGradients > 0), 1, 3).astype(np.uint8)
+    directionIdx[absHorizontal >  tan67 * absVertical] = 2
+    directionIdx[absHorizontal <= tan22 * absVertical] = 0
+
+    return directionIdx
+
+
+def nonMaximumSuppressionNumpy(img: np.typing.NDArray) -> np.typing.NDArray:
+    """
+    The reference implementation of the Sobel gradient + non-maximum suppression in suppression.pyx. Thins the edges by
+    setting to zero every pixel that isn't a local maximum along the direction of the gradient.
+
+    The direction is rounded to one of 4 directions (0, 45, 90 and 135 degrees), and each pixel is compared to its
+    2 neighbours in that direction. Instead of looping over the pixels, we compare the whole image to shifted views of itself,
+    once for each direction, and pick the right comparison for each pixel with a mask.
+
+    Args:
+        img (np.typing.NDArray): The (H, W) np.float32 grayscale image.
+
+    Returns:
+        np.typing.NDArray: The gradient magnitude, with zeros where the pixel is not a local maximum.
+    """
+    horizontalGradients = convolve2d.convolve2d(img, kernels.sobelHorizontal3x3, "edge").astype(np.float32)
+    verticalGradients   = convolve2d.convolve2d(img, kernels.sobelVertical3x3,   "edge").astype(np.float32)
+
+    gradient     = np.sqrt(horizontalGradients**2 + verticalGradients**2)
+    directionIdx = gradientDirectionIdx(horizontalGradients, verticalGradients)
+
+    H, W = gradient.shape
+
+    padded = np.pad(gradient, 1, mode="constant")
+
+    def shifted(rowOffset, columnOffset):
+        return padded[1 + rowOffset : 1 + rowOffset + H, 1 + columnOffset : 1 + columnOffset + W]
+
+    # The neighbours along each direction. Rows grow downwards, so 45 degrees goes down and to the right.
+    neighbourOffsets = [((0, 1), (0, -1)), ((1, 1), (-1, -1)), ((1, 0), (-1, 0)), ((1, -1), (-1, 1))]
+
+    isMaximum = np.zeros((H, W), dtype=bool)
+    for direction, (forward, backward) in enumerate(neighbourOffsets):
+        # Using > on one side and >= on the other keeps exactly one pixel on flat ridges
+        isMaximumHere = (gradient > shifted(*forward)) & (gradient >= shifted(*backward))
+        isMaximum    |= isMaximumHere & (directionIdx == direction)
+
+    return np.where(isMaximum, gradient, 0).astype(np.float32)
+
+
+def edgeColorsNumpy(edges: np.typing.NDArray, img: np.typing.NDArray, table: np.typing.NDArray, out: np.typing.NDArray = None) -> np.typing.NDArray:
+    """
+    The reference implementation of the coloring in edge_colors.pyx. Colors the edges by the direction of their Sobel gradient.
+
+    The direction is only computed on the edge pixels, with the same "edge" padding as the convolutions, and it's rounded
+    to the closest entry of the table. The pixels that aren't edges are black.
+
+    Args:
+        edges (np.typing.NDArray): The (H, W) np.uint8 edge map. Anything other than 0 is an edge.
+        img (np.typing.NDArray)  : The (H, W) np.float32 image the edges were detected on.
+        table (np.typing.NDArray): The (N, 3) np.uint8 colors of N evenly spaced directions. See gradients.edgeColorTable().
+        out (np.typing.NDArray)  : Where to write the result. Must be np.uint8 in the format (H, W, 3). By default, a new array is created.
+
+    Returns:
+        np.typing.NDArray (np.uint8): The edges in RGB format.
+    """
+    H, W = edges.shape
+
+    if out is None:
+        out = np.empty((H, W, 3), dtype=np.uint8)
+    out[...] = 0
+
+    rows, columns = np.nonzero(edges)
+
+    # The gradient of the edge pixels. The sums are done in double precision, like in convolve2d.convolve2dNumpy()
+    horizontalGradients = np.zeros(len(rows), dtype=np.float64)
+    verticalGradients   = np.zeros(len(rows), dtype=np.float64)
+    for rowOffset in range(-1, 2):
+        neighbourRows = np.clip(rows + rowOffset, 0, H - 1)
+
+        for columnOffset in range(-1, 2):
+            neighbours = img[neighbourRows, np.clip(columns + columnOffset, 0, W - 1)].astype(np.float64)
+
+            horizontalGradients += kernels.sobelHorizontal3x3[rowOffset + 1, columnOffset + 1] * neighbours
+            verticalGradients   += kernels.sobelVertical3x3[rowOffset + 1, columnOffset + 1]   * neighbours
+
+    # The same direction as gradients.computeGradients(), rounded to the closest entry of the table
+    gradientDirection = np.rad2deg(np.atan2(horizontalGradients.astype(np.float32), verticalGradients.astype(np.float32)))
+    directionIdx      = np.rint(gradientDirection * np.float32(len(table) / 360)).astype(np.intp) % len(table)
+
+    out[rows, columns] = table[directionIdx]
+
+    return out
+
+
+def hysteresisNumpy(gradient: np.typing.NDArray, lowThreshold: float, highThreshold: float) -> np.typing.NDArray:
+    """
+    The reference implementation of the hysteresis in hysteresis.pyx. The strong edges keep growing by 1 pixel
+    into the weak edges until they stop changing, which takes as many iterations as the longest weak edge, so this
+    is only usable on small images.
+
+    Args:
+        gradient (np.typing.NDArray): The (H, W) gradient magnitude, after non-maximum suppression.
+        lowThreshold (float)        : The threshold for weak edges.
+        highThreshold (float)       : The threshold for strong edges.
+
+    Returns:
+        np.typing.NDArray (np.uint8): 1 where there is an edge and 0 everywhere else.
+    """
+    H, W = gradient.shape
+
+    weak  = gradient > lowThreshold
+    edges = gradient >= highThreshold
+
+    while True:
+        padded = np.pad(edges, 1, mode="constant")
+
+        # Grow the edges by 1 pixel in every direction (a 3x3 dilation)
+        grown = np.zeros_like(edges)
+        for rowOffset in range(3):
+            for columnOffset in range(3):
+                grown |= padded[rowOffset : rowOffset + H, columnOffset : columnOffset + W]
+
+        grown &= weak
+        if np.array_equal(grown, edges):
+            return edges.astype(np.uint8)
+
+        edges = grown
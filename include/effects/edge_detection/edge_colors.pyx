@@ -0,0 +1,84 @@
+# cython: boundscheck=False, wraparound=False, nonecheck=False, cdivision=True
+import numpy as np
+cimport numpy as np
+
+from cython.parallel import prange
+from libc.math cimport atan2f, rintf
+from libc.string cimport memcpy, memset
+
+
+def edgeColors(np.ndarray[np.uint8_t, ndim=2] edges, np.ndarray[np.float32_t, ndim=2] img, np.ndarray[np.uint8_t, ndim=2] table,
+               np.ndarray out=None):
+    """
+    Colors the edges by the direction of their Sobel gradient, looking the colors up in a table of evenly spaced directions.
+    The direction is only computed on the edge pixels, which are usually a few percent of the image, and the rows are colored
+    in parallel.
+
+    Args:
+        edges (np.typing.NDArray): The (H, W) np.uint8 edge map. Anything other than 0 is an edge.
+        img (np.typing.NDArray)  : The (H, W) np.float32 image the edges were detected on.
+        table (np.typing.NDArray): The (N, 3) np.uint8 colors of N evenly spaced directions. See gradients.edgeColorTable().
+        out (np.typing.NDArray)  : Where to write the result. Must be np.uint8 in the format (H, W, 3). By default, a new array is created.
+
+    Returns:
+        np.typing.NDArray (np.uint8): The edges in RGB format.
+    """
+    cdef np.ndarray[np.uint8_t,   ndim=2] edgeSrc  = np.ascontiguousarray(edges)
+    cdef np.ndarray[np.float32_t, ndim=2] src      = np.ascontiguousarray(img)
+    cdef np.ndarray[np.uint8_t,   ndim=2] colors   = np.ascontiguousarray(table)
+
+    cdef Py_ssize_t H = edgeSrc.shape[0]
+    cdef Py_ssize_t W = edgeSrc.shape[1]
+    cdef int N        = colors.shape[0]
+
+    # The rows are written straight into 'out', unless it isn't contiguous
+    cdef bint intoOut = out is not None and out.flags.c_contiguous
+    cdef np.ndarray[np.uint8_t, ndim=3] dst = out if intoOut else np.empty((H, W, 3), dtype=np.uint8)
+
+    if H == 0 or W == 0:
+        return dst
+
+    cdef np.uint8_t *edgePtr  = &edgeSrc[0, 0]
+    cdef float *srcPtr        = &src[0, 0]
+    cdef np.uint8_t *tablePtr = &colors[0, 0]
+    cdef np.uint8_t *outPtr   = &dst[0, 0, 0]
+
+    # The same conversions as np.rad2deg() and the rounding to the closest entry in canny.edgeColorsNumpy()
+    cdef float toDegrees = <float> (180.0 / np.pi)
+    cdef float toEntries = <float> (N / 360.0)
+
+    cdef Py_ssize_t row, column, left, right
+    cdef float *up
+    cdef float *middle
+    cdef float *down
+    cdef float horizontal, vertical
+    cdef int entry
+
+    for row in prange(H, nogil=True):
+        memset(outPtr + row * W * 3, 0, W * 3)
+
+        up     = srcPtr + (row - 1 if row > 0 else 0) * W
+        middle = srcPtr + row * W
+        down   = srcPtr + (row + 1 if row < H - 1 else H - 1) * W
+
+        for column in range(W):
+            if edgePtr[row * W + column] == 0:
+                continue
+
+            # The neighbours outside the image repeat the border, like np.pad(mode="edge")
+            left  = column - 1 if column > 0 else 0
+            right = column + 1 if column < W - 1 else W - 1
+
+            horizontal = <float> (<double> up[left] + 2.0 * up[column] + up[right] - down[left] - 2.0 * down[column] - down[right])
+            vertical   = <float> (<double> up[left] - up[right] + 2.0 * middle[left] - 2.0 * middle[right] + down[left] - down[right])
+
+            entry = <int> rintf(atan2f(horizontal, vertical) * toDegrees * toEntries)
+            entry = ((entry % N) + N) % N
+
+            memcpy(outPtr + (row * W + column) * 3, tablePtr + entry * 3, 3)
+
+    if out is not None and not intoOut:
+        out[...] = dst
+        return out
+
+    return dst
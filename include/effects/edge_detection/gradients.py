@@ -0,0 +1,108 @@
+"""
+Gradients.py has the parts that are shared by all the edge detection algorithms: computing the image gradient
+with a pair of kernels, and coloring the detected edges.
+"""
+
+import functools
+
+import numpy as np
+import warnings
+
+import include.utils.colormodel as colormodel
+import include.utils.convolve2d as convolve2d
+
+
+def toGrayscale(img: np.typing.NDArray) -> np.typing.NDArray:
+    """Prepares the image for edge detection: converts it to grayscale if needed, removes the fake 'channel'
+    dimension and casts it to np.float32.
+    """
+    # If it's not a grayscale image
+    if img.shape[2] != 1:
+        warnings.warn("Cannot do edge detection on an RGB image! Automatically converting to grayscale...\n"\
+              "Expect weird results, especially if the image is quantized, because now the edge detection "\
+              "will mark the color banding artifacts as edges! Consider using the -g option.")
+        img = colormodel.rgb2grayscale(img)
+
+    # Remove the fake 'channel' dimension
+    img = img.squeeze(axis=2)
+
+    # Directly cast to float32
+    return img.astype(np.float32)
+
+
+def computeGradients(img: np.typing.NDArray, horizontalKernel: np.typing.NDArray, verticalKernel: np.typing.NDArray):
+    """Computes the gradient of a grayscale image with a pair of kernels (Sobel, Prewitt, ...).
+
+    Args:
+        img (np.typing.NDArray)             : The (H, W) np.float32 grayscale image.
+        horizontalKernel (np.typing.NDArray): The kernel that detects horizontal edges.
+        verticalKernel (np.typing.NDArray)  : The kernel that detects vertical edges.
+
+    Returns:
+        tuple: (gradient, gradientDirection). gradient is the magnitude of the gradient and gradientDirection
+        is its direction in degrees, in the [0, 360) range.
+    """
+    # Calculate edges
+    horizontalGradients = convolve2d.convolve2d(img, horizontalKernel, "edge")
+    verticalGradients   = convolve2d.convolve2d(img, verticalKernel,   "edge")
+
+    # Combine horizontal and vertical edges
+    gradient = np.sqrt((horizontalGradients**2) + (verticalGradients**2))
+
+    # Treat the horizontal and vertical gradients as a right triangle and use the arctangent
+    # of both gradients to get the direction for the edges.
+    gradientDirection = np.atan2(horizontalGradients, verticalGradients)
+    # Convert from radians to degrees
+    gradientDirection = np.rad2deg(gradientDirection) % 360
+
+    return gradient, gradientDirection
+
+
+def colorEdges(gradient: np.typing.NDArray, gradientDirection: np.typing.NDArray, edgeColor: int, out: np.typing.NDArray = None) -> np.typing.NDArray:
+    """Colors the edges using an HSV color wheel.
+
+    Args:
+        gradient (np.typing.NDArray)         : The edge strength of every pixel, in the range [0, 1].
+        gradientDirection (np.typing.NDArray): The direction of the gradient in degrees.
+        edgeColor (int)                      : -2 = White edges, -1 = Uses the edge direction in an HSV color wheel
+                                               (https://i.sstatic.net/UyDZ8.jpg) to automatically get the edge color.
+                                               Any other number will use the same HSV color wheel to choose a color and then
+                                               color all edges with that color.
+        out (np.typing.NDArray)              : Where to write the result. Must be np.uint8 in the format (H, W, 3). By default, a new array is created.
+
+    Returns:
+        np.typing.NDArray: The edges in RGB format.
+    """
+    if edgeColor == -2:
+        img = np.stack([gradientDirection                         , np.full_like(gradientDirection, 0.0), gradient], axis=2)
+    elif edgeColor == -1:
+        img = np.stack([gradientDirection                         , np.full_like(gradientDirection, 0.8), gradient], axis=2)
+    else:
+        img = np.stack([np.full_like(gradientDirection, edgeColor), np.full_like(gradientDirection, 0.8), gradient], axis=2)
+
+    return colormodel.hsv2rgb(img, out)
+
+
+
+# How many entries the direction -> color table of edgeColorTable() has. 10 per degree, so the hue is never more than
+# 0.05 degrees away from the exact direction, which is well below a single step of a np.uint8 color.
+directionTableSize = 3600
+
+
+@functools.lru_cache(maxsize=None)
+def edgeColorTable(edgeColor: int) -> np.typing.NDArray:
+    """The RGB color of an edge pixel for every direction, in steps of 360 / directionTableSize degrees. When every edge has the
+    same strength (like in Canny), the color only depends on the direction, so looking it up here is a lot cheaper than
+    converting the whole image from HSV. The colors come from colorEdges(), so they are the same ones that sobel() and prewitt()
+    give to their strongest edges.
+
+    Args:
+        edgeColor (int): The edge color. See colorEdges().
+
+    Returns:
+        np.typing.NDArray (np.uint8): The (directionTableSize, 3) table.
+    """
+    directions = np.arange(directionTableSize, dtype=np.float32)[:, np.newaxis] * np.float32(360 / directionTableSize)
+
+    return colorEdges(np.ones_like(directions), directions, edgeColor)[:, 0]
+
@@ -0,0 +1,158 @@
+# cython: boundscheck=False, wraparound=False, nonecheck=False, cdivision=True
+import numpy as np
+cimport numpy as np
+
+import os
+
+from cython.parallel import prange
+from libc.stdlib cimport malloc, free
+
+
+# Spreads the edges from the pixels in the stack to the weak pixels connected to them, without leaving the rows [startRow, endRow).
+# Returns how many pixels became edges.
+cdef Py_ssize_t fill(float *gradientPtr, np.uint8_t *edgePtr, unsigned int *stack, Py_ssize_t stackSize, Py_ssize_t W,
+                     Py_ssize_t startRow, Py_ssize_t endRow, float lowThreshold) noexcept nogil:
+    cdef Py_ssize_t marked = 0
+    cdef Py_ssize_t pixel, row, column, neighbourRow, neighbourColumn, neighbour
+    cdef int rowOffset, columnOffset
+
+    while stackSize > 0:
+        stackSize -= 1
+        pixel  = stack[stackSize]
+        row    = pixel // W
+        column = pixel % W
+
+        for rowOffset in range(-1, 2):
+            neighbourRow = row + rowOffset
+            if neighbourRow < startRow or neighbourRow >= endRow:
+                continue
+
+            for columnOffset in range(-1, 2):
+                neighbourColumn = column + columnOffset
+                if neighbourColumn < 0 or neighbourColumn >= W:
+                    continue
+
+                neighbour = neighbourRow * W + neighbourColumn
+                if edgePtr[neighbour] == 0 and gradientPtr[neighbour] > lowThreshold:
+                    edgePtr[neighbour] = 1
+                    stack[stackSize] = <unsigned int> neighbour
+                    stackSize += 1
+                    marked    += 1
+
+    return marked
+
+
+# Finds the edges of the rows [startRow, endRow). The first time, the fill starts from every strong pixel of the stripe. After that,
+# it only starts from the weak pixels of the first and last rows that touch an edge in the stripe above or below.
+# Returns how many pixels became edges.
+cdef Py_ssize_t fillStripe(float *gradientPtr, np.uint8_t *edgePtr, unsigned int *stack, Py_ssize_t H, Py_ssize_t W,
+                           Py_ssize_t startRow, Py_ssize_t endRow, float lowThreshold, float highThreshold, bint firstRound) noexcept nogil:
+    cdef Py_ssize_t marked = 0
+    cdef Py_ssize_t start, row, outsideRow, column, neighbourColumn
+    cdef int side, columnOffset
+
+    if firstRound:
+        for start in range(startRow * W, endRow * W):
+            if edgePtr[start] or gradientPtr[start] < highThreshold:
+                continue
+
+            edgePtr[start] = 1
+            stack[0] = <unsigned int> start
+            marked  += 1 + fill(gradientPtr, edgePtr, stack, 1, W, startRow, endRow, lowThreshold)
+
+    for side in range(2):
+        row        = startRow   if side == 0 else endRow - 1
+        outsideRow = startRow - 1 if side == 0 else endRow
+        if outsideRow < 0 or outsideRow >= H:
+            continue
+
+        for column in range(W):
+            start = row * W + column
+            if edgePtr[start] or not gradientPtr[start] > lowThreshold:
+                continue
+
+            for columnOffset in range(-1, 2):
+                neighbourColumn = column + columnOffset
+                if neighbourColumn >= 0 and neighbourColumn < W and edgePtr[outsideRow * W + neighbourColumn]:
+                    edgePtr[start] = 1
+                    stack[0] = <unsigned int> start
+                    marked  += 1 + fill(gradientPtr, edgePtr, stack, 1, W, startRow, endRow, lowThreshold)
+                    break
+
+    return marked
+
+
+def hysteresis(np.ndarray[np.float32_t, ndim=2] gradient, float lowThreshold, float highThreshold):
+    """
+    Hysteresis thresholding for Canny edge detection (https://en.wikipedia.org/wiki/Canny_edge_detector#Edge_tracking_by_hysteresis).
+
+    Every pixel with a gradient of at least highThreshold is an edge. Pixels with a gradient above lowThreshold are only edges if they
+    are connected (with 8-connectivity) to one of those strong edges. This is a flood fill that starts from every strong pixel and
+    spreads through the weak pixels.
+
+    To run it in parallel, the image is split into horizontal stripes, and every stripe is filled on its own. Then the edges that reach
+    the border of a stripe are carried over to the stripes above and below, which keep filling from there, until nothing changes.
+    The stripes next to each other never run at the same time, so a stripe can safely read the rows of its neighbours.
+    Each pixel is pushed to the stack at most once, so it is O(H * W), plus a pass over the borders of the stripes every round.
+
+    The comparison with lowThreshold is strict, so the zeros left by the non-maximum suppression are never weak edges,
+    even with lowThreshold = 0.
+
+    Args:
+        gradient (np.typing.NDArray): The (H, W) np.float32 gradient magnitude, after non-maximum suppression.
+        lowThreshold (float)        : The threshold for weak edges.
+        highThreshold (float)       : The threshold for strong edges.
+
+    Returns:
+        np.typing.NDArray (np.uint8): 1 where there is an edge and 0 everywhere else.
+    """
+    cdef np.ndarray[np.float32_t, ndim=2] src = np.ascontiguousarray(gradient)
+    cdef Py_ssize_t H = src.shape[0]
+    cdef Py_ssize_t W = src.shape[1]
+
+    cdef np.ndarray[np.uint8_t, ndim=2] edges = np.zeros((H, W), dtype=np.uint8)
+
+    if H == 0 or W == 0:
+        return edges
+
+    cdef float *gradientPtr  = &src[0, 0]
+    cdef np.uint8_t *edgePtr = &edges[0, 0]
+
+    # The pixel indices are stored as 32-bit integers to keep the stack small
+    if H * W >= 2**32:
+        raise ValueError("The image is too large for hysteresis thresholding")
+
+    # The stacks of pixels whose neighbours still have to be checked. Every stripe uses the part of it that matches its rows.
+    cdef unsigned int *stack = <unsigned int *> malloc(H * W * sizeof(unsigned int))
+    if stack == NULL:
+        raise MemoryError()
+
+    # About 4 stripes per core, so they are evenly spread, but not too thin, so fewer edges cross from one stripe to the next
+    cdef Py_ssize_t nCores       = os.cpu_count()
+    cdef Py_ssize_t stripeHeight = max(64, (H + 4 * nCores - 1) // (4 * nCores))
+    cdef Py_ssize_t nStripes     = (H + stripeHeight - 1) // stripeHeight
+    cdef Py_ssize_t task, stripe, startRow, endRow, marked
+    cdef int parity
+    cdef bint firstRound = True
+
+    with nogil:
+        while True:
+            marked = 0
+
+            # First the even stripes and then the odd ones
+            for parity in range(2):
+                for task in prange((nStripes - parity + 1) // 2, schedule="dynamic"):
+                    stripe   = 2 * task + parity
+                    startRow = stripe * stripeHeight
+                    endRow   = min(startRow + stripeHeight, H)
+                    marked  += fillStripe(gradientPtr, edgePtr, stack + startRow * W, H, W, startRow, endRow,
+                                          lowThreshold, highThreshold, firstRound)
+
+            if marked == 0 and not firstRound:
+                break
+
+            firstRound = False
+
+    free(stack)
+
+    return edges
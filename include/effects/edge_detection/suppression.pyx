@@ -0,0 +1,121 @@
+# cython: boundscheck=False, wraparound=False, nonecheck=False, cdivision=True
+import numpy as np
+cimport numpy as np
+
+from cython.parallel import prange
+from libc.math cimport sqrtf
+
+
+# The boundaries between the 4 directions of the non-maximum suppression (22.5 and 67.5 degrees). Comparing the gradients with
+# these is the same as rounding the angle to the closest multiple of 45 degrees, without computing the angle.
+cdef float tan22 = 0.41421356237309503
+cdef float tan67 = 2.414213562373095
+
+
+# The Sobel gradient of one pixel, given its 3 rows and the columns to its left and right (which repeat the border column
+# at the edges of the image). Writes the magnitude and which of the 4 directions it is closest to (see canny.gradientDirectionIdx()).
+cdef inline void sobelAt(float *up, float *middle, float *down, Py_ssize_t left, Py_ssize_t column, Py_ssize_t right,
+                         float *magnitude, np.uint8_t *direction) noexcept nogil:
+    # The sums are done in double precision and then rounded, like the dot product in convolve2d.convolve2dNumpy()
+    cdef float horizontal = <float> (<double> up[left] + 2.0 * up[column] + up[right] - down[left] - 2.0 * down[column] - down[right])
+    cdef float vertical   = <float> (<double> up[left] - up[right] + 2.0 * middle[left] - 2.0 * middle[right] + down[left] - down[right])
+    cdef float absHorizontal = horizontal if horizontal >= 0 else -horizontal
+    cdef float absVertical   = vertical   if vertical   >= 0 else -vertical
+
+    magnitude[column] = sqrtf(horizontal * horizontal + vertical * vertical)
+
+    if absHorizontal <= tan22 * absVertical:
+        direction[column] = 0
+    elif absHorizontal > tan67 * absVertical:
+        direction[column] = 2
+    elif (horizontal > 0) == (vertical > 0):
+        direction[column] = 1
+    else:
+        direction[column] = 3
+
+
+# The gradient magnitude of a pixel, or 0 outside the image
+cdef inline float magnitudeAt(float *magnitude, Py_ssize_t H, Py_ssize_t W, Py_ssize_t row, Py_ssize_t column) noexcept nogil:
+    if row < 0 or row >= H or column < 0 or column >= W:
+        return 0
+
+    return magnitude[row * W + column]
+
+
+def nonMaximumSuppression(np.ndarray[np.float32_t, ndim=2] img):
+    """
+    The Sobel gradient and the non-maximum suppression of Canny edge detection in two passes over the image, instead of the
+    dozen full size temporaries of canny.nonMaximumSuppressionNumpy(). There's no atan2() either: the direction is rounded to
+    one of the 4 directions by comparing the two gradients with tan(22.5) and tan(67.5).
+
+    Every row only depends on the rows around it, so both passes run in parallel, one row at a time.
+
+    Args:
+        img (np.typing.NDArray): The (H, W) np.float32 grayscale image, usually already blurred.
+
+    Returns:
+        np.typing.NDArray (np.float32): The gradient magnitude, with zeros where the pixel is not a local maximum along
+        the direction of the gradient.
+    """
+    cdef np.ndarray[np.float32_t, ndim=2] src = np.ascontiguousarray(img)
+    cdef Py_ssize_t H = src.shape[0]
+    cdef Py_ssize_t W = src.shape[1]
+
+    cdef np.ndarray[np.float32_t, ndim=2] magnitude  = np.empty((H, W), dtype=np.float32)
+    cdef np.ndarray[np.uint8_t,   ndim=2] direction  = np.empty((H, W), dtype=np.uint8)
+    cdef np.ndarray[np.float32_t, ndim=2] suppressed = np.empty((H, W), dtype=np.float32)
+
+    if H == 0 or W == 0:
+        return suppressed
+
+    cdef float *srcPtr        = &src[0, 0]
+    cdef float *magnitudePtr  = &magnitude[0, 0]
+    cdef np.uint8_t *directionPtr = &direction[0, 0]
+    cdef float *suppressedPtr = &suppressed[0, 0]
+
+    cdef Py_ssize_t row, column, idx
+    cdef float *up
+    cdef float *middle
+    cdef float *down
+    cdef float current, forward, backward
+
+    # The neighbours along each of the 4 directions, in the same order as in canny.nonMaximumSuppressionNumpy()
+    cdef int rowOffsets[4]
+    cdef int columnOffsets[4]
+    rowOffsets[:]    = [0, 1, 1,  1]
+    columnOffsets[:] = [1, 1, 0, -1]
+
+    # The gradient. The rows and columns outside the image repeat the border, like np.pad(mode="edge")
+    for row in prange(H, nogil=True):
+        up     = srcPtr + (row - 1 if row > 0 else 0) * W
+        middle = srcPtr + row * W
+        down   = srcPtr + (row + 1 if row < H - 1 else H - 1) * W
+
+        sobelAt(up, middle, down, 0, 0, 1 if W > 1 else 0, magnitudePtr + row * W, directionPtr + row * W)
+        for column in range(1, W - 1):
+            sobelAt(up, middle, down, column - 1, column, column + 1, magnitudePtr + row * W, directionPtr + row * W)
+        if W > 1:
+            sobelAt(up, middle, down, W - 2, W - 1, W - 1, magnitudePtr + row * W, directionPtr + row * W)
+
+    # The same offsets, in pixels. Used away from the borders, where every neighbour is inside the image.
+    cdef Py_ssize_t offsets[4]
+    for idx in range(4):
+        offsets[idx] = rowOffsets[idx] * W + columnOffsets[idx]
+
+    # The suppression. Outside the image the gradient is 0
+    for row in prange(H, nogil=True):
+        for column in range(W):
+            idx     = row * W + column
+            current = magnitudePtr[idx]
+
+            if row > 0 and row < H - 1 and column > 0 and column < W - 1:
+                forward  = magnitudePtr[idx + offsets[directionPtr[idx]]]
+                backward = magnitudePtr[idx - offsets[directionPtr[idx]]]
+            else:
+                forward  = magnitudeAt(magnitudePtr, H, W, row + rowOffsets[directionPtr[idx]], column + columnOffsets[directionPtr[idx]])
+                backward = magnitudeAt(magnitudePtr, H, W, row - rowOffsets[directionPtr[idx]], column - columnOffsets[directionPtr[idx]])
+
+            # Using > on one side and >= on the other keeps exactly one pixel on flat ridges
+            suppressedPtr[idx] = current if current > forward and current >= backward else 0
+
+    return suppressed
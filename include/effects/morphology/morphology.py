@@ -0,0 +1,169 @@
+"""
+Morphology.py has the morphological operators (https://en.wikipedia.org/wiki/Mathematical_morphology) with rectangular
+structuring elements. They are mostly useful to clean up edge maps and dithered masks: opening removes small specks,
+closing fills small holes and gaps, and the morphological gradient outlines the shapes.
+"""
+
+import numpy as np
+
+import include.utils.buffers as buffers
+
+
+def parseElementSize(elementSize: str) -> tuple:
+    """Parses the size of a structuring element in the format HxW (or just N for an N x N square) into a tuple.
+
+    Args:
+        elementSize (str): The size. For example, "5x3".
+
+    Returns:
+        tuple: The size in the (H, W) format.
+    """
+    size = tuple(int(dimension) for dimension in elementSize.lower().split("x"))
+
+    if len(size) == 1:
+        size = size * 2
+
+    if len(size) != 2 or min(size) <= 0:
+        raise ValueError(f"Invalid structuring element size '{elementSize}'. Must be in the format HxW or N")
+
+    return size
+
+
+def vanHerkGilWerman(img: np.typing.NDArray, size: int, axis: int, operator, out: np.typing.NDArray = None) -> np.typing.NDArray:
+    """
+    The running minimum/maximum of every window of 'size' pixels along one axis of the image, using the algorithm by van Herk
+    (https://doi.org/10.1016/0167-8655(92)90069-C) and Gil and Werman (https://doi.org/10.1109/34.211471).
+
+    The line is split into blocks of 'size' pixels. Inside every block we compute the running maximum from the left (prefix) and from the
+    right (suffix). Any window of 'size' pixels covers the end of one block and the start of the next one, so its maximum is just
+    max(suffix[start], prefix[end]). That is 3 comparisons per pixel no matter how big the window is, and both running maximums are
+    a single np.maximum.accumulate over the whole image.
+
+    The window is centered on each pixel, and the borders are padded with the identity of the operator, so they never win.
+
+    Args:
+        img (np.typing.NDArray): The image.
+        size (int)             : The size of the window.
+        axis (int)             : The axis along which the window slides.
+        operator (np.ufunc)    : np.minimum (erosion) or np.maximum (dilation).
+        out (np.typing.NDArray): Where to write the result. Must have the same shape and dtype as img. It can be img itself,
+                                 since the result is only written after the running minimums/maximums are computed.
+
+    Returns:
+        np.typing.NDArray: The filtered image, with the same shape and dtype as img.
+    """
+    if size == 1:
+        return img.copy() if out is None else buffers.writeInto(img, out)
+
+    img    = np.moveaxis(img, axis, 0)
+    length = img.shape[0]
+
+    # The value that never wins. For np.uint8 that's 255 when eroding and 0 when dilating.
+    limits   = np.iinfo(img.dtype) if np.issubdtype(img.dtype, np.integer) else np.finfo(img.dtype)
+    identity = limits.max if operator is np.minimum else limits.min
+
+    # Pad the line so the window is centered, and then so it can be split in blocks of 'size' pixels
+    before  = size // 2
+    nBlocks = (length + size - 1 + size - 1) // size
+    after   = nBlocks * size - length - before
+
+    padWidth = [(before, after)] + [(0, 0)] * (img.ndim - 1)
+    padded   = np.pad(img, padWidth, mode="constant", constant_values=identity)
+    blocks   = padded.reshape((nBlocks, size) + img.shape[1:])
+
+    prefix = operator.accumulate(blocks, axis=1).reshape(padded.shape)
+    suffix = operator.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].reshape(padded.shape)
+
+    # The window that starts at 'start' ends at start + size - 1
+    if out is None:
+        return np.moveaxis(operator(suffix[:length], prefix[size - 1 : size - 1 + length]), 0, axis)
+
+    operator(suffix[:length], prefix[size - 1 : size - 1 + length], out=np.moveaxis(out, axis, 0))
+
+    return out
+
+
+def erode(img: np.typing.NDArray, elementSize: tuple, out: np.typing.NDArray = None) -> np.typing.NDArray:
+    """
+    Erosion: every pixel becomes the minimum of the rectangle around it. Bright regions shrink and small bright specks disappear.
+    A rectangle is separable, so this is a running minimum over the rows followed by one over the columns.
+
+    Args:
+        img (np.typing.NDArray): The image. Must be in the format (H, W, C).
+        elementSize (tuple)    : The (H, W) size of the rectangular structuring element.
+        out (np.typing.NDArray): Where to write the result. Must have the same shape and dtype as img. It can be img itself.
+
+    Returns:
+        np.typing.NDArray: The eroded image.
+    """
+    img = vanHerkGilWerman(img, elementSize[1], 1, np.minimum)
+
+    return vanHerkGilWerman(img, elementSize[0], 0, np.minimum, out)
+
+
+def dilate(img: np.typing.NDArray, elementSize: tuple, out: np.typing.NDArray = None) -> np.typing.NDArray:
+    """
+    Dilation: every pixel becomes the maximum of the rectangle around it. Bright regions grow and small dark holes disappear.
+
+    Args:
+        img (np.typing.NDArray): The image. Must be in the format (H, W, C).
+        elementSize (tuple)    : The (H, W) size of the rectangular structuring element.
+        out (np.typing.NDArray): Where to write the result. Must have the same shape and dtype as img. It can be img itself.
+
+    Returns:
+        np.typing.NDArray: The dilated image.
+    """
+    img = vanHerkGilWerman(img, elementSize[1], 1, np.maximum)
+
+    return vanHerkGilWerman(img, elementSize[0], 0, np.maximum, out)
+
+
+def opening(img: np.typing.NDArray, elementSize: tuple, out: np.typing.NDArray = None) -> np.typing.NDArray:
+    """Opening: an erosion followed by a dilation. Removes bright details smaller than the structuring element
+    and leaves everything else (almost) untouched.
+    """
+    return dilate(erode(img, elementSize), elementSize, out)
+
+
+def closing(img: np.typing.NDArray, elementSize: tuple, out: np.typing.NDArray = None) -> np.typing.NDArray:
+    """Closing: a dilation followed by an erosion. Fills dark holes and gaps smaller than the structuring element,
+    which reconnects broken edges.
+    """
+    return erode(dilate(img, elementSize), elementSize, out)
+
+
+def morphologicalGradient(img: np.typing.NDArray, elementSize: tuple, out: np.typing.NDArray = None) -> np.typing.NDArray:
+    """Morphological gradient: the difference between the dilation and the erosion. It's bright on the outline of every shape.
+    """
+    return np.subtract(dilate(img, elementSize), erode(img, elementSize), out=out)
+
+
+def morphology(img: np.typing.NDArray, operation: str, elementSize: tuple, out: np.typing.NDArray = None) -> np.typing.NDArray:
+    """
+    Applies one of the morphological operators to the image.
+
+    Args:
+        img (np.typing.NDArray): The image. Must be in the format (H, W, C).
+        operation (str)        : "erode", "dilate", "open", "close" or "gradient".
+        elementSize (tuple)    : The (H, W) size of the rectangular structuring element. Can also be a string in the
+                                 format accepted by parseElementSize().
+        out (np.typing.NDArray): Where to write the result. Must have the same shape and dtype as img. By default, a new array is created.
+
+    Returns:
+        np.typing.NDArray: The processed image.
+    """
+    if isinstance(elementSize, str):
+        elementSize = parseElementSize(elementSize)
+
+    if operation == "erode":
+        return erode(img, elementSize, out)
+    elif operation == "dilate":
+        return dilate(img, elementSize, out)
+    elif operation == "open":
+        return opening(img, elementSize, out)
+    elif operation == "close":
+        return closing(img, elementSize, out)
+    elif operation == "gradient":
+        return morphologicalGradient(img, elementSize, out)
+
+    raise ValueError(f"Unknown morphological operation '{operation}'")
@@ -0,0 +1,501 @@
+"""
+Backends.py is a registry of the different implementations (backends) of the heavy operations in Image Studio.
+
+Some operations have more than one implementation. For example, a convolution can be done with a sliding window in Numpy,
+with the same sliding window split into tiles that run in parallel, or with an FFT. Which one is the fastest depends on the size
+of the image, its dtype and on how many cores the machine has. So instead of hardwiring one of them, the effects call
+dispatch(), which picks the backend to use:
+
+    1. If the operation was autotuned on this machine (see autotune()), it uses the backend that was the fastest for
+       images of that size and dtype.
+    2. Otherwise, it uses the backend with the highest priority among the ones that support the image.
+    3. If none of them support the image (for example, the Cython extension wasn't compiled), it falls back to the Numpy reference.
+
+Every operation has exactly one reference backend, which is the plain Numpy implementation. All the other backends are checked against
+it with verify(), so a fast path can never silently give different results.
+
+The backends are declared with the "module:function" path of their implementation and are only imported when they are first used.
+"""
+
+import concurrent.futures
+import importlib
+import json
+import math
+import os
+import time
+import warnings
+
+import numpy as np
+
+import include.utils.synthetic as synthetic
+
+
+class Backend:
+    def __init__(self, name: str, path: str, priority: int = 0, reference: bool = False,
+                 minPixels: int = 0, maxPixels: int = None, minCores: int = 1, dtypes: tuple = None):
+        """
+        Args:
+            name (str)     : The name of the backend (numpy, cython, fft, tiled, ...).
+            path (str)     : Where the implementation is, in the format "module:function".
+            priority (int) : When the operation wasn't autotuned, the backend with the highest priority is used.
+            reference (bool): If this is the Numpy reference implementation for the operation.
+            minPixels (int): The backend is only used on images with at least this many pixels.
+            maxPixels (int): The backend is only used on images with at most this many pixels. None means no limit.
+            minCores (int) : The backend is only used on machines with at least this many cores.
+            dtypes (tuple) : The image dtypes supported by the backend. None means any dtype.
+        """
+        self.name      = name
+        self.path      = path
+        self.priority  = priority
+        self.reference = reference
+        self.minPixels = minPixels
+        self.maxPixels = maxPixels
+        self.minCores  = minCores
+        self.dtypes    = dtypes
+
+        self._function = None
+
+
+    def load(self):
+        """Imports the implementation. Raises ImportError if it isn't available (for example, if the Cython code wasn't compiled).
+        """
+        if self._function is None:
+            moduleName, functionName = self.path.split(":")
+            self._function = getattr(importlib.import_module(moduleName), functionName)
+
+        return self._function
+
+
+    def isAvailable(self) -> bool:
+        try:
+            self.load()
+        except ImportError:
+            return False
+
+        return True
+
+
+    def supports(self, nPixels: int, dtype) -> bool:
+        if nPixels < self.minPixels:
+            return False
+        if self.maxPixels is not None and nPixels > self.maxPixels:
+            return False
+        if os.cpu_count() < self.minCores:
+            return False
+        if self.dtypes is not None and np.dtype(dtype).name not in self.dtypes:
+            return False
+
+        return self.isAvailable()
+
+
+def makeConvolutionArguments(img: np.typing.NDArray):
+    return (img[..., 0].astype(np.float32), np.outer([1, 4, 6, 4, 1], [1, 4, 6, 4, 1]), "edge")
+
+
+def makeConvolutionCases(img: np.typing.NDArray):
+    import include.utils.kernels as kernels
+
+    # The derivative kernels sum to 0, and their output goes through atan2() in the edge detectors. A backend that gives 1e-6
+    # instead of 0 on a flat area completely changes the direction of the edge, so they have to be checked too.
+    channel = img[..., 0].astype(np.float32)
+
+    return [makeConvolutionArguments(img),
+            (channel, kernels.boxBlur3x3,           "constant"),
+            (channel, kernels.sobelHorizontal3x3,   "edge"),
+            (channel, kernels.sobelVertical3x3,     "edge"),
+            (channel, kernels.prewittHorizontal3x3, "edge")]
+
+
+def makeHSVArguments(img: np.typing.NDArray):
+    import include.utils.colormodel as colormodel
+
+    return (colormodel.rgb2hsvNumpy(img),)
+
+
+def makeQuantizationArguments(img: np.typing.NDArray):
+    return (img, np.linspace(0, 255, 8, dtype=np.uint8))
+
+
+def makePaletteArguments(img: np.typing.NDArray):
+    import include.effects.color.quantize as quantize
+
+    nearestIdx, palette = quantize.labPalette(np.linspace(0, 255, 4, dtype=np.uint8).tobytes())
+
+    return (img, nearestIdx, palette)
+
+
+def makeHysteresisArguments(img: np.typing.NDArray):
+    import include.effects.edge_detection.canny as canny
+
+    suppressed = canny.nonMaximumSuppressionNumpy(img[..., 0].astype(np.float32))
+
+    return (suppressed, np.float32(0.1 * suppressed.max()), np.float32(0.2 * suppressed.max()))
+
+
+def makeEdgeColorArguments(img: np.typing.NDArray):
+    import include.effects.edge_detection.canny as canny
+    import include.effects.edge_detection.gradients as gradients
+
+    channel = img[..., 0].astype(np.float32)
+    edges   = (canny.nonMaximumSuppressionNumpy(channel) > 0).astype(np.uint8)
+
+    return (edges, channel, gradients.edgeColorTable(-1))
+
+
+# Every operation has a list of backends and a function that turns a synthetic RGB np.uint8 image into the arguments of the operation.
+# The arguments are used to check the backends against the reference and to autotune them. Operations can also have "makeCases",
+# which returns a list of arguments, so the backends are checked on more than one kind of input (see verify()).
+#
+# The tolerance is the largest absolute difference to the reference that a backend is allowed to have in any pixel. Error diffusion
+# is the exception: it uses the mean absolute difference (see "metric"). With "keepsZeros", every value that is exactly 0 in the
+# reference must also be exactly 0 in the backend.
+registry = {
+    "convolve2d": {
+        "makeArguments": makeConvolutionArguments,
+        "makeCases"    : makeConvolutionCases,
+        "tolerance"    : 1e-3,
+        "keepsZeros"   : True,
+        "backends"     : [
+            Backend("numpy", "include.utils.convolve2d:convolve2dNumpy", reference=True),
+            Backend("tiled", "include.utils.convolve2d:convolve2dTiled", priority=1, minPixels=2**18),
+            Backend("fft",   "include.utils.convolve2d:convolve2dFFT",   priority=-1),
+            Backend("shifted", "include.utils.convolve2d:convolve2dShifted", priority=2),
+        ]
+    },
+    "rgb2hsv": {
+        "makeArguments": lambda img: (img,),
+        "tolerance"    : 1e-5,
+        "backends"     : [
+            Backend("numpy", "include.utils.colormodel:rgb2hsvNumpy", reference=True),
+            Backend("tiled", "include.utils.colormodel:rgb2hsvTiled", priority=1, minPixels=2**18, minCores=2),
+        ]
+    },
+    "hsv2rgb": {
+        "makeArguments": makeHSVArguments,
+        "tolerance"    : 0,
+        "backends"     : [
+            Backend("numpy", "include.utils.colormodel:hsv2rgbNumpy", reference=True),
+            Backend("tiled", "include.utils.colormodel:hsv2rgbTiled", priority=1, minPixels=2**18, minCores=2),
+        ]
+    },
+    "rgb2lab": {
+        "makeArguments": lambda img: (img,),
+        # The 3x3 matrix is summed in a different order than in Numpy, so a few pixels end up in the next entry of the cube
+        # root table. One entry is at most ~1e-4, which the 500 in a = 500 * (fx - fy) turns into ~0.05.
+        "tolerance"    : 0.05,
+        "backends"     : [
+            Backend("numpy",  "include.utils.colormodel:rgb2labNumpy", reference=True),
+            Backend("cython", "include.utils.lab:rgb2lab", priority=1, dtypes=("uint8",)),
+        ]
+    },
+    "quantize": {
+        "makeArguments": makeQuantizationArguments,
+        "tolerance"    : 0,
+        "backends"     : [
+            Backend("numpy", "include.effects.color.quantize:quantizeNumpy", reference=True),
+            Backend("lut",   "include.effects.color.quantize:quantizeLUT",   priority=1, dtypes=("uint8",)),
+        ]
+    },
+    "recursiveGaussian": {
+        "makeArguments": lambda img: (img.astype(np.float32), 4.0),
+        "tolerance"    : 1e-3,
+        "backends"     : [
+            Backend("numpy",  "include.effects.blur.blur:recursiveGaussianNumpy", reference=True),
+            Backend("cython", "include.effects.blur.recursive_gaussian:recursiveGaussian", priority=1, dtypes=("float32",)),
+        ]
+    },
+    "medianFilter": {
+        "makeArguments": lambda img: (img, 3),
+        "tolerance"    : 0,
+        "backends"     : [
+            # The Numpy reference needs (2 * radius + 1)^2 floats per pixel, so it's only usable on small images
+            Backend("numpy",  "include.effects.blur.denoise:medianFilterNumpy", reference=True, maxPixels=2**20),
+            Backend("cython", "include.effects.blur.median:medianFilter", priority=1, dtypes=("uint8",)),
+        ]
+    },
+    "nonMaximumSuppression": {
+        "makeArguments": lambda img: (img[..., 0].astype(np.float32),),
+        "tolerance"    : 0,
+        "backends"     : [
+            Backend("numpy",  "include.effects.edge_detection.canny:nonMaximumSuppressionNumpy", reference=True),
+            Backend("cython", "include.effects.edge_detection.suppression:nonMaximumSuppression", priority=1, dtypes=("float32",)),
+        ]
+    },
+    "edgeColors": {
+        "makeArguments": makeEdgeColorArguments,
+        "tolerance"    : 0,
+        "backends"     : [
+            Backend("numpy",  "include.effects.edge_detection.canny:edgeColorsNumpy", reference=True),
+            Backend("cython", "include.effects.edge_detection.edge_colors:edgeColors", priority=1, dtypes=("uint8",)),
+        ]
+    },
+    "hysteresis": {
+        "makeArguments": makeHysteresisArguments,
+        "tolerance"    : 0,
+        "backends"     : [
+            # The Numpy reference needs one iteration per pixel of the longest weak edge, so it's only usable on small images
+            Backend("numpy",  "include.effects.edge_detection.canny:hysteresisNumpy", reference=True, maxPixels=2**20),
+            Backend("cython", "include.effects.edge_detection.hysteresis:hysteresis", priority=1, dtypes=("float32",)),
+        ]
+    },
+    "floydSteinberg": {
+        "makeArguments": makeQuantizationArguments,
+        # Error diffusion is chaotic, so a single rounding difference can change a whole region of the image. That's why this is the
+        # only operation that is checked with the mean difference, and why the tolerance is large.
+        "metric"       : "mean",
+        "tolerance"    : 1.0,
+        "backends"     : [
+            # The Numpy reference goes through every pixel in Python, so it's only usable on really small images
+            Backend("numpy",  "include.effects.dithering.error_diffusion:floydSteinbergNumpy", reference=True, maxPixels=2**16),
+            Backend("cython", "include.effects.dithering.floyd_steinberg:floydSteinberg", priority=1, dtypes=("uint8", "float32")),
+        ]
+    },
+    "floydSteinbergPalette": {
+        "makeArguments": makePaletteArguments,
+        "metric"       : "mean",
+        "tolerance"    : 1.0,
+        "backends"     : [
+            Backend("numpy",  "include.effects.dithering.error_diffusion:floydSteinbergPaletteNumpy", reference=True, maxPixels=2**14),
+            Backend("cython", "include.effects.dithering.floyd_steinberg:floydSteinbergPalette", priority=1, dtypes=("uint8",)),
+        ]
+    },
+}
+
+
+# Where the autotuning results are saved
+autotunePath = os.environ.get("IMAGE_STUDIO_AUTOTUNE", os.path.join(os.path.expanduser("~"), ".cache", "image-studio", "autotune.json"))
+
+# Bump this whenever the implementation of a backend changes, so the autotuning results measured with the old code are thrown away.
+# Adding or removing backends doesn't need it, since the names of the backends of each operation are saved with the results.
+autotuneVersion = 2
+
+# The autotuning results, loaded from autotunePath the first time they are needed
+_autotuneChoices = None
+
+
+def sizeBucket(nPixels: int) -> int:
+    """Groups image sizes in powers of 2, so images of similar sizes share the same autotuning result.
+    """
+    return int(round(math.log2(max(nPixels, 1))))
+
+
+def backendNames(operation: str) -> list:
+    return [backend.name for backend in registry[operation]["backends"]]
+
+
+def loadAutotuneChoices() -> dict:
+    global _autotuneChoices
+
+    if _autotuneChoices is None:
+        _autotuneChoices = {}
+
+        if os.path.exists(autotunePath):
+            with open(autotunePath) as f:
+                saved = json.load(f)
+
+            # The results are only valid on the machine and with the code they were measured with. An operation whose backends
+            # changed since then (for example, a new and faster one was added) is ignored, so it goes back to the priorities.
+            if saved.get("version") == autotuneVersion and saved.get("cpuCount") == os.cpu_count():
+                savedBackends    = saved.get("backends", {})
+                _autotuneChoices = {operation: choice for operation, choice in saved["choices"].items()
+                                    if operation in registry and savedBackends.get(operation) == backendNames(operation)}
+
+                # Only the backends that matched the reference when they were autotuned can be chosen. A file that doesn't say
+                # which ones did (written by hand, or by an older version) can't send dispatch() to a backend that was never verified.
+                verifiedBackends = saved.get("verified", {})
+                _autotuneChoices = {operation: onlyVerified(choice, verifiedBackends.get(operation, []))
+                                    for operation, choice in _autotuneChoices.items()}
+
+    return _autotuneChoices
+
+
+def onlyVerified(choice: dict, verifiedBackends: list) -> dict:
+    """Drops the autotuning choices, in the format { dtype: { sizeBucket: backendName } }, of the backends that aren't in verifiedBackends.
+    """
+    return {dtype: {size: name for size, name in sizes.items() if name in verifiedBackends} for dtype, sizes in choice.items()}
+
+
+def choiceNames(choice: dict) -> list:
+    """The names of the backends used in the autotuning choices of an operation.
+    """
+    return sorted({name for sizes in choice.values() for name in sizes.values()})
+
+
+def reference(operation: str) -> Backend:
+    return next(backend for backend in registry[operation]["backends"] if backend.reference)
+
+
+def getBackend(operation: str, name: str) -> Backend:
+    for backend in registry[operation]["backends"]:
+        if backend.name == name:
+            return backend
+
+    raise ValueError(f"Unknown backend '{name}' for {operation}. Choose from: {', '.join(backend.name for backend in registry[operation]['backends'])}")
+
+
+def select(operation: str, nPixels: int, dtype) -> Backend:
+    """Picks the backend that should be used for an image with nPixels pixels of the given dtype.
+    """
+    candidates = [backend for backend in registry[operation]["backends"] if backend.supports(nPixels, dtype)]
+
+    if len(candidates) == 0:
+        return reference(operation)
+
+    # If the operation was autotuned, use the choice of the closest size that was measured
+    tunedSizes = loadAutotuneChoices().get(operation, {}).get(np.dtype(dtype).name, {})
+    if len(tunedSizes) > 0:
+        closestSize = min(tunedSizes.keys(), key=lambda size: abs(int(size) - sizeBucket(nPixels)))
+
+        for backend in candidates:
+            if backend.name == tunedSizes[closestSize]:
+                return backend
+
+    return max(candidates, key=lambda backend: backend.priority)
+
+
+def dispatch(operation: str, img: np.typing.NDArray, *args):
+    """Runs the operation on the image with the best backend. img must be the first argument of the operation.
+    """
+    nPixels = img.shape[0] * img.shape[1]
+    backend = select(operation, nPixels, img.dtype)
+
+    if backend.reference and backend.maxPixels is not None and nPixels > backend.maxPixels:
+        warnings.warn(f"No fast backend is available for {operation}, so the Numpy reference will be used. This will be VERY slow!")
+
+    return backend.load()(img, *args)
+
+
+def parallelRows(function, nRows: int, nTiles: int = None) -> list:
+    """Splits the rows [0, nRows) into tiles and calls function(startRow, endRow) for every tile in a thread pool.
+    Numpy releases the GIL for most operations on large arrays, so the tiles really run in parallel.
+
+    Args:
+        function (callable): Receives the first and last (exclusive) rows of the tile.
+        nRows (int)        : The number of rows to split.
+        nTiles (int)       : How many tiles to create. The default is 4 tiles per core, so the work is evenly spread.
+
+    Returns:
+        list: The results of each tile, in order.
+    """
+    if nTiles is None:
+        nTiles = 4 * os.cpu_count()
+
+    nTiles = max(1, min(nTiles, nRows))
+    bounds = np.linspace(0, nRows, nTiles + 1).astype(int)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        return list(executor.map(function, bounds[:-1], bounds[1:]))
+
+
+def verify(operation: str, megapixels: float = 0.01) -> dict:
+    """Checks every available backend of the operation against the Numpy reference.
+
+    Args:
+        operation (str)   : The operation.
+        megapixels (float): The size of the synthetic image used for the check. Must be small enough for the reference to run on it.
+
+    Returns:
+        dict: The largest difference to the reference for each backend (the largest absolute difference of any pixel, or the mean
+        absolute difference for the operations whose "metric" is "mean"), over every case, and whether it is within the tolerance.
+    """
+    img        = synthetic.makeImage(megapixels, 3, seed=1)
+    operations = registry[operation]
+    cases      = operations["makeCases"](img) if "makeCases" in operations else [operations["makeArguments"](img)]
+    tolerance  = operations["tolerance"]
+    metric     = operations.get("metric", "max")
+
+    results = {}
+    for arguments in cases:
+        expected = np.asarray(reference(operation).load()(*arguments), dtype=np.float64)
+
+        for backend in operations["backends"]:
+            if backend.reference or not backend.isAvailable():
+                continue
+
+            result = np.asarray(backend.load()(*arguments), dtype=np.float64)
+            if result.shape != expected.shape:
+                difference, keepsZeros = float("inf"), False
+            else:
+                difference = np.abs(result - expected)
+                difference = difference.mean() if metric == "mean" else difference.max(initial=0)
+                keepsZeros = not operations.get("keepsZeros", False) or bool(np.all(result[expected == 0] == 0))
+
+            previous = results.get(backend.name, {"difference": 0.0, "ok": True})
+            results[backend.name] = {"difference": max(previous["difference"], float(difference)),
+                                     "ok"        : previous["ok"] and bool(difference <= tolerance) and keepsZeros}
+
+    return results
+
+
+def autotune(operations: list = None, sizes: list = (0.06, 0.25, 1, 4), repeat: int = 3, save: bool = True) -> dict:
+    """Measures every backend of every operation on this machine and saves the fastest one for each image size and dtype.
+    Backends that don't match the reference (see verify()) are never chosen. The backends that do are saved with the choices,
+    and loadAutotuneChoices() ignores any choice that isn't one of them.
+
+    Args:
+        operations (list): The operations to autotune. Default = all of them.
+        sizes (list)     : The image sizes (in megapixels) to measure.
+        repeat (int)     : How many times each backend runs. The best time is kept.
+        save (bool)      : Whether to save the results in autotunePath.
+
+    Returns:
+        dict: The choices, in the format { operation: { dtype: { sizeBucket: backendName } } }.
+    """
+    global _autotuneChoices
+
+    if operations is None:
+        operations = list(registry.keys())
+
+    choices = dict(loadAutotuneChoices())
+
+    # The operations that aren't autotuned again keep their previous choices, which were verified when they were loaded
+    verifiedBackends = {operation: choiceNames(choice) for operation, choice in choices.items()}
+
+    for operation in operations:
+        verified  = verify(operation)
+        backends  = [backend for backend in registry[operation]["backends"]
+                     if backend.isAvailable() and (backend.reference or verified[backend.name]["ok"])]
+
+        verifiedBackends[operation] = [backend.name for backend in backends]
+
+        for backend in registry[operation]["backends"]:
+            if backend.name in verified and not verified[backend.name]["ok"]:
+                warnings.warn(f"The {backend.name} backend of {operation} doesn't match the reference and will not be used.")
+
+        choices[operation] = {}
+
+        for megapixels in sizes:
+            arguments = registry[operation]["makeArguments"](synthetic.makeImage(megapixels, 3))
+            nPixels   = arguments[0].shape[0] * arguments[0].shape[1]
+            dtype     = arguments[0].dtype.name
+
+            times = {}
+            for backend in backends:
+                # No point measuring a backend that dispatch() would never pick for this image
+                if not backend.supports(nPixels, dtype):
+                    continue
+
+                function = backend.load()
+                bestTime = float("inf")
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    function(*arguments)
+                    bestTime = min(bestTime, time.perf_counter() - start)
+
+                times[backend.name] = bestTime
+
+            if len(times) > 0:
+                choices[operation].setdefault(dtype, {})[str(sizeBucket(nPixels))] = min(times, key=times.get)
+
+    _autotuneChoices = choices
+
+    if save:
+        os.makedirs(os.path.dirname(autotunePath), exist_ok=True)
+        with open(autotunePath, "w") as f:
+            json.dump({"version" : autotuneVersion,
+                       "cpuCount": os.cpu_count(),
+                       "backends": {operation: backendNames(operation) for operation in choices},
+                       "verified": verifiedBackends,
+                       "choices" : choices}, f, indent=4)
+
+    return choices
@@ -0,0 +1,116 @@
+"""
+Buffers.py helps the effects write into buffers that already exist, instead of allocating a new full size image every time.
+
+Most effects have an optional 'out' argument. When it's given, the result is written there and 'out' is returned. When processing
+lots of images (or the frames of an animation) in the same process, the pipeline gets those buffers from a ScratchArena,
+which hands out the same np.uint8/np.float32 buffers over and over as long as the images have the same size. That keeps the
+peak memory down and stops the allocator from mapping and unmapping hundreds of megabytes for every image.
+"""
+
+import numpy as np
+
+
+# How many elements are looked up at a time by lookup()
+lookupChunk = 2**20
+
+
+class ScratchArena:
+    def __init__(self):
+        # The buffers, by name. Each name only ever has one buffer, which is replaced when a different shape or dtype is asked for.
+        self.buffers = {}
+
+        # How many times a buffer was reused and how many times one had to be allocated
+        self.hits   = 0
+        self.misses = 0
+
+
+    def get(self, name: str, shape: tuple, dtype) -> np.typing.NDArray:
+        """Returns the buffer with this name, allocating it if it doesn't exist yet or if it has a different shape or dtype.
+        The buffer is NOT cleared, so it still has whatever was written in it before.
+
+        Args:
+            name (str)   : The name of the buffer. Two parts of the code that need a buffer at the same time must use different names.
+            shape (tuple): The shape of the buffer.
+            dtype        : The dtype of the buffer.
+
+        Returns:
+            np.typing.NDArray: The buffer.
+        """
+        buffer = self.buffers.get(name)
+        if buffer is not None and buffer.shape == tuple(shape) and buffer.dtype == dtype:
+            self.hits += 1
+            return buffer
+
+        self.misses += 1
+        buffer = np.empty(shape, dtype=dtype)
+        self.buffers[name] = buffer
+
+        return buffer
+
+
+    def outputFor(self, img: np.typing.NDArray, channels: int = None, dtype=np.uint8) -> np.typing.NDArray:
+        """Returns a buffer with the same shape as img (or with 'channels' channels) to write the result of an effect on img.
+        There are two of them, used in turns, so the buffer is never img itself (the result of the previous effect).
+        """
+        shape = img.shape if channels is None else img.shape[:-1] + (channels,)
+
+        for name in ["output0", "output1"]:
+            buffer = self.get(name, shape, dtype)
+            if not np.shares_memory(buffer, img):
+                return buffer
+
+
+    def owns(self, img: np.typing.NDArray) -> bool:
+        """If img is (or is a view of) one of the buffers of the arena.
+        """
+        return any(np.shares_memory(buffer, img) for buffer in self.buffers.values())
+
+
+    def nbytes(self) -> int:
+        """How much memory the buffers use, in bytes.
+        """
+        return sum(buffer.nbytes for buffer in self.buffers.values())
+
+
+    def clear(self):
+        """Frees all the buffers.
+        """
+        self.buffers = {}
+
+
+def lookup(table: np.typing.NDArray, img: np.typing.NDArray, out: np.typing.NDArray = None) -> np.typing.NDArray:
+    """The same as table[img], but written into 'out'. Numpy can't do a lookup into an existing array without first creating
+    the whole result (np.take() is even worse, since it converts the indices to 64-bit integers), so the image is looked up a few rows at a time.
+
+    Args:
+        table (np.typing.NDArray): The 1D lookup table.
+        img (np.typing.NDArray)  : The indices. Usually a np.uint8 image.
+        out (np.typing.NDArray)  : Where to write the result. Must have the same shape as img. It can be img itself.
+
+    Returns:
+        np.typing.NDArray: out, or a new array if out is None.
+    """
+    if out is None:
+        return table[img]
+
+    if img.ndim == 0 or img.size == 0:
+        out[...] = table[img]
+        return out
+
+    rowSize = max(1, img.size // img.shape[0])
+    nRows   = max(1, lookupChunk // rowSize)
+    for start in range(0, img.shape[0], nRows):
+        out[start : start + nRows] = table[img[start : start + nRows]]
+
+    return out
+
+
+def writeInto(result: np.typing.NDArray, out: np.typing.NDArray = None) -> np.typing.NDArray:
+    """For the effects that can't write directly into 'out': copies the result there (if out was given) and returns it.
+    """
+    if out is None:
+        return result
+
+    out[...] = result
+
+    return out
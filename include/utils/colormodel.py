@@ -3,8 +3,40 @@ Colormodel.py is where I implement my own color model conversions. For more clar
 a color model, check https://en.wikipedia.org/wiki/Color_model
 """
 
+import functools
+
 import numpy as np
 
+import include.utils.backends as backends
+import include.utils.buffers as buffers
+
+
+# The number of entries in the linear -> sRGB table. The sRGB curve is really steep near black, so the table has to be
+# much finer than 256 entries there. With 65536 entries, neighbouring entries are at most 0.05 sRGB levels apart.
+srgbEncodeTableSize = 2**16
+
+# The number of entries in the table with the cube root used by CIELAB. Same idea as srgbEncodeTableSize.
+labTableSize = 2**16
+
+# Full range YCbCr, the same one used by JPEG (https://en.wikipedia.org/wiki/YCbCr#JPEG_conversion)
+rgb2ycbcrMatrix = np.array([[ 0.299000,  0.587000,  0.114000],
+                            [-0.168736, -0.331264,  0.500000],
+                            [ 0.500000, -0.418688, -0.081312]], dtype=np.float32)
+ycbcrOffset     = np.array([0, 128, 128], dtype=np.float32)
+
+# Linear sRGB -> CIE XYZ (https://en.wikipedia.org/wiki/SRGB#From_sRGB_to_CIE_XYZ), and the D65 white point
+rgb2xyzMatrix = np.array([[0.4124564, 0.3575761, 0.1804375],
+                          [0.2126729, 0.7151522, 0.0721750],
+                          [0.0193339, 0.1191920, 0.9503041]], dtype=np.float64)
+whitePoint    = np.array([0.95047, 1.0, 1.08883], dtype=np.float64)
+
+# CIELAB is computed from XYZ divided by the white point, so both are folded into a single matrix
+rgb2labMatrix = (rgb2xyzMatrix / whitePoint.reshape(-1, 1)).astype(np.float32)
+lab2rgbMatrix = np.linalg.inv(rgb2xyzMatrix / whitePoint.reshape(-1, 1)).astype(np.float32)
+
+# Below (6/29)^3, the cube root in CIELAB is replaced by a straight line
+labDelta = 6 / 29
+
 
 def rgb2grayscale(img: np.typing.NDArray) -> np.typing.NDArray:
     """Converts an image from RGB to Grayscale. 
@@ -36,7 +68,203 @@ def rgb2grayscale(img: np.typing.NDArray) -> np.typing.NDArray:
 
 
 
-def rgb2hsv(img: np.typing.NDArray) -> np.typing.NDArray:
+@functools.lru_cache(maxsize=None)
+def srgbDecodeTable() -> np.typing.NDArray:
+    """The sRGB -> linear light table (https://en.wikipedia.org/wiki/SRGB#Transfer_function_(%22gamma%22)).
+    A np.uint8 image only has 256 possible values, so the transfer function is computed for each of them just once.
+
+    Returns:
+        np.typing.NDArray (np.float32): The 256 linear values, in the range [0, 1].
+    """
+    srgb   = np.arange(256, dtype=np.float64) / 255
+    linear = np.where(srgb <= 0.04045, srgb / 12.92, ((srgb + 0.055) / 1.055) ** 2.4).astype(np.float32)
+
+    # The table is cached, so make sure nobody changes it by accident
+    linear.flags.writeable = False
+
+    return linear
+
+
+@functools.lru_cache(maxsize=None)
+def srgbEncodeTable() -> np.typing.NDArray:
+    """The linear light -> sRGB table. Entry i has the np.uint8 sRGB value of the linear value i / (srgbEncodeTableSize - 1).
+
+    Returns:
+        np.typing.NDArray (np.uint8): The srgbEncodeTableSize sRGB values.
+    """
+    linear = np.linspace(0, 1, srgbEncodeTableSize, dtype=np.float64)
+    srgb   = np.where(linear <= 0.0031308, linear * 12.92, 1.055 * linear ** (1 / 2.4) - 0.055)
+    srgb   = np.clip(np.rint(srgb * 255), 0, 255).astype(np.uint8)
+
+    srgb.flags.writeable = False
+
+    return srgb
+
+
+def srgbToLinear(img: np.typing.NDArray) -> np.typing.NDArray:
+    """Converts a np.uint8 sRGB image to linear light. Blurring, stretching the contrast or dithering in linear light
+    mixes the colors the same way light does, so there are no dark halos around bright edges and no extra banding in the shadows.
+    This is a single lookup per pixel, instead of a np.power() over the whole image.
+
+    Args:
+        img (np.typing.NDArray): The np.uint8 image.
+
+    Returns:
+        np.typing.NDArray (np.float32): The image in linear light, in the range [0, 1].
+    """
+    return srgbDecodeTable()[img]
+
+
+def linearToSrgb(img: np.typing.NDArray, out: np.typing.NDArray = None) -> np.typing.NDArray:
+    """Converts an image in linear light (in the range [0, 1]) back to np.uint8 sRGB with a lookup in srgbEncodeTable().
+    The values are clipped to [0, 1] first.
+
+    Args:
+        img (np.typing.NDArray): The image in linear light.
+        out (np.typing.NDArray): Where to write the sRGB image. Must be np.uint8 with the same shape as img. By default, a new array is created.
+
+    Returns:
+        np.typing.NDArray (np.uint8): The sRGB image.
+    """
+    idx  = np.clip(img, 0, 1).astype(np.float32)
+    idx *= srgbEncodeTableSize - 1
+    idx += 0.5
+
+    return buffers.lookup(srgbEncodeTable(), idx.astype(np.uint16), out)
+
+
+def rgb2ycbcr(img: np.typing.NDArray) -> np.typing.NDArray:
+    """Converts an RGB image to YCbCr (https://en.wikipedia.org/wiki/YCbCr). Y is the brightness, and Cb and Cr are how far the color
+    is from gray towards blue and red. It's a single 3x3 matrix multiplication per pixel.
+
+    Args:
+        img (np.typing.NDArray): The np.uint8 RGB image in the format (H, W, 3).
+
+    Returns:
+        np.typing.NDArray (np.float32): The YCbCr image. All 3 channels are in the range [0, 255].
+    """
+    img = np.asarray(img, dtype=np.float32) @ rgb2ycbcrMatrix.T
+    img += ycbcrOffset
+
+    return img
+
+
+def ycbcr2rgb(img: np.typing.NDArray) -> np.typing.NDArray:
+    """Converts a YCbCr image back to RGB. See rgb2ycbcr().
+
+    Args:
+        img (np.typing.NDArray): The YCbCr image in the format (H, W, 3).
+
+    Returns:
+        np.typing.NDArray (np.uint8): The RGB image.
+    """
+    img = (np.asarray(img, dtype=np.float32) - ycbcrOffset) @ np.linalg.inv(rgb2ycbcrMatrix).T
+
+    return np.clip(np.rint(img), 0, 255).astype(np.uint8)
+
+
+@functools.lru_cache(maxsize=None)
+def labCubeRootTable() -> np.typing.NDArray:
+    """The function f(t) used by CIELAB (https://en.wikipedia.org/wiki/CIELAB_color_space#From_CIEXYZ_to_CIELAB), for
+    labTableSize values of t evenly spaced in [0, 1]. It's a cube root, except close to 0, where it's a straight line.
+
+    Returns:
+        np.typing.NDArray (np.float32): The values of f(t).
+    """
+    t = np.linspace(0, 1, labTableSize, dtype=np.float64)
+    f = np.where(t > labDelta ** 3, np.cbrt(t), t / (3 * labDelta ** 2) + 4 / 29).astype(np.float32)
+
+    f.flags.writeable = False
+
+    return f
+
+
+def rgb2lab(img: np.typing.NDArray) -> np.typing.NDArray:
+    """
+    Converts an image from RGB to CIELAB (https://en.wikipedia.org/wiki/CIELAB_color_space). In CIELAB, the distance between two colors
+    is close to how different they look, which makes it much better than RGB for finding the closest color in a palette.
+    The backend that does the actual work is chosen by backends.dispatch(). See rgb2labNumpy() for the details.
+
+    Args:
+        img (np.typing.NDArray): The np.uint8 RGB image in the format (H, W, 3).
+
+    Returns:
+        np.typing.NDArray (np.float32): The CIELAB image. L is in [0, 100], and a and b are roughly in [-128, 127].
+    """
+    return backends.dispatch("rgb2lab", img)
+
+
+def rgb2labNumpy(img: np.typing.NDArray) -> np.typing.NDArray:
+    """
+    The Numpy implementation of rgb2lab(). The steps are:
+        1. sRGB -> linear light with srgbToLinear() (a lookup in a 256-entry table).
+        2. Linear light -> XYZ divided by the white point, which is a single 3x3 matrix multiplication.
+        3. The cube root of each channel. Computing cube roots is slow, so this is a lookup in labCubeRootTable().
+        4. L, a and b are differences between the 3 cube roots.
+    """
+    xyz  = srgbToLinear(img) @ rgb2labMatrix.T
+
+    idx  = np.clip(xyz, 0, 1)
+    idx *= labTableSize - 1
+    idx += 0.5
+    f    = labCubeRootTable()[idx.astype(np.uint16)]
+
+    fx, fy, fz = f[..., 0], f[..., 1], f[..., 2]
+
+    return np.stack([116 * fy - 16, 500 * (fx - fy), 200 * (fy - fz)], axis=-1)
+
+
+def lab2rgb(img: np.typing.NDArray) -> np.typing.NDArray:
+    """Converts a CIELAB image back to RGB. See rgb2lab().
+
+    Args:
+        img (np.typing.NDArray): The CIELAB image in the format (H, W, 3).
+
+    Returns:
+        np.typing.NDArray (np.uint8): The RGB image.
+    """
+    img = np.asarray(img, dtype=np.float32)
+
+    fy = (img[..., 0] + 16) / 116
+    f  = np.stack([fy + img[..., 1] / 500, fy, fy - img[..., 2] / 200], axis=-1)
+
+    # The inverse of the cube root is cheap, so there's no need for a table here
+    xyz = np.where(f > labDelta, f ** 3, 3 * labDelta ** 2 * (f - 4 / 29)).astype(np.float32)
+
+    return linearToSrgb(xyz @ lab2rgbMatrix.T)
+
+
+def rgb2hsv(img: np.typing.NDArray, out: np.typing.NDArray = None) -> np.typing.NDArray:
+    """
+    Converts an image from the RGB color model into the HSV color model. The backend that does the
+    actual work is chosen by backends.dispatch(). See rgb2hsvNumpy() for the details of the conversion.
+
+    Args:
+        img (np.typing.NDArray): The RGB image.
+        out (np.typing.NDArray): Where to write the HSV image. Must be np.float32 with the same shape as img.
+                                 By default, a new array is created.
+
+    Returns:
+        np.typing.NDArray: The HSV image.
+    """
+    return backends.dispatch("rgb2hsv", img, out)
+
+
+def rgb2hsvTiled(img: np.typing.NDArray, out: np.typing.NDArray = None) -> np.typing.NDArray:
+    """
+    Same as rgb2hsvNumpy, but the image is split into horizontal tiles that are converted in parallel.
+    Every pixel is converted independently of the others, so there's no need to worry about the borders of the tiles.
+    Each tile is written straight into its rows of the result, so the tiles never have to be put together.
+    """
+    if out is None:
+        out = np.empty(img.shape, dtype=np.float32)
+
+    backends.parallelRows(lambda startRow, endRow: rgb2hsvNumpy(img[startRow : endRow], out[startRow : endRow]), img.shape[0])
+
+    return out
+
+
+def rgb2hsvNumpy(img: np.typing.NDArray, out: np.typing.NDArray = None) -> np.typing.NDArray:
     """
     Converts an image from the RGB color model into the HSV color model (https://en.wikipedia.org/wiki/HSL_and_HSV#From_RGB)!
 
@@ -44,6 +272,7 @@ def rgb2hsv(img: np.typing.NDArray) -> np.typing.NDArray:
 
     Args:
         img (np.typing.NDArray): The RGB image.
+        out (np.typing.NDArray): Where to write the HSV image. By default, a new array is created.
 
     Returns:
         np.typing.NDArray: The HSV image.
@@ -156,6 +385,13 @@ def rgb2hsv(img: np.typing.NDArray) -> np.typing.NDArray:
     saturationChannel[maskBlueChannel  & nonZeroDelta & nonZeroCmax] = delta[maskBlueChannel  & nonZeroDelta & nonZeroCmax] / Cmax[maskBlueChannel  & nonZeroDelta & nonZeroCmax]
     
 
+    # When there's somewhere to write the result, each channel is written straight into it
+    if out is not None:
+        for channel, values in enumerate([hueChannel, saturationChannel, valueChannel]):
+            out[..., channel] = values.reshape(originalImgShape[:-1])
+
+        return out
+
     # Stack each of the Hue, Saturation and Value channels on top of one another.
     hsvImg = np.stack([hueChannel, saturationChannel, valueChannel], axis=1)
 
@@ -167,13 +403,43 @@ def rgb2hsv(img: np.typing.NDArray) -> np.typing.NDArray:
 
 
 
-def hsv2rgb(hsvImg: np.typing.NDArray) -> np.typing.NDArray:
+def hsv2rgb(hsvImg: np.typing.NDArray, out: np.typing.NDArray = None) -> np.typing.NDArray:
+    """
+    Converts an image from the HSV color model back into the RGB color model. The backend that does the
+    actual work is chosen by backends.dispatch(). See hsv2rgbNumpy() for the details of the conversion.
+
+    Args:
+        hsvImg (np.typing.NDArray): The HSV image.
+        out (np.typing.NDArray)   : Where to write the RGB image. Must be np.uint8 with the same shape as hsvImg.
+                                    By default, a new array is created.
+
+    Returns:
+        np.typing.NDArray: The RGB Image
+    """
+    return backends.dispatch("hsv2rgb", hsvImg, out)
+
+
+def hsv2rgbTiled(hsvImg: np.typing.NDArray, out: np.typing.NDArray = None) -> np.typing.NDArray:
+    """
+    Same as hsv2rgbNumpy, but the image is split into horizontal tiles that are converted in parallel.
+    Each tile is written straight into its rows of the result.
+    """
+    if out is None:
+        out = np.empty(hsvImg.shape, dtype=np.uint8)
+
+    backends.parallelRows(lambda startRow, endRow: hsv2rgbNumpy(hsvImg[startRow : endRow], out[startRow : endRow]), hsvImg.shape[0])
+
+    return out
+
+
+def hsv2rgbNumpy(hsvImg: np.typing.NDArray, out: np.typing.NDArray = None) -> np.typing.NDArray:
     """
     The formula for conversion can be found in https://en.wikipedia.org/wiki/HSL_and_HSV#HSV_to_RGB
 
     
     Args:
         hsvImg (np.typing.NDArray): The HSV image.
+        out (np.typing.NDArray)   : Where to write the RGB image. By default, a new array is created.
 
     Returns:
         np.typing.NDArray: The RGB Image
@@ -236,4 +502,4 @@ def hsv2rgb(hsvImg: np.typing.NDArray) -> np.typing.NDArray:
     rgbImg = rgbImg.reshape(originalShape)
     
     # Done!
-    return rgbImg
\ No newline at end of file
+    return buffers.writeInto(rgbImg, out)
\ No newline at end of file
@@ -1,11 +1,70 @@
 """
 Numpy doesn't support 2d convolution operations, so I implemented my own.
+
+There are four implementations (backends) of the convolution, and include/utils/backends.py picks the best one for each image:
+    * convolve2dNumpy: A sliding window + a dot product. This is the reference implementation.
+    * convolve2dTiled: The same sliding window, but the image is split in horizontal tiles that run in parallel.
+                       This also uses way less memory, because the sliding window makes a copy of each tile instead of the whole image.
+    * convolve2dFFT   : Uses the Fast Fourier Transform (https://en.wikipedia.org/wiki/Convolution_theorem). Its cost doesn't depend
+                       on the kernel size, so it's the fastest one for big kernels.
+    * convolve2dShifted: Adds up shifted views of the padded image, one per non-zero element of the kernel. There's no copy at all,
+                       so it's the fastest one for small kernels like Sobel and Prewitt, which are mostly zeros.
 """
 
+import os
+
 import numpy as np
 
+import include.utils.backends as backends
+
+
+# How many pixels convolveSeparable() convolves at a time. Each tile needs a few np.float32 buffers of this size, which have to fit in the cache.
+separableTilePixels = 2**17
+
 
 def convolve2d(img: np.typing.NDArray, kernel: np.typing.NDArray, padMode="constant") -> np.typing.NDArray:
+    """
+    Performs a convolution operation (https://en.wikipedia.org/wiki/Convolution) in a 2d image 
+    using a given kernel. The backend that does the actual work is chosen by backends.dispatch().
+
+    Args:
+        img (np.typing.NDArray)   : The image.
+        kernel (np.typing.NDArray): The kernel. Must be odd-sized (3x3, 5x5, 7x7, etc).
+        padMode (str)               : What mode to use with np.pad(). The default is padMode="constant"
+
+    Returns:
+        np.typing.NDArray: The convolved image.
+    """
+    return backends.dispatch("convolve2d", img, kernel, padMode)
+
+
+def convolveValid(img: np.typing.NDArray, kernel: np.typing.NDArray) -> np.typing.NDArray:
+    """Convolves an image that was already padded. The result is smaller than img by kernel.shape - 1 pixels
+    in each dimension, because only the positions where the kernel fully fits inside img are computed.
+    """
+    kernelHeight, kernelWidth = kernel.shape
+    outputHeight = img.shape[0] - kernelHeight + 1
+    outputWidth  = img.shape[1] - kernelWidth  + 1
+
+    # Creates a sliding window view into the array using the kernel shape.
+    patches = np.lib.stride_tricks.sliding_window_view(img, kernel.shape)
+
+    # Reshape the arrays so they match dimensionality and shape.
+    patches = patches.reshape(-1, kernelHeight * kernelWidth)
+    kernel  = kernel.flatten()
+
+    # Some kernels (like Sobel) add up to zero when summing all the elements,
+    # so doing np.sum(kernel) straight away could lead to a division by zero error.
+    kernelSum = np.sum(kernel)
+    kernelSum = kernelSum if kernelSum != 0 else 1
+
+    # Perform the convolution operation.
+    img = (np.dot(patches, kernel) / kernelSum).astype(np.float32)
+
+    return img.reshape(outputHeight, outputWidth)
+
+
+def convolve2dNumpy(img: np.typing.NDArray, kernel: np.typing.NDArray, padMode="constant") -> np.typing.NDArray:
     """
     Performs a convolution operation (https://en.wikipedia.org/wiki/Convolution) in a 2d image 
     using a given kernel.
@@ -27,8 +86,7 @@ def convolve2d(img: np.typing.NDArray, kernel: np.typing.NDArray, padMode="const
         np.typing.NDArray: The convolved image.
     """
 
-    originalImgHeight, originalImgWidth = img.shape
-    kernelHeight, kernelWidth           = kernel.shape
+    kernelWidth = kernel.shape[1]
 
     # Determine the padding size (number of pixels to add on each side)
     # based on the kernel width. (Assumes an odd kernel size.)
@@ -37,21 +95,175 @@ def convolve2d(img: np.typing.NDArray, kernel: np.typing.NDArray, padMode="const
     # Pad the image with padding on all sides.
     img = np.pad(img, ((padding, padding), (padding, padding)), mode=padMode)
 
-    # Creates a sliding window view into the array using the kernel shape.
-    patches = np.lib.stride_tricks.sliding_window_view(img, kernel.shape)
+    return convolveValid(img, kernel)
 
-    # Reshape the arrays so they match dimensionality and shape.
-    patches = patches.reshape(-1, kernelHeight * kernelWidth)
-    kernel  = kernel.flatten()
 
-    # Some kernels (like Sobel) add up to zero when summing all the elements,
-    # so doing np.sum(kernel) straight away could lead to a division by zero error.
+def convolve2dTiled(img: np.typing.NDArray, kernel: np.typing.NDArray, padMode="constant") -> np.typing.NDArray:
+    """
+    Same as convolve2dNumpy, but the image is split into horizontal tiles that are convolved in parallel.
+    Each tile also needs the `padding` rows above and below it, so the kernel has all the pixels it needs at the borders of the tile.
+
+    Args:
+        img (np.typing.NDArray)   : The image.
+        kernel (np.typing.NDArray): The kernel. Must be odd-sized (3x3, 5x5, 7x7, etc).
+        padMode (str)               : What mode to use with np.pad(). The default is padMode="constant"
+
+    Returns:
+        np.typing.NDArray: The convolved image.
+    """
+    padding = kernel.shape[1] // 2
+    img     = np.pad(img, ((padding, padding), (padding, padding)), mode=padMode)
+
+    # The number of rows in the original image
+    nRows = img.shape[0] - 2 * padding
+
+    def convolveTile(startRow, endRow):
+        return convolveValid(img[startRow : endRow + 2 * padding], kernel)
+
+    # Keep every tile at around 1 megapixel so the sliding window copies stay small
+    nTiles = max(nRows * img.shape[1] // 2**20, 4 * os.cpu_count())
+
+    return np.concatenate(backends.parallelRows(convolveTile, nRows, nTiles), axis=0)
+
+
+def convolve2dFFT(img: np.typing.NDArray, kernel: np.typing.NDArray, padMode="constant") -> np.typing.NDArray:
+    """
+    Performs the convolution using the Convolution Theorem (https://en.wikipedia.org/wiki/Convolution_theorem):
+    a convolution in the spatial domain is the same as a multiplication in the frequency domain.
+
+    Since this function is a cross-correlation (see convolve2dNumpy), the kernel is flipped before going into the
+    frequency domain. The image is padded just like in the other backends, so the FFT's circular convolution never wraps
+    around the borders of the area that we keep.
+
+    Args:
+        img (np.typing.NDArray)   : The image.
+        kernel (np.typing.NDArray): The kernel. Must be odd-sized (3x3, 5x5, 7x7, etc).
+        padMode (str)               : What mode to use with np.pad(). The default is padMode="constant"
+
+    Returns:
+        np.typing.NDArray: The convolved image.
+    """
+    originalImgHeight, originalImgWidth = img.shape
+    kernelHeight, kernelWidth           = kernel.shape
+
+    padding = kernelWidth // 2
+    img     = np.pad(img, ((padding, padding), (padding, padding)), mode=padMode)
+
     kernelSum = np.sum(kernel)
     kernelSum = kernelSum if kernelSum != 0 else 1
 
-    # Perform the convolution operation.
-    img = (np.dot(patches, kernel) / kernelSum).astype(np.float32)
-    
-    img = img.reshape(originalImgHeight, originalImgWidth)
-    
-    return img
\ No newline at end of file
+    # Flip the kernel to turn the convolution into a cross-correlation
+    flippedKernel = kernel[::-1, ::-1] / kernelSum
+
+    imgFrequencies    = np.fft.rfft2(img,           s=img.shape)
+    kernelFrequencies = np.fft.rfft2(flippedKernel, s=img.shape)
+
+    scale = np.abs(img).max(initial=0) * np.abs(flippedKernel).sum()
+
+    img = np.fft.irfft2(imgFrequencies * kernelFrequencies, s=img.shape)
+
+    # The pixel (row, column) of the cross-correlation ends up in (row + kernelHeight - 1, column + kernelWidth - 1)
+    img = img[kernelHeight - 1 : kernelHeight - 1 + originalImgHeight, kernelWidth - 1 : kernelWidth - 1 + originalImgWidth]
+    img = img.astype(np.float32)
+
+    # The FFT never gives an exact 0. Where the other backends give 0 (like a derivative kernel on a flat area), it gives
+    # something like 1e-6 with a random sign, which is enough to flip the direction of an edge in atan2(). Anything smaller
+    # than the rounding error of the FFT is noise, so it becomes 0.
+    img[np.abs(img) <= 8 * np.finfo(np.float32).eps * scale] = 0
+
+    return img
+
+def convolve2dShifted(img: np.typing.NDArray, kernel: np.typing.NDArray, padMode="constant") -> np.typing.NDArray:
+    """
+    Performs the convolution by adding up shifted views of the padded image. The element kernel[i, j] multiplies every pixel
+    of the image shifted by i rows and j columns, so the whole convolution is one multiply-add of the full image per element
+    of the kernel. Elements that are zero are skipped.
+
+    Args:
+        img (np.typing.NDArray)   : The image.
+        kernel (np.typing.NDArray): The kernel. Must be odd-sized (3x3, 5x5, 7x7, etc).
+        padMode (str)               : What mode to use with np.pad(). The default is padMode="constant"
+
+    Returns:
+        np.typing.NDArray: The convolved image.
+    """
+    originalImgHeight, originalImgWidth = img.shape
+    kernelHeight, kernelWidth           = kernel.shape
+
+    padding = kernelWidth // 2
+    img     = np.pad(img.astype(np.float32), ((padding, padding), (padding, padding)), mode=padMode)
+
+    # All the multiplications reuse the same temporary buffer, instead of allocating a new full-size image for each of them
+    out       = np.zeros((originalImgHeight, originalImgWidth), dtype=np.float32)
+    temporary = np.empty_like(out)
+    for row in range(kernelHeight):
+        for column in range(kernelWidth):
+            weight  = kernel[row, column]
+            shifted = img[row : row + originalImgHeight, column : column + originalImgWidth]
+
+            # Weights of 1 and -1 are really common (Sobel, Prewitt, Box Blur), and they don't need a multiplication
+            if weight == 0:
+                continue
+            elif weight == 1:
+                out += shifted
+            elif weight == -1:
+                out -= shifted
+            else:
+                np.multiply(shifted, np.float32(weight), out=temporary)
+                out += temporary
+
+    kernelSum = np.sum(kernel)
+    if kernelSum != 0 and kernelSum != 1:
+        out /= np.float32(kernelSum)
+
+    return out
+
+
+def convolveSeparable(img: np.typing.NDArray, kernel: np.typing.NDArray, padMode="constant") -> np.typing.NDArray:
+    """
+    Convolves a 2d image with a separable kernel (https://en.wikipedia.org/wiki/Separable_filter), that is, a 2d kernel
+    that is the outer product of a 1d kernel with itself. Gaussian and box blurs are both separable.
+
+    Instead of multiplying every pixel by the k * k elements of the 2d kernel, we convolve the rows with the 1d kernel and
+    then the columns, which is only 2 * k multiplications per pixel. Each step is just a weighted sum of shifted views of the
+    padded image, so there's no need for a sliding window copy either.
+
+    Every step goes through the whole image k times, so the image is split into horizontal tiles that are small enough to stay
+    in the cache while they are being convolved. The tiles also run in parallel. Like in convolve2dTiled(), each tile needs the
+    `padding` rows above and below it.
+
+    Args:
+        img (np.typing.NDArray)   : The image.
+        kernel (np.typing.NDArray): The 1d kernel. Must be odd-sized and should already be normalized.
+        padMode (str)             : What mode to use with np.pad(). The default is padMode="constant"
+
+    Returns:
+        np.typing.NDArray: The convolved image (np.float32).
+    """
+    originalImgHeight, originalImgWidth = img.shape
+    padding = len(kernel) // 2
+
+    img = np.pad(img.astype(np.float32), ((padding, padding), (padding, padding)), mode=padMode)
+    out = np.empty((originalImgHeight, originalImgWidth), dtype=np.float32)
+
+    def convolveTile(startRow, endRow):
+        tile = img[startRow : endRow + 2 * padding]
+
+        # Convolve the rows
+        rows      = np.zeros((tile.shape[0], originalImgWidth), dtype=np.float32)
+        temporary = np.empty_like(rows)
+        for idx, weight in enumerate(kernel):
+            np.multiply(tile[:, idx : idx + originalImgWidth], np.float32(weight), out=temporary)
+            rows += temporary
+
+        # And then the columns
+        tileOut      = out[startRow : endRow]
+        tileOut[...] = 0
+        temporary    = temporary[:endRow - startRow]
+        for idx, weight in enumerate(kernel):
+            np.multiply(rows[idx : idx + endRow - startRow], np.float32(weight), out=temporary)
+            tileOut += temporary
+
+    backends.parallelRows(convolveTile, originalImgHeight, max(originalImgHeight * originalImgWidth // separableTilePixels, 4 * os.cpu_count()))
+
+    return out
@@ -0,0 +1,311 @@
+"""
+Imageio.py is where I handle reading images from disk and writing the processed results back.
+Besides the regular RGB/Grayscale output, it also knows how to write indexed (palette-mode) images,
+which are a much better fit for quantized images (https://en.wikipedia.org/wiki/Indexed_color).
+
+It also reads and writes uncompressed .npy and raw interleaved np.uint8 files through np.memmap
+(https://numpy.org/doc/stable/reference/generated/numpy.memmap.html). These skip the PNG decoding/encoding
+completely and only load the parts of the file that are actually touched, which makes a huge difference
+with really big images or when chaining several runs together.
+
+Animations (GIF/APNG) and numbered frame sequences (like frames/frame_%04d.png) are read and written one frame at a time.
+"""
+
+import os
+import re
+
+import numpy as np
+import PIL.Image
+import PIL.ImageSequence
+
+
+# File extensions that are read and written as memory-mapped arrays instead of going through PIL
+arrayExtensions = (".npy", ".raw")
+
+# The printf integer field that is replaced by the frame number in frame sequences (%d, %4d, %04d...)
+framePattern = re.compile(r"%0?\d*d")
+
+
+def isArrayFile(path: str) -> bool:
+    """Returns True if the path points to a .npy or .raw file.
+    """
+    return os.path.splitext(path)[1].lower() in arrayExtensions
+
+
+def parseRawShape(rawShape: str) -> tuple:
+    """Parses a shape in the format HxWxC (or HxW for grayscale images) into a tuple.
+
+    Args:
+        rawShape (str): The shape. For example, "1080x1920x3".
+
+    Returns:
+        tuple: The shape in the (H, W, C) format.
+    """
+    shape = tuple(int(dimension) for dimension in rawShape.lower().split("x"))
+
+    if len(shape) == 2:
+        shape = shape + (1,)
+
+    if len(shape) != 3 or min(shape) <= 0:
+        raise ValueError(f"Invalid raw shape '{rawShape}'. Must be in the format HxWxC or HxW")
+
+    return shape
+
+
+def isFrameSequence(path: str) -> bool:
+    """Returns True if the path is a pattern for a numbered sequence of frames, like frames/frame_%04d.png.
+    Any other % (like in 100%.png) is just part of the name.
+    """
+    return framePattern.search(path) is not None
+
+
+def framePath(path: str, idx: int) -> str:
+    """Returns the path of a frame of a sequence. Only the first integer field is replaced, so the rest of the path
+    is used as it is even if it has other % in it.
+
+    Args:
+        path (str): The pattern of the sequence. For example, frames/frame_%04d.png.
+        idx (int) : The number of the frame.
+
+    Returns:
+        str: The path of the frame. For example, frames/frame_0007.png.
+    """
+    return framePattern.sub(lambda field: field.group() % idx, path, count=1)
+
+
+def isAnimation(path: str) -> bool:
+    """Returns True if the path is a frame sequence or an image with more than one frame (an animated GIF, APNG or WebP).
+    """
+    if isFrameSequence(path):
+        return True
+
+    if isArrayFile(path):
+        return False
+
+    with PIL.Image.open(path) as img:
+        return getattr(img, "n_frames", 1) > 1
+
+
+def iterFrames(path: str):
+    """Reads the frames of an animation or a frame sequence one at a time, so only one of them is in memory at any moment.
+
+    Frame sequences are numbered from 0 (or 1, if there's no frame 0) and end at the first missing number.
+
+    Args:
+        path (str): The path to the animation, or the pattern of the frame sequence (for example, frames/frame_%04d.png).
+
+    Yields:
+        tuple: (frame, duration). frame is a np.uint8 RGB image in the format (H, W, 3) and duration is how long the frame is shown,
+        in milliseconds.
+    """
+    def toArray(frame):
+        # GIF frames are stored as palette indices, so they have to be converted before anything else.
+        # Grayscale frames are also converted, since the pipeline expects RGB images (-g converts them back).
+        return np.asarray(frame.convert("RGB"), dtype=np.uint8)
+
+    if isFrameSequence(path):
+        idx = 0 if os.path.exists(framePath(path, 0)) else 1
+        while os.path.exists(framePath(path, idx)):
+            with PIL.Image.open(framePath(path, idx)) as frame:
+                yield toArray(frame), frame.info.get("duration", 100)
+
+            idx += 1
+
+        return
+
+    with PIL.Image.open(path) as img:
+        for frame in PIL.ImageSequence.Iterator(img):
+            yield toArray(frame), frame.info.get("duration", 100)
+
+
+def loadImage(path: str, rawShape: str = None) -> np.typing.NDArray:
+    """Opens an image. PNGs, JPEGs and anything else that PIL supports is fully decoded into memory.
+    .npy and .raw files are memory-mapped in read-only mode, so no data is copied until an effect actually reads it.
+
+    Args:
+        path (str)    : The path to the image.
+        rawShape (str): The shape of the image in the format HxWxC. Only needed for .raw files, since they don't have a header.
+
+    Returns:
+        np.typing.NDArray: The image as a np.uint8 array.
+    """
+    extension = os.path.splitext(path)[1].lower()
+
+    if extension == ".npy":
+        img = np.load(path, mmap_mode="r")
+
+        if img.dtype != np.uint8:
+            raise ValueError(f"{path} has dtype {img.dtype}, but only np.uint8 images are supported")
+
+        return img
+
+    if extension == ".raw":
+        if rawShape is None:
+            raise ValueError("The shape of a .raw image must be specified with --raw-shape")
+
+        return np.memmap(path, dtype=np.uint8, mode="r", shape=parseRawShape(rawShape))
+
+    img = PIL.Image.open(path)
+
+    return np.asarray(img, dtype=np.uint8)
+
+
+def saveArray(img: np.typing.NDArray, path: str):
+    """Saves the image as a .npy or a .raw file. The file is created as a writable memory map and
+    the image is copied straight into it, so the OS can flush it to disk from the page cache whenever it wants.
+
+    Args:
+        img (np.typing.NDArray): The image.
+        path (str)             : Where to save the image. Must end with .npy or .raw.
+    """
+    if path.lower().endswith(".npy"):
+        out = np.lib.format.open_memmap(path, mode="w+", dtype=img.dtype, shape=img.shape)
+    else:
+        out = np.memmap(path, mode="w+", dtype=img.dtype, shape=img.shape)
+
+    out[...] = img
+    out.flush()
+
+    # Release the memory map
+    del out
+
+
+def toIndexed(img: np.typing.NDArray):
+    """Converts an image into a palette + an array of indices into that palette.
+    Only works if the image has at most 256 different colors, because the indices are stored as np.uint8.
+
+    Args:
+        img (np.typing.NDArray): The image. Can be in the format (H, W), (H, W, 1) or (H, W, 3).
+
+    Returns:
+        tuple: (indices, palette). indices is a (H, W) np.uint8 array and palette is a (nColors, C) np.uint8 array.
+        If the image has more than 256 colors, returns (None, None).
+    """
+    if img.ndim == 2:
+        img = np.expand_dims(img, axis=2)
+
+    if img.shape[-1] == 1:
+        # Grayscale images only have 256 possible values, so they always fit in a palette and
+        # a bincount is enough to find the ones that are used.
+        usedColors = np.flatnonzero(np.bincount(img.ravel(), minlength=256))
+
+        remap = np.zeros(256, dtype=np.uint8)
+        remap[usedColors] = np.arange(len(usedColors))
+
+        return remap[img[..., 0]], usedColors.astype(np.uint8).reshape(-1, 1)
+
+    # For RGB images, pack the 3 channels of each pixel in a single np.uint32 so we can
+    # find the unique colors with a single np.unique call.
+    img    = img.astype(np.uint32)
+    packed = (img[..., 0] << 16) | (img[..., 1] << 8) | img[..., 2]
+
+    usedColors, indices = np.unique(packed.ravel(), return_inverse=True)
+    if len(usedColors) > 256:
+        return None, None
+
+    palette = np.stack([(usedColors >> 16) & 0xFF, (usedColors >> 8) & 0xFF, usedColors & 0xFF], axis=1).astype(np.uint8)
+
+    return indices.reshape(packed.shape).astype(np.uint8), palette
+
+
+def saveImage(img: np.typing.NDArray, path: str, compressLevel: int = 6, optimize: bool = False):
+    """Saves a regular (Grayscale or RGB) image.
+
+    Args:
+        img (np.typing.NDArray): The image. Must be np.uint8 in the format (H, W) or (H, W, 3).
+        path (str)             : Where to save the image. The format is inferred from the extension.
+        compressLevel (int)    : The zlib compression level (0-9) used for PNGs. Lower is faster, higher is smaller.
+        optimize (bool)        : Makes the encoder try harder to get a smaller file. Slower.
+    """
+    img = PIL.Image.fromarray(img)
+    img.save(path, compress_level=compressLevel, optimize=optimize)
+
+
+def saveIndexed(indices: np.typing.NDArray, palette: np.typing.NDArray, path: str, compressLevel: int = 6, optimize: bool = False):
+    """Saves an image in palette mode ('P' mode in PIL). Each pixel is stored as a single byte that indexes
+    into the palette, so there's 3x less data to compress than with a regular RGB image.
+
+    Args:
+        indices (np.typing.NDArray): The (H, W) np.uint8 array of palette indices.
+        palette (np.typing.NDArray): The (nColors, C) np.uint8 palette. C can be 1 (Grayscale) or 3 (RGB).
+        path (str)                 : Where to save the image. Should be a .png or a .gif.
+        compressLevel (int)        : The zlib compression level (0-9) used for PNGs. Lower is faster, higher is smaller.
+        optimize (bool)            : Makes the encoder try harder to get a smaller file. Slower.
+    """
+    img = indexedImage(indices, palette)
+    img.save(path, compress_level=compressLevel, optimize=optimize)
+
+
+def indexedImage(indices: np.typing.NDArray, palette: np.typing.NDArray) -> PIL.Image.Image:
+    """Builds a PIL image in palette mode from an array of palette indices and a palette. See saveIndexed().
+    """
+    # PIL always expects an RGB palette
+    if palette.shape[-1] == 1:
+        palette = np.repeat(palette, repeats=3, axis=1)
+
+    img = PIL.Image.fromarray(indices)
+    img.putpalette(palette.astype(np.uint8).ravel().tolist())
+
+    return img
+
+
+class AnimationWriter:
+    """
+    Writes the processed frames of an animation as they come.
+
+    If the output is a frame sequence (for example, out/frame_%04d.png), every frame is saved as soon as it's added, so memory stays
+    bounded no matter how long the animation is. Otherwise, the frames are saved as a single animation (GIF, APNG or WebP) when the writer is
+    closed. PIL needs all of them at once for that, so each frame is kept in palette mode whenever possible, which is 1 byte per pixel.
+    """
+
+    def __init__(self, path: str, indexed: bool = False, compressLevel: int = 6, optimize: bool = False):
+        """
+        Args:
+            path (str)          : Where to save the animation, or the pattern of the frame sequence.
+            indexed (bool)      : Saves the frames in palette mode. GIFs are always saved in palette mode.
+            compressLevel (int) : The zlib compression level (0-9) used for PNGs.
+            optimize (bool)     : Makes the encoder try harder to get a smaller file. Slower.
+        """
+        self.path          = path
+        self.indexed       = indexed or path.lower().endswith(".gif")
+        self.compressLevel = compressLevel
+        self.optimize      = optimize
+
+        self.frames    = []
+        self.durations = []
+        self.nFrames   = 0
+
+    def addFrame(self, img: np.typing.NDArray, duration: int, indices: np.typing.NDArray = None, palette: np.typing.NDArray = None):
+        """Adds the next frame.
+
+        Args:
+            img (np.typing.NDArray)    : The frame. Must be np.uint8 in the format (H, W) or (H, W, 3).
+            duration (int)             : How long the frame is shown, in milliseconds.
+            indices (np.typing.NDArray): The palette indices of the frame, if they are already known. See quantize.paletteIndices().
+            palette (np.typing.NDArray): The palette that goes with indices.
+        """
+        if self.indexed and indices is None:
+            indices, palette = toIndexed(img)
+
+        if indices is not None:
+            frame = indexedImage(indices, palette)
+        else:
+            frame = PIL.Image.fromarray(img)
+
+        if isFrameSequence(self.path):
+            frame.save(framePath(self.path, self.nFrames), compress_level=self.compressLevel, optimize=self.optimize)
+        else:
+            self.frames.append(frame)
+            self.durations.append(duration)
+
+        self.nFrames += 1
+
+    def close(self):
+        """Saves the animation. Does nothing for frame sequences, since their frames were already saved.
+        """
+        if isFrameSequence(self.path) or len(self.frames) == 0:
+            return
+
+        self.frames[0].save(self.path, save_all=True, append_images=self.frames[1:], duration=self.durations, loop=0,
+                            compress_level=self.compressLevel, optimize=self.optimize)
+        self.frames = []
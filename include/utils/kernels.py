@@ -1,3 +1,5 @@
+import functools
+
 import numpy as np
 
 boxBlur3x3 = np.asarray(
@@ -28,7 +30,7 @@ gaussianBlur5x5 = np.asarray(
                                 [1,  4,  7,  4, 1],
                                 [4, 16, 26, 16, 4],
                                 [7, 26, 41, 26, 7],
-                                [4, 16, 25, 16, 4],
+                                [4, 16, 26, 16, 4],
                                 [1,  4,  7,  4, 1]
                             ])
 
@@ -60,4 +62,51 @@ prewittVertical3x3 = np.asarray(
                                 [ 1, 0, -1],
                                 [ 1, 0, -1],
                                 [ 1, 0, -1]
-                            ])
\ No newline at end of file
+                            ])
+
+
+@functools.lru_cache(maxsize=64)
+def gaussianKernel1d(sigma: float) -> np.typing.NDArray:
+    """Generates a 1D Gaussian kernel (https://en.wikipedia.org/wiki/Gaussian_blur) for the given sigma.
+    The Gaussian is separable, so blurring the rows and then the columns with this kernel is the same as
+    blurring with the full 2D kernel. The kernels are cached, so each sigma is only generated once.
+
+    Args:
+        sigma (float): The standard deviation of the Gaussian.
+
+    Returns:
+        np.typing.NDArray: The normalized kernel. It has 2 * ceil(3 * sigma) + 1 elements, which covers 99.7% of the Gaussian.
+    """
+    radius = int(np.ceil(3 * sigma))
+    x      = np.arange(-radius, radius + 1, dtype=np.float64)
+
+    kernel = np.exp(-(x ** 2) / (2 * sigma ** 2))
+    kernel = kernel / kernel.sum()
+
+    # The kernel is cached, so make sure nobody changes it by accident
+    kernel.flags.writeable = False
+
+    return kernel
+
+
+def youngVanVlietCoefficients(sigma: float) -> tuple:
+    """Computes the coefficients of the recursive Gaussian filter by Young and van Vliet (https://doi.org/10.1016/0165-1684(95)00020-E).
+    The feedback coefficients are already divided by b0.
+
+    Args:
+        sigma (float): The standard deviation of the Gaussian. The formulas are only valid for sigma >= 0.5.
+
+    Returns:
+        tuple: (B, b1, b2, b3)
+    """
+    if sigma >= 2.5:
+        q = 0.98711 * sigma - 0.96330
+    else:
+        q = 3.97156 - 4.14554 * np.sqrt(1 - 0.26891 * sigma)
+
+    b0 = 1.57825 + 2.44413 * q + 1.4281 * q**2 + 0.422205 * q**3
+    b1 = 2.44413 * q + 2.85619 * q**2 + 1.26661 * q**3
+    b2 = -(1.4281 * q**2 + 1.26661 * q**3)
+    b3 = 0.422205 * q**3
+
+    return 1 - (b1 + b2 + b3) / b0, b1 / b0, b2 / b0, b3 / b0
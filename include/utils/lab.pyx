@@ -0,0 +1,76 @@
+# cython: boundscheck=False, wraparound=False, nonecheck=False, cdivision=True
+import numpy as np
+cimport numpy as np
+
+from cython.parallel import prange
+
+import importlib
+
+# 'include' is a reserved word in Cython, so the usual 'import include.utils.colormodel as colormodel' doesn't compile
+colormodel = importlib.import_module("include.utils.colormodel")
+
+
+# Looks up f(t) in the cube root table. t is clipped to [0, 1] first.
+cdef inline float cubeRootLookup(float t, float *cubeRoot, float scale) noexcept nogil:
+    if t < 0:
+        t = 0
+    elif t > 1:
+        t = 1
+
+    return cubeRoot[<Py_ssize_t> (t * scale + 0.5)]
+
+
+def rgb2lab(np.ndarray[np.uint8_t, ndim=3] img):
+    """
+    Converts an image from RGB to CIELAB. This does exactly the same steps as colormodel.rgb2labNumpy() (with the same tables),
+    but all of them are fused into a single pass over the image. Each pixel goes from np.uint8 RGB to Lab without writing anything
+    in between to memory, and the rows are converted in parallel.
+
+    Args:
+        img (np.typing.NDArray): The np.uint8 RGB image in the format (H, W, 3).
+
+    Returns:
+        np.typing.NDArray (np.float32): The CIELAB image.
+    """
+    cdef np.ndarray[np.uint8_t, ndim=3] src = np.ascontiguousarray(img)
+
+    cdef Py_ssize_t H = src.shape[0]
+    cdef Py_ssize_t W = src.shape[1]
+
+    cdef np.ndarray[np.float32_t, ndim=3] out = np.empty((H, W, 3), dtype=np.float32)
+
+    if H == 0 or W == 0:
+        return out
+
+    cdef np.ndarray[np.float32_t, ndim=1] decodeTable = np.ascontiguousarray(colormodel.srgbDecodeTable())
+    cdef np.ndarray[np.float32_t, ndim=1] cubeRoot    = np.ascontiguousarray(colormodel.labCubeRootTable())
+    cdef np.ndarray[np.float32_t, ndim=2] matrix      = np.ascontiguousarray(colormodel.rgb2labMatrix)
+
+    cdef float *decodePtr   = &decodeTable[0]
+    cdef float *cubeRootPtr = &cubeRoot[0]
+    cdef float *matrixPtr   = &matrix[0, 0]
+    cdef np.uint8_t *srcPtr = &src[0, 0, 0]
+    cdef float *outPtr      = &out[0, 0, 0]
+
+    cdef float scale = colormodel.labTableSize - 1
+
+    cdef Py_ssize_t row, column, pixel
+    cdef float red, green, blue, fx, fy, fz
+
+    for row in prange(H, nogil=True):
+        for column in range(W):
+            pixel = (row * W + column) * 3
+
+            red   = decodePtr[srcPtr[pixel]]
+            green = decodePtr[srcPtr[pixel + 1]]
+            blue  = decodePtr[srcPtr[pixel + 2]]
+
+            fx = cubeRootLookup(matrixPtr[0] * red + matrixPtr[1] * green + matrixPtr[2] * blue, cubeRootPtr, scale)
+            fy = cubeRootLookup(matrixPtr[3] * red + matrixPtr[4] * green + matrixPtr[5] * blue, cubeRootPtr, scale)
+            fz = cubeRootLookup(matrixPtr[6] * red + matrixPtr[7] * green + matrixPtr[8] * blue, cubeRootPtr, scale)
+
+            outPtr[pixel]     = 116 * fy - 16
+            outPtr[pixel + 1] = 500 * (fx - fy)
+            outPtr[pixel + 2] = 200 * (fy - fz)
+
+    return out
@@ -0,0 +1,101 @@
+"""
+Metrics.py measures how close a processed image is to the original one. PSNR (https://en.wikipedia.org/wiki/Peak_signal-to-noise_ratio)
+only looks at the difference between the pixels, while SSIM (https://en.wikipedia.org/wiki/Structural_similarity_index_measure)
+compares the brightness, contrast and structure of small windows, which is a lot closer to what we actually see.
+"""
+
+import numpy as np
+
+
+def psnr(original: np.typing.NDArray, processed: np.typing.NDArray) -> float:
+    """The Peak Signal-to-Noise Ratio between two np.uint8 images, in decibels. Higher is better, and identical images give infinity.
+
+    Args:
+        original (np.typing.NDArray) : The original image.
+        processed (np.typing.NDArray): The processed image, with the same shape.
+
+    Returns:
+        float: The PSNR.
+    """
+    difference = np.asarray(original, dtype=np.float32) - np.asarray(processed, dtype=np.float32)
+    mse        = float(np.mean(difference * difference))
+
+    if mse == 0:
+        return float("inf")
+
+    return 10 * np.log10(255 ** 2 / mse)
+
+
+def windowSums(img: np.typing.NDArray, windowSize: int) -> np.typing.NDArray:
+    """
+    The sum of every windowSize x windowSize window of a 2D image, using an integral image (https://en.wikipedia.org/wiki/Summed-area_table).
+    The integral image has, in each position, the sum of everything above and to the left of it. The sum of any window is then
+    just 4 lookups, no matter how big the window is, and all the windows are computed at once with shifted slices.
+
+    Only the windows that are completely inside the image are returned, so the result is (H - windowSize + 1, W - windowSize + 1).
+
+    Args:
+        img (np.typing.NDArray): The (H, W) image.
+        windowSize (int)       : The size of the window.
+
+    Returns:
+        np.typing.NDArray (np.float64): The sum of each window.
+    """
+    # float64, since the sums of squares get big enough to lose precision in float32
+    integral = np.zeros((img.shape[0] + 1, img.shape[1] + 1), dtype=np.float64)
+    np.cumsum(img, axis=0, dtype=np.float64, out=integral[1:, 1:])
+    np.cumsum(integral[1:, 1:], axis=1, out=integral[1:, 1:])
+
+    k = windowSize
+
+    return integral[k:, k:] - integral[:-k, k:] - integral[k:, :-k] + integral[:-k, :-k]
+
+
+def ssim(original: np.typing.NDArray, processed: np.typing.NDArray, windowSize: int = 7) -> float:
+    """
+    The Structural Similarity Index between two np.uint8 images. 1 means they are identical, and the lower it gets the more they differ.
+
+    For every windowSize x windowSize window, SSIM compares the means, the variances and the covariance of both images. All of
+    those come from window sums (see windowSums()) of x, y, x^2, y^2 and x * y, so the cost per pixel doesn't depend on the size of the window.
+    RGB images are compared one channel at a time, and the result is the average of all the windows of all the channels.
+
+    Args:
+        original (np.typing.NDArray) : The original image, in the format (H, W) or (H, W, C).
+        processed (np.typing.NDArray): The processed image, with the same shape.
+        windowSize (int)             : The size of the window. Default = 7.
+
+    Returns:
+        float: The SSIM.
+    """
+    original  = np.asarray(original,  dtype=np.float64)
+    processed = np.asarray(processed, dtype=np.float64)
+
+    if original.ndim == 2:
+        original  = np.expand_dims(original,  axis=2)
+        processed = np.expand_dims(processed, axis=2)
+
+    if min(original.shape[:2]) < windowSize:
+        raise ValueError(f"The image must be at least {windowSize}x{windowSize} pixels to compute the SSIM")
+
+    # The constants that keep the division stable when the means or variances are close to 0
+    C1 = (0.01 * 255) ** 2
+    C2 = (0.03 * 255) ** 2
+
+    nPixels = windowSize * windowSize
+    total   = 0.0
+    for channel in range(original.shape[-1]):
+        x = original[..., channel]
+        y = processed[..., channel]
+
+        meanX = windowSums(x, windowSize) / nPixels
+        meanY = windowSums(y, windowSize) / nPixels
+
+        # Var(x) = E[x^2] - E[x]^2, and the same for the covariance
+        varianceX  = windowSums(x * x, windowSize) / nPixels - meanX * meanX
+        varianceY  = windowSums(y * y, windowSize) / nPixels - meanY * meanY
+        covariance = windowSums(x * y, windowSize) / nPixels - meanX * meanY
+
+        ssimMap = ((2 * meanX * meanY + C1) * (2 * covariance + C2)) / ((meanX ** 2 + meanY ** 2 + C1) * (varianceX + varianceY + C2))
+        total  += ssimMap.mean()
+
+    return float(total / original.shape[-1])
@@ -1,54 +1,74 @@
 from argparse import ArgumentParser
+import copy
+
+import include.utils.imageio as imageio
+import include.utils.pipeline as pipeline
 
 
 def make_parser():
     parser     = ArgumentParser(description="Define the parameters")
 
     parser.add_argument('-i', '--image', type=str, required=True,
-                        help="The image that is going to be processed.")
-
-    parser.add_argument('-q', '--quantize', type=int, default=255,
-                        help='Quantizes the image according to an arbitrary number of colors. Does NOT dither the image, so expect major color banding.')
+                        help="The image that is going to be processed. .npy and .raw files are memory-mapped instead of decoded. " \
+                        "Animated GIFs/APNGs and numbered frame sequences (for example, frames/frame_%%04d.png) are processed one frame at a time.")
 
-    parser.add_argument('-d', '--dithering', choices=["ordered", "floyd-steinberg"], default=None,
-                        help='Quantizes the image, but this time applying dithering to the image to help minimize color banding. \
-                            The choices are either ordered dithering or floyd-steinberg dithering.')
+    parser.add_argument('--raw-shape', type=str, default=None,
+                        help="The shape of the image when reading a .raw file, in the format HxWxC (or HxW for grayscale images). " \
+                        "The file must contain interleaved np.uint8 pixels with no header.")
 
     parser.add_argument('-g', '--grayscale', action='store_true', default=False,
                         help='Converts the image to grayscale before processing. The output will also be a grayscale image.')
 
-    parser.add_argument('--hue', type=int, default=None,
-                        help="Specify a hue value (google HSV color wheel) to convert the image to a different color palette. \
-                            Super recommended to also use the -g option, because converting the color palette of an RGB image \
-                                tends to give weird results.")
+    parser.add_argument('--linear', action='store_true', default=False,
+                        help="Runs the contrast boost, sharpening, quantization, dithering and blur in linear light instead of on the gamma-encoded sRGB values. " \
+                        "This avoids dark halos around bright edges when blurring or sharpening, and keeps dithered shadows from looking too bright.")
 
-    parser.add_argument('--hue-range', type=int, default=0,
-                       help="By how much the hue in the color palette can vary. Default = 0.")
-    
-    parser.add_argument('--hue-reversed', action='store_true', default=False,
-                        help="Reverses the color pallete. Instead of [hue - hue_range, hue + hue_range], it changes to [hue + hue_range, hue - hue_range].")
+    # The options of each effect (--contrast, --quantize, --blur, ...) are declared next to the effect itself, in pipeline.py
+    pipeline.addOptions(parser)
+
+    parser.add_argument('--pipeline', type=str, default=None,
+                        help="The order in which the effects run, as a comma-separated list. For example, \"contrast,blur,sobel\" boosts the contrast, " \
+                        f"blurs and then detects the edges. It must list exactly the effects selected by the other options, each of them once. The effects are: {', '.join(pipeline.effectsByName)}. " \
+                        "Default = the order in that list.")
+
+    parser.add_argument('--output', '-o', type=str, default="./processed.png",
+                        help="Where to save the processed image. The format is inferred from the extension. .npy and .raw files are written " \
+                        "through a memory map with no encoding. Animations are saved as a GIF/APNG, or as a frame sequence if the path is a pattern " \
+                        "like out/frame_%%04d.png. Default = ./processed.png")
+
+    parser.add_argument('--indexed', action='store_true', default=False,
+                        help="Saves the image in palette mode (indexed PNG/GIF) instead of full RGB. Only works if the image ends up with at most 256 colors, " \
+                        "which is always the case for grayscale images and for RGB images quantized with 6 colors or less.")
 
-    parser.add_argument('--blur', '-b', type=str, choices=["boxblur3x3", "boxblur5x5", "gaussian3x3", "gaussian5x5"], default=None,
-                        help="Apply a blur filter in the image. Choose from the available implemented blur kernels.")
+    parser.add_argument('--compress-level', type=int, default=6,
+                        help="The PNG compression level, between 0 and 9. Lower values encode faster but give bigger files. Default = 6.")
 
-    parser.add_argument('--edge-detection', '-e', type=str, choices=["sobel", "prewitt"], default=None, 
-                        help="Detects edges in the image using one of the available algorithms.")
+    parser.add_argument('--optimize', action='store_true', default=False,
+                        help="Makes the encoder try harder to reduce the file size. Much slower, especially for big images.")
 
-    parser.add_argument('--edge-color', '-ec', type=int, default=-1, 
-                        help="Colors the detected edges with a specific color. -2 = All edges are white, -1 = Assigns a Hue value based on \
-                            the direction that the edges points to, any other value = colors all edges with that Hue value. Default = -1")
+    parser.add_argument('--preview', type=int, default=0,
+                        help="Runs the whole pipeline on a smaller version of the image, to quickly try out parameters on huge images. " \
+                        "The image is shrunk by 2^preview (1 = half the size, 2 = a quarter, ...), and every blur radius, structuring element and " \
+                        "dithering pattern is shrunk to match (the fixed size blur kernels are replaced by a Gaussian blur " \
+                        "of the same size). Prints the command that processes the image in full resolution with the same parameters. Default = 0 (disabled).")
 
-    parser.add_argument('--contrast', '-c', type=float, default=-1,
-                        help="By how much to boost the contrast in the image. Must be between 0 and 100. -c = 2 will take the 2% lowest and 2% highest colors" \
-                        "and equal them to 0 and 255 respectively and then scale the midtones.")
+    parser.add_argument('--profile', type=str, default=None,
+                        help="Measures the wall time and CPU time of every stage of the pipeline and saves the report in this JSON file.")
 
-    parser.add_argument('--brightness', '-br', type=int, default=-256,
-                        help="Boosts the brightness by the specified value. Must be between -255 and 255.")
+    parser.add_argument('--profile-trace', type=str, default=None,
+                        help="Same as --profile, but saves the measurements as a Chrome trace that can be opened in chrome://tracing or ui.perfetto.dev.")
+
+    parser.add_argument('--profile-memory', action='store_true',
+                        help="Also measures the peak, allocated and retained memory of every stage in --profile/--profile-trace. Tracing the memory " \
+                        "slows down every allocation, so the times are only accurate without this option.")
 
     return parser
 
 
 def validateParams(args):
+    if args.profile_memory and args.profile is None and args.profile_trace is None:
+        raise ValueError("--profile-memory needs --profile or --profile-trace")
+
     if args.edge_color < -2 or args.edge_color > 360:
         raise ValueError("--edge-color must be between -2 and 360")
     
@@ -59,4 +79,122 @@ def validateParams(args):
         raise ValueError("--brightness must be between -255 and 255")
     
     if args.contrast < -1 or args.contrast > 100:
-        raise ValueError("--contrast must be between 0 and 100")
\ No newline at end of file
+        raise ValueError("--contrast must be between 0 and 100")
+    
+    if args.compress_level < 0 or args.compress_level > 9:
+        raise ValueError("--compress-level must be between 0 and 9")
+    
+    if args.image.lower().endswith(".raw") and args.raw_shape is None:
+        raise ValueError("--raw-shape must be specified when reading a .raw image")
+
+    if args.indexed and imageio.isArrayFile(args.output):
+        raise ValueError("--indexed only works with .png and .gif outputs")
+    
+    if args.sigma is not None and args.sigma <= 0:
+        raise ValueError("--sigma must be greater than 0")
+
+    if args.radius < 1:
+        raise ValueError("--radius must be at least 1")
+
+    if args.sigma_range <= 0:
+        raise ValueError("--sigma-range must be greater than 0")
+
+    if args.sharpen is not None and args.sharpen <= 0:
+        raise ValueError("--sharpen must be greater than 0")
+
+    if args.sharpen_radius <= 0:
+        raise ValueError("--sharpen-radius must be greater than 0")
+
+    if args.sharpen_threshold < 0 or args.sharpen_threshold > 255:
+        raise ValueError("--sharpen-threshold must be between 0 and 255")
+
+    if not 0 <= args.canny_low <= args.canny_high <= 1:
+        raise ValueError("--canny-low and --canny-high must be between 0 and 1, and --canny-low must not be greater than --canny-high")
+
+    if args.temporal_dither and args.dithering != "ordered":
+        raise ValueError("--temporal-dither only works with --dithering ordered")
+
+    if args.temporal_threshold < 0 or args.temporal_threshold > 255:
+        raise ValueError("--temporal-threshold must be between 0 and 255")
+
+    if imageio.isArrayFile(args.output) and imageio.isAnimation(args.image):
+        raise ValueError("Animations can't be saved as .npy or .raw files")
+
+    if args.target_psnr is not None and args.target_ssim is not None:
+        raise ValueError("Only one of --target-psnr and --target-ssim can be used")
+
+    if args.target_psnr is not None and args.target_psnr <= 0:
+        raise ValueError("--target-psnr must be greater than 0")
+
+    if args.target_ssim is not None and not 0 < args.target_ssim <= 1:
+        raise ValueError("--target-ssim must be between 0 and 1")
+
+    if args.preview < 0:
+        raise ValueError("--preview must not be negative")
+
+    if args.canny_sigma < 0:
+        raise ValueError("--canny-sigma must not be negative")
+
+    if args.morphology is not None:
+        import include.effects.morphology.morphology as morphology
+
+        # Raises a ValueError if the size is not valid
+        morphology.parseElementSize(args.element_size)
+
+    pipeline.validatePipeline(args)
+
+
+def previewArgs(args):
+    """Makes a copy of the arguments for --preview, with every size in pixels shrunk by the same factor as the image,
+    so the preview looks like a smaller version of the full resolution result.
+
+    Args:
+        args: The parsed command line arguments.
+
+    Returns:
+        The arguments that should be used to process the preview.
+    """
+    # Only imported here, so the effects are still only loaded when they are used (see pipeline.py)
+    import include.effects.blur.blur as blur
+    import include.effects.morphology.morphology as morphology
+
+    factor  = 2 ** args.preview
+    preview = copy.copy(args)
+
+    # The sigma of the Gaussian and bilateral blurs
+    if args.blur in blur.defaultSigmas:
+        sigma         = args.sigma if args.sigma is not None else blur.defaultSigmas[args.blur]
+        preview.sigma = sigma / factor
+
+    # The fixed size kernels can't be shrunk, so the preview uses a Gaussian blur that blurs by the same amount instead
+    if args.blur in blur.blurKernels:
+        preview.blur  = "gaussian"
+        preview.sigma = blur.equivalentSigma(args.blur) / factor
+
+    preview.radius         = max(1, round(args.radius / factor))
+    preview.canny_sigma    = args.canny_sigma / factor
+    preview.sharpen_radius = args.sharpen_radius / factor
+
+    elementHeight, elementWidth = morphology.parseElementSize(args.element_size)
+    preview.element_size = f"{max(1, round(elementHeight / factor))}x{max(1, round(elementWidth / factor))}"
+
+    # The Bayer matrices are 2x2, 4x4 and 8x8, so every preview level uses the next smaller one
+    preview.bayer_matrix = max(0, args.bayer_matrix - args.preview)
+
+    return preview
+
+
+def withoutPreview(argv: list) -> list:
+    """Removes the --preview option from a command line, so the same command processes the image in full resolution.
+    """
+    fullResolution = []
+    skipNext       = False
+    for argument in argv:
+        if skipNext:
+            skipNext = False
+        elif argument == "--preview":
+            skipNext = True
+        elif not argument.startswith("--preview="):
+            fullResolution.append(argument)
+
+    return fullResolution
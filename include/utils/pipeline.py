@@ -0,0 +1,486 @@
+"""
+Pipeline.py is the registry of every effect that main.py can apply to an image.
+
+Each effect declares, in a single place:
+    * The command line options that configure it (make_parser() adds them to the parser)
+    * When it is selected, given the parsed command line arguments
+    * Where its implementation is, in the format "module:function", and which arguments it takes
+
+Like the backends in backends.py, the implementations are only imported when the effect actually runs. A run that only
+changes the brightness never loads the dithering, the edge detectors, the blurs or any of the compiled extensions, which
+keeps the start up time down when processing lots of small images from a script.
+
+By default the effects run in the order of the registry. --pipeline "contrast,blur,sobel" runs them in any other order.
+"""
+
+import importlib
+
+import numpy as np
+
+
+class Effect:
+    def __init__(self, name: str, stage: str, path: str, arguments, isSelected, options: list = None, perPixel: bool = False,
+                 acceptsOut: bool = False, outputChannels: int = None):
+        """
+        Args:
+            name (str)          : The name of the effect in --pipeline.
+            stage (str)         : The name of the stage in the profiler report.
+            path (str)          : Where the implementation is, in the format "module:function". It's called as
+                                  function(img, *arguments(args, state)) and must return the processed image.
+            arguments (callable): Turns the parsed command line arguments (and the state shared by the frames of an animation) into
+                                  the arguments of the implementation.
+            isSelected (callable): Returns True if the parsed command line arguments ask for this effect.
+            options (list)      : The command line options of the effect, as (flags, keyword arguments) of parser.add_argument().
+            perPixel (bool)     : If the result of every pixel only depends on the color of that pixel. These effects can be applied
+                                  to the palette of an indexed image instead of to every pixel.
+            acceptsOut (bool)   : If the implementation takes an 'out' keyword argument, where it writes a np.uint8 result with the same
+                                  shape as the image, or with outputChannels channels (see include/utils/buffers.py).
+            outputChannels (int): How many channels the result has, if it isn't the same as the image. The edge detectors and
+                                  the hue mapping always return an RGB image, even from a grayscale one.
+        """
+        self.name       = name
+        self.stage      = stage
+        self.path       = path
+        self.arguments  = arguments
+        self.isSelected = isSelected
+        self.options    = options if options is not None else []
+        self.perPixel   = perPixel
+        self.acceptsOut = acceptsOut
+        self.outputChannels = outputChannels
+
+        self._function = None
+
+
+    def load(self):
+        """Imports the implementation. Only happens the first time the effect runs.
+        """
+        if self._function is None:
+            moduleName, functionName = self.path.split(":")
+            self._function = getattr(importlib.import_module(moduleName), functionName)
+
+        return self._function
+
+
+    def apply(self, img: np.typing.NDArray, args, state: dict, out: np.typing.NDArray = None) -> np.typing.NDArray:
+        """Applies the effect to the image.
+
+        Args:
+            img (np.typing.NDArray): The image. Must be in the format (H, W, C).
+            args                   : The parsed command line arguments.
+            state (dict)           : Whatever can be reused between the frames of an animation.
+            out (np.typing.NDArray): Where to write the result, if the effect accepts it (see acceptsOut). It's ignored otherwise,
+                                     so always use the returned image.
+
+        Returns:
+            np.typing.NDArray: The processed image.
+        """
+        if out is not None and self.acceptsOut:
+            return self.load()(img, *self.arguments(args, state), out=out)
+
+        return self.load()(img, *self.arguments(args, state))
+
+
+def availableColors(args, state: dict) -> np.typing.NDArray:
+    """The colors used to quantize each channel: a uniform division from 0 to 255, with --quantize different colors
+    (or with the number of colors found by --target-psnr/--target-ssim).
+    """
+    nColors = state.get("nColors", args.quantize)
+
+    return np.linspace(0, 255, nColors, dtype=np.uint8)
+
+
+def quantizeImage(img: np.typing.NDArray, args, state: dict, out: np.typing.NDArray = None) -> np.typing.NDArray:
+    """Quantizes the image, with or without dithering, according to the command line arguments.
+
+    With --target-psnr or --target-ssim, the number of colors is the smallest one that meets the target (see searchPaletteSize()).
+    It's saved in state["nColors"], so the caller can report it. Animations only search on the first frame, so every frame uses the same palette.
+
+    Args:
+        img (np.typing.NDArray): The image. Must be in the format (H, W, C)
+        args                   : The parsed command line arguments.
+        state (dict)           : Where the temporal dithering keeps its state between the frames of an animation.
+        out (np.typing.NDArray): Where to write the quantized image. By default, a new array is created.
+
+    Returns:
+        np.typing.NDArray: The quantized image. If it didn't have to be quantized, it's img itself.
+    """
+    if (args.target_psnr is not None or args.target_ssim is not None) and "nColors" not in state:
+        state["nColors"] = searchPaletteSize(img, args)
+
+    # 255 colors means there's no need to quantize the image
+    colors = availableColors(args, state)
+    if len(colors) == 255:
+        return img
+
+    return quantizeWith(img, colors, args, state, out)
+
+
+def quantizeWith(img: np.typing.NDArray, colors: np.typing.NDArray, args, state: dict, out: np.typing.NDArray = None) -> np.typing.NDArray:
+    """Quantizes the image with the colors in colors, with the dithering selected in the command line arguments.
+    """
+    # Quantize the image with dithering
+    if args.dithering == "ordered" and args.temporal_dither:
+        import include.effects.dithering.ordered_dither as ordered_dither
+
+        if "ditherer" not in state:
+            state["ditherer"] = ordered_dither.TemporalOrderedDithering(args.bayer_matrix, colors, args.temporal_threshold, args.linear, args.lab)
+        return state["ditherer"].dither(img, out)
+    elif args.dithering == "ordered":
+        import include.effects.dithering.ordered_dither as ordered_dither
+
+        return ordered_dither.orderedDithering(img, args.bayer_matrix, colors, args.linear, args.lab, out)
+    elif args.dithering == "floyd-steinberg":
+        import include.effects.dithering.error_diffusion as error_diffusion
+
+        return error_diffusion.floydSteinberg(img, colors, args.linear, args.lab, out)
+
+    # Quantize the image without dithering
+    import include.effects.color.quantize as quantize
+
+    return quantize.quantize(img, colors, args.linear, args.lab, out)
+
+
+# How many pixels --target-psnr and --target-ssim use to search for the number of colors
+searchPixels = 2**18
+
+
+def searchPaletteSize(img: np.typing.NDArray, args) -> int:
+    """Finds the smallest number of colors that still meets the --target-psnr or --target-ssim quality target.
+
+    The quality goes up with the number of colors, so this is a binary search between 2 and 255 colors. To keep it cheap, the search
+    runs on a copy of the image that is shrunk to around searchPixels pixels.
+
+    Args:
+        img (np.typing.NDArray): The image, right before quantization. Must be in the format (H, W, C)
+        args                   : The parsed command line arguments.
+
+    Returns:
+        int: The number of colors. 255 means the target can't be met with less than 255 colors, so the image shouldn't be quantized.
+    """
+    import include.utils.metrics as metrics
+    import include.utils.resample as resample
+
+    factor = int(np.ceil(np.sqrt(img.shape[0] * img.shape[1] / searchPixels)))
+    sample = resample.downscale(img, factor) if factor > 1 else np.asarray(img)
+
+    if args.target_ssim is not None:
+        # The SSIM windows must fit in the sample, so tiny images use smaller windows
+        windowSize     = min(7, sample.shape[0], sample.shape[1])
+        metric, target = lambda original, processed: metrics.ssim(original, processed, windowSize), args.target_ssim
+    else:
+        metric, target = metrics.psnr, args.target_psnr
+
+    def meetsTarget(nColors):
+        colors = np.linspace(0, 255, nColors, dtype=np.uint8)
+        # Each attempt gets its own state, so the temporal dithering of an animation doesn't see the attempts
+        return metric(sample, quantizeWith(sample, colors, args, {})) >= target
+
+    # The smallest number of colors that meets the target is in [low, high]
+    low, high = 2, 255
+    while low < high:
+        middle = (low + high) // 2
+        if meetsTarget(middle):
+            high = middle
+        else:
+            low = middle + 1
+
+    return low
+
+
+def changeHue(img: np.typing.NDArray, args, state: dict, out: np.typing.NDArray = None) -> np.typing.NDArray:
+    """Changes the color palette of the image according to the --hue, --hue-range and --hue-reversed options.
+
+    Args:
+        img (np.typing.NDArray): The image. Must be in the format (H, W, C)
+        args                   : The parsed command line arguments.
+        state (dict)           : When processing an animation, the color LUT is stored here by the first frame
+                                 and reused by all the other ones. If it has a ScratchArena in "arena", the np.float32
+                                 HSV image is written in one of its buffers.
+        out (np.typing.NDArray): Where to write the result. Must be np.uint8 in the format (H, W, 3). By default, a new array is created.
+
+    Returns:
+        np.typing.NDArray: The RGB image with the new color palette.
+    """
+    import include.effects.color.colormapping as colormapping
+    import include.utils.colormodel as colormodel
+
+    # The colors that were used to quantize the image
+    colors = availableColors(args, state)
+
+    # The HSV image is 4 times bigger than the image itself, so it's the one buffer worth reusing from frame to frame
+    def hsvBuffer(rgbImg):
+        if state.get("arena") is None:
+            return None
+
+        return state["arena"].get("hsv", rgbImg.shape, np.float32)
+
+    # This is kinda crazy, but we have to use separate functions depending if the image is Grayscale or if it is RGB.
+    # That's because if the image is in grayscale, then the available colors are... well... the array availableColors.
+
+    # But if the image is RGB, then the available colors are all the unique combinations in the R, G and B channel.
+    # That's because even though we quantize the image with an arbitrary number of colors, that reduced number of
+    # colors can COMBINE INTO DIFFERENT colors because of the 3 channels. For example, if there's only 3 colors for each channel:
+    # [0, 127, 255], then there's 3 * 3 * 3 different combinations of colors.
+    # This is what ends up giving us a very large number of different Hues, and the reason why
+    # the colors available in the RGB image are the unique values in hsvImg[..., 0] instead of availableColors :)
+    if img.shape[-1] == 1:
+        # Since we just have an rgb2hsv function and not a grayscale2hsv function, we have to repeat the channel dimension 3 times
+        # to make the grayscale image work as an RGB image.
+        img      = np.repeat(img, repeats=3, axis=2)
+        hsvImg   = colormodel.rgb2hsv(img, hsvBuffer(img))
+        if "colorLUT" not in state:
+            state["colorLUT"] = colormapping.generatePalette(args.hue, colors, args.hue_range, args.hue_reversed)
+        hsvImg   = colormapping.changeColorPaletteGrayscale(hsvImg, state["colorLUT"])
+    else:
+        hsvImg   = colormodel.rgb2hsv(img, hsvBuffer(img))
+        if "colorLUT" in state:
+            colorLUT = state["colorLUT"]
+        elif state.get("animated") and len(colors) != 255:
+            # In an animation, each frame has different hues, and a LUT made from the hues of the first frame wouldn't cover the others.
+            # But a quantized frame can only have the colors that combine availableColors in each channel, so we can make a LUT
+            # for all of them and reuse it in every frame. That also makes sure the same color is mapped the same way in every frame.
+            allColors = np.stack(np.meshgrid(colors, colors, colors, indexing="ij"), axis=-1).reshape(1, -1, 3)
+            colorLUT  = colormapping.generatePalette(args.hue, np.unique(colormodel.rgb2hsv(allColors)[..., 0]), args.hue_range, args.hue_reversed)
+            state["colorLUT"] = colorLUT
+        else:
+            colorLUT = colormapping.generatePalette(args.hue, np.unique(hsvImg[..., 0]), args.hue_range, args.hue_reversed)
+        hsvImg   = colormapping.changeColorPaletteRGB(hsvImg, colorLUT)
+
+    img  = colormodel.hsv2rgb(hsvImg, out)
+
+    return img
+
+
+# The options shared by the 3 edge detectors
+edgeDetectionOptions = [
+    (['--edge-detection', '-e'], dict(type=str, choices=["sobel", "prewitt", "canny"], default=None,
+                                      help="Detects edges in the image using one of the available algorithms.")),
+
+    (['--edge-color', '-ec'], dict(type=int, default=-1,
+                                   help="Colors the detected edges with a specific color. -2 = All edges are white, -1 = Assigns a Hue value based on \
+                                       the direction that the edges points to, any other value = colors all edges with that Hue value. Default = -1")),
+]
+
+
+# Every effect, in the order they run by default
+effects = [
+    Effect("contrast", "contrast", "include.effects.color.contrast:contrast_boost",
+           arguments  = lambda args, state: (args.contrast, args.linear),
+           isSelected = lambda args: args.contrast != -1,
+           acceptsOut = True,
+           options    = [
+               (['--contrast', '-c'], dict(type=float, default=-1,
+                                           help="By how much to boost the contrast in the image. Must be between 0 and 100. -c = 2 will take the 2%% lowest and 2%% highest colors" \
+                                           "and equal them to 0 and 255 respectively and then scale the midtones.")),
+           ]),
+
+    Effect("brightness", "brightness", "include.effects.color.brightness:brightness_boost",
+           arguments  = lambda args, state: (args.brightness,),
+           isSelected = lambda args: args.brightness != -256,
+           perPixel   = True,
+           acceptsOut = True,
+           options    = [
+               (['--brightness', '-br'], dict(type=int, default=-256,
+                                              help="Boosts the brightness by the specified value. Must be between -255 and 255.")),
+           ]),
+
+    Effect("sharpen", "sharpen", "include.effects.blur.sharpen:unsharpMask",
+           arguments  = lambda args, state: (args.sharpen, args.sharpen_radius, args.sharpen_threshold, args.linear),
+           isSelected = lambda args: args.sharpen is not None,
+           acceptsOut = True,
+           options    = [
+               (['--sharpen'], dict(type=float, default=None,
+                                    help="Sharpens the image with an unsharp mask. The value is the amount: how much of the fine details (the difference between " \
+                                    "the image and a blurred copy of it) is added back to the image. 1 doubles the contrast of the details. Must be greater than 0.")),
+
+               (['--sharpen-radius'], dict(type=float, default=1.0,
+                                           help="The sigma (in pixels) of the Gaussian blur used by --sharpen. Bigger values sharpen bigger details. Default = 1.0.")),
+
+               (['--sharpen-threshold'], dict(type=float, default=0,
+                                              help="How different (in the [0, 255] range) a pixel must be from its blurred copy to be sharpened by --sharpen. " \
+                                              "Keeps the noise in flat areas from being sharpened. Default = 0.")),
+           ]),
+
+    Effect("quantize", "quantize", "include.utils.pipeline:quantizeImage",
+           arguments  = lambda args, state: (args, state),
+           isSelected = lambda args: args.quantize != 255 or args.target_psnr is not None or args.target_ssim is not None,
+           acceptsOut = True,
+           options    = [
+               (['-q', '--quantize'], dict(type=int, default=255,
+                                           help='Quantizes the image according to an arbitrary number of colors. Does NOT dither the image, so expect major color banding.')),
+
+               (['-d', '--dithering'], dict(choices=["ordered", "floyd-steinberg"], default=None,
+                                            help='Quantizes the image, but this time applying dithering to the image to help minimize color banding. \
+                                                The choices are either ordered dithering or floyd-steinberg dithering.')),
+
+               (['--target-psnr'], dict(type=float, default=None,
+                                        help="Instead of using --quantize, picks the smallest number of colors whose result has at least this PSNR (in dB) " \
+                                        "compared to the image before quantization. Works with every --dithering option.")),
+
+               (['--target-ssim'], dict(type=float, default=None,
+                                        help="Same as --target-psnr, but with the SSIM, which is closer to how different the images look. Must be between 0 and 1.")),
+
+               (['--bayer-matrix'], dict(type=int, choices=[0, 1, 2], default=2,
+                                         help="The threshold map used by ordered dithering. 0 = 2x2, 1 = 4x4, 2 = 8x8. Default = 2.")),
+
+               (['--temporal-dither'], dict(action='store_true', default=False,
+                                            help="For animations with --dithering ordered. Pixels that barely change from one frame to the next keep their previous dithered color, " \
+                                            "which stops the dithering pattern from flickering. See --temporal-threshold.")),
+
+               (['--temporal-threshold'], dict(type=int, default=4,
+                                               help="How much (in the [0, 255] range) a pixel has to change before --temporal-dither dithers it again. Default = 4.")),
+
+               (['--lab'], dict(action='store_true', default=False,
+                                help="Quantizes and dithers by picking the closest color in CIELAB, where the distance between two colors matches how different they look. " \
+                                "In RGB images, every pixel picks the closest combination of colors across the 3 channels instead of quantizing each channel on its own.")),
+           ]),
+
+    Effect("hue", "hue mapping", "include.utils.pipeline:changeHue",
+           arguments  = lambda args, state: (args, state),
+           isSelected = lambda args: args.hue is not None,
+           perPixel   = True,
+           acceptsOut = True,
+           outputChannels = 3,
+           options    = [
+               (['--hue'], dict(type=int, default=None,
+                                help="Specify a hue value (google HSV color wheel) to convert the image to a different color palette. \
+                                    Super recommended to also use the -g option, because converting the color palette of an RGB image \
+                                        tends to give weird results.")),
+
+               (['--hue-range'], dict(type=int, default=0,
+                                      help="By how much the hue in the color palette can vary. Default = 0.")),
+
+               (['--hue-reversed'], dict(action='store_true', default=False,
+                                         help="Reverses the color pallete. Instead of [hue - hue_range, hue + hue_range], it changes to [hue + hue_range, hue - hue_range].")),
+           ]),
+
+    Effect("blur", "blur", "include.effects.blur.blur:blur",
+           arguments  = lambda args, state: (args.blur, args.sigma, args.radius, args.sigma_range, args.linear),
+           isSelected = lambda args: args.blur is not None,
+           acceptsOut = True,
+           options    = [
+               (['--blur', '-b'], dict(type=str, choices=["boxblur3x3", "boxblur5x5", "gaussian3x3", "gaussian5x5", "gaussian", "median", "bilateral"], default=None,
+                                       help="Apply a blur filter in the image. Choose from the available implemented blur kernels. \
+                                           'gaussian' is a Gaussian blur with an arbitrary sigma (see --sigma). 'median' and 'bilateral' are \
+                                               edge-preserving filters that remove noise without smearing the edges.")),
+
+               (['--sigma'], dict(type=float, default=None,
+                                  help="The sigma (in pixels) of --blur gaussian and --blur bilateral. Bigger values blur more. \
+                                      Default = 1.0 for gaussian and 8.0 for bilateral.")),
+
+               (['--radius'], dict(type=int, default=2,
+                                   help="The radius of --blur median. The window is (2 * radius + 1) x (2 * radius + 1) pixels. Default = 2.")),
+
+               (['--sigma-range'], dict(type=float, default=30,
+                                        help="How different (in the [0, 255] range) two pixels can be and still be blurred together by --blur bilateral. Default = 30.")),
+           ]),
+
+    Effect("sobel", "edge detection", "include.effects.edge_detection.sobel:sobel",
+           arguments  = lambda args, state: (args.edge_color,),
+           isSelected = lambda args: args.edge_detection == "sobel",
+           acceptsOut = True,
+           outputChannels = 3,
+           options    = edgeDetectionOptions),
+
+    Effect("prewitt", "edge detection", "include.effects.edge_detection.prewitt:prewitt",
+           arguments  = lambda args, state: (args.edge_color,),
+           isSelected = lambda args: args.edge_detection == "prewitt",
+           acceptsOut = True,
+           outputChannels = 3,
+           options    = edgeDetectionOptions),
+
+    Effect("canny", "edge detection", "include.effects.edge_detection.canny:canny",
+           arguments  = lambda args, state: (args.edge_color, args.canny_low, args.canny_high, args.canny_sigma),
+           isSelected = lambda args: args.edge_detection == "canny",
+           acceptsOut = True,
+           outputChannels = 3,
+           options    = edgeDetectionOptions + [
+               (['--canny-low'], dict(type=float, default=0.1,
+                                      help="The threshold for weak edges in Canny edge detection, as a fraction of the strongest edge. Default = 0.1.")),
+
+               (['--canny-high'], dict(type=float, default=0.2,
+                                       help="The threshold for strong edges in Canny edge detection, as a fraction of the strongest edge. Default = 0.2.")),
+
+               (['--canny-sigma'], dict(type=float, default=1.4,
+                                        help="The sigma of the Gaussian blur that Canny edge detection uses to remove noise. 0 disables it. Default = 1.4.")),
+           ]),
+
+    Effect("morphology", "morphology", "include.effects.morphology.morphology:morphology",
+           arguments  = lambda args, state: (args.morphology, args.element_size),
+           isSelected = lambda args: args.morphology is not None,
+           acceptsOut = True,
+           options    = [
+               (['--morphology', '-m'], dict(type=str, choices=["erode", "dilate", "open", "close", "gradient"], default=None,
+                                             help="Applies a morphological operator after edge detection. 'open' removes small specks, 'close' fills small holes \
+                                                 and reconnects broken edges, and 'gradient' outlines the shapes. Also works without edge detection, for example on dithered images.")),
+
+               (['--element-size'], dict(type=str, default="3x3",
+                                         help="The size of the rectangular structuring element used by --morphology, in the format HxW (or N for an N x N square). Default = 3x3.")),
+           ]),
+]
+
+effectsByName = {effect.name: effect for effect in effects}
+
+
+def addOptions(parser):
+    """Adds the command line options of every effect to the parser. Options shared by more than one effect are only added once.
+    """
+    added = set()
+    for effect in effects:
+        for flags, keywordArguments in effect.options:
+            if flags[0] in added:
+                continue
+
+            parser.add_argument(*flags, **keywordArguments)
+            added.add(flags[0])
+
+
+def selectedEffects(args) -> list:
+    """The effects that the command line arguments ask for, in the order they should run.
+
+    Args:
+        args: The parsed command line arguments.
+
+    Returns:
+        list: The Effect objects. Without --pipeline, they are in the order of the registry.
+    """
+    if args.pipeline is None:
+        return [effect for effect in effects if effect.isSelected(args)]
+
+    return [effectsByName[name] for name in parsePipeline(args.pipeline)]
+
+
+def parsePipeline(pipeline: str) -> list:
+    """Splits the --pipeline option into the names of the effects. Raises a ValueError if any of them doesn't exist.
+    """
+    names = [name.strip() for name in pipeline.split(",") if name.strip() != ""]
+
+    for name in names:
+        if name not in effectsByName:
+            raise ValueError(f"Unknown effect '{name}' in --pipeline. Choose from: {', '.join(effectsByName.keys())}")
+
+    return names
+
+
+def validatePipeline(args):
+    """Checks that --pipeline lists exactly the effects that were selected with the other options, each of them once,
+    so no effect is silently skipped or repeated.
+    """
+    if args.pipeline is None:
+        return
+
+    names = parsePipeline(args.pipeline)
+
+    if len(names) == 0:
+        raise ValueError("--pipeline must have at least one effect")
+
+    # Every effect has a single set of options, so running it twice would just repeat the same thing
+    repeated = sorted({name for name in names if names.count(name) > 1})
+    if len(repeated) > 0:
+        raise ValueError(f"Each effect can only be in --pipeline once. Repeated: {', '.join(repeated)}")
+
+    for effect in effects:
+        if effect.isSelected(args) and effect.name not in names:
+            raise ValueError(f"The options of '{effect.name}' were used, but it's not in --pipeline")
+        if not effect.isSelected(args) and effect.name in names:
+            raise ValueError(f"'{effect.name}' is in --pipeline, but none of its options were used")
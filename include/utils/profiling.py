@@ -0,0 +1,191 @@
+"""
+Profiling.py measures how long each stage of the pipeline takes and how much memory it uses.
+
+For every stage it records:
+    * The wall time (how long we actually waited)
+    * The CPU time (how long the CPU spent working on it, across all threads of the process)
+
+And, if the memory is traced:
+    * The peak traced memory (the highest amount of memory that was allocated at the same time during the stage,
+      on top of what was already allocated when it started)
+    * The allocated memory (how much memory the stage allocated that is still in use when it ends, even if it freed as much
+      memory that was allocated before it. A buffer that is allocated and freed inside the stage only shows up in the peak)
+    * The retained memory (how much more memory is in use when the stage ends than when it started, that is, the allocated
+      memory minus what the stage freed)
+
+Memory is measured with tracemalloc (https://docs.python.org/3/library/tracemalloc.html). Numpy reports its array
+allocations to tracemalloc, so this covers the image buffers, which are by far the biggest allocations in this code.
+But tracemalloc slows down every allocation, so the times of a stage are only accurate when the memory is NOT traced.
+To get both, run the code twice: once for the times and once for the memory.
+"""
+
+import contextlib
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+
+# The peak memory of the stages that are still running, innermost last. tracemalloc only has a single peak, which every
+# stage resets when it starts, so each stage keeps here the highest peak it saw before its nested stages reset it.
+_openStagePeaks = []
+
+# The allocations made by the profiler itself (the snapshots and the records) aren't part of any stage
+_ownAllocations = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+
+# Hooks that are called for every stage measured by any Profiler. This is how external code (monitoring, logging, etc)
+# can get the measurements without having to touch the pipeline.
+globalHooks = []
+
+
+def addHook(hook):
+    """Registers a function that will be called with the record of every profiled stage.
+
+    Args:
+        hook (callable): A function that receives a single dict with the stage measurements.
+    """
+    globalHooks.append(hook)
+
+
+def removeHook(hook):
+    """Unregisters a hook that was added with addHook().
+    """
+    globalHooks.remove(hook)
+
+
+class Profiler:
+    def __init__(self, enabled: bool = True, hooks: list = None, traceMemory: bool = False):
+        """
+        Args:
+            enabled (bool)    : If False, stage() does nothing. This way the pipeline can always call it without any overhead.
+            hooks (list)      : Functions that will be called with the record of every stage measured by this profiler.
+            traceMemory (bool): Also measures the memory of every stage with tracemalloc. This makes the times of the stages longer.
+        """
+        self.enabled     = enabled
+        self.hooks       = list(hooks) if hooks is not None else []
+        self.traceMemory = traceMemory
+        self.records     = []
+
+        # Used as the zero for the timestamps in the Chrome trace
+        self.startTime = time.perf_counter()
+
+
+    def stage(self, name: str):
+        """Measures a stage of the pipeline. Use it as a context manager:
+
+            with profiler.stage("blur"):
+                img = blur.blur(img, "gaussian3x3")
+
+        Args:
+            name (str): The name of the stage.
+        """
+        if not self.enabled:
+            return contextlib.nullcontext()
+
+        return self._measure(name)
+
+
+    @contextlib.contextmanager
+    def _measure(self, name: str):
+        startedTracing = False
+        if self.traceMemory:
+            # Only start tracing memory if nobody else is already doing it
+            startedTracing = not tracemalloc.is_tracing()
+            if startedTracing:
+                tracemalloc.start()
+
+            # Taken before memoryBefore, so the snapshot itself is part of what was already in use when the stage started
+            snapshotBefore = tracemalloc.take_snapshot().filter_traces(_ownAllocations)
+
+            # Resetting the peak would lose the peak of the stage this one is nested in, so that stage keeps it
+            memoryBefore, outerPeak = tracemalloc.get_traced_memory()
+            if len(_openStagePeaks) > 0:
+                _openStagePeaks[-1] = max(_openStagePeaks[-1], outerPeak)
+
+            tracemalloc.reset_peak()
+            _openStagePeaks.append(memoryBefore)
+
+        wallStart = time.perf_counter()
+        cpuStart  = time.process_time()
+
+        try:
+            yield
+        finally:
+            cpuEnd  = time.process_time()
+            wallEnd = time.perf_counter()
+
+            record = {
+                "stage"   : name,
+                "start"   : wallStart - self.startTime,
+                "wallTime": wallEnd - wallStart,
+                "cpuTime" : cpuEnd - cpuStart,
+            }
+
+            if self.traceMemory:
+                memoryAfter, memoryPeak = tracemalloc.get_traced_memory()
+                memoryPeak = max(memoryPeak, _openStagePeaks.pop())
+
+                # The stage this one is nested in also reached this peak
+                if len(_openStagePeaks) > 0:
+                    _openStagePeaks[-1] = max(_openStagePeaks[-1], memoryPeak)
+
+                # Every line of code that has more memory allocated by it than when the stage started allocated (at least) that much
+                # during the stage. The lines that have less freed memory, which is only subtracted from the retained memory.
+                snapshotAfter = tracemalloc.take_snapshot().filter_traces(_ownAllocations)
+                differences   = snapshotAfter.compare_to(snapshotBefore, "lineno")
+
+                if startedTracing:
+                    tracemalloc.stop()
+
+                record["peakMemory"]      = memoryPeak - memoryBefore
+                record["allocatedMemory"] = sum(max(difference.size_diff, 0) for difference in differences)
+                record["retainedMemory"]  = memoryAfter - memoryBefore
+
+            self.records.append(record)
+
+            for hook in self.hooks + globalHooks:
+                hook(record)
+
+
+    def report(self) -> dict:
+        """Returns all the measurements in a dict, plus the totals for the whole pipeline.
+        """
+        report = {
+            "stages"        : self.records,
+            "totalWallTime" : sum(record["wallTime"] for record in self.records),
+            "totalCpuTime"  : sum(record["cpuTime"]  for record in self.records),
+        }
+
+        if self.traceMemory:
+            report["peakMemory"] = max((record["peakMemory"] for record in self.records), default=0)
+
+        return report
+
+
+    def saveReport(self, path: str):
+        """Saves the report as a JSON file.
+        """
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=4)
+
+
+    def saveChromeTrace(self, path: str):
+        """Saves the measurements in the Chrome Trace Event format, which can be opened
+        in chrome://tracing or in https://ui.perfetto.dev to see the stages in a timeline.
+        """
+        events = []
+        for record in self.records:
+            events.append({
+                "name": record["stage"],
+                "ph"  : "X",
+                # The timestamps in the trace are in microseconds
+                "ts"  : record["start"]    * 1e6,
+                "dur" : record["wallTime"] * 1e6,
+                "pid" : os.getpid(),
+                "tid" : threading.get_ident(),
+                "args": {key: record[key] for key in ["cpuTime", "peakMemory", "allocatedMemory", "retainedMemory"] if key in record}
+            })
+
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
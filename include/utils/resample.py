@@ -0,0 +1,48 @@
+"""
+Resample.py shrinks images. It's what the --preview mode uses to run the whole pipeline on a small proxy of a huge image.
+"""
+
+import numpy as np
+
+
+def downscale(img: np.typing.NDArray, factor: int) -> np.typing.NDArray:
+    """
+    Shrinks the image by an integer factor with area averaging: every factor x factor block of pixels becomes one pixel with
+    their average color. Instead of looping over the blocks, the image is reshaped to (H / factor, factor, W / factor, factor, C),
+    so each block gets its own 2 axes. Then, for every position inside the block, the whole (H / factor, W / factor, C) slice is added
+    to a running total. That is a single pass over the image, and it's a lot faster than blocks.sum(axis=(1, 3)), which walks through
+    the image in a very cache-unfriendly order. The total is an integer, so the average is exact.
+
+    If the size of the image is not a multiple of factor, the last few rows/columns are dropped.
+
+    Args:
+        img (np.typing.NDArray): The np.uint8 image. Must be in the format (H, W) or (H, W, C).
+        factor (int)           : By how much to shrink the image.
+
+    Returns:
+        np.typing.NDArray (np.uint8): The smaller image.
+    """
+    if factor == 1:
+        return np.asarray(img)
+
+    H = img.shape[0] // factor
+    W = img.shape[1] // factor
+
+    if H == 0 or W == 0:
+        raise ValueError(f"The image is too small to be shrunk by a factor of {factor}")
+
+    blocks = img[: H * factor, : W * factor].reshape((H, factor, W, factor) + img.shape[2:])
+
+    # np.uint16 is enough for blocks of up to 256 pixels
+    nPixels = factor * factor
+    total   = np.zeros((H, W) + img.shape[2:], dtype=np.uint16 if nPixels <= 256 else np.uint32)
+    for row in range(factor):
+        for column in range(factor):
+            total += blocks[:, row, :, column]
+
+    # Round to the nearest integer instead of truncating
+    total += nPixels // 2
+    total //= nPixels
+
+    return total.astype(np.uint8)
+
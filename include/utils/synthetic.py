@@ -0,0 +1,34 @@
+"""
+Synthetic.py creates artificial images, which are used by the benchmarks and to check that every backend gives the same results.
+"""
+
+import numpy as np
+
+
+def makeImage(megapixels: float, nChannels: int, seed: int = 0) -> np.typing.NDArray:
+    """Creates a synthetic square image with smooth gradients plus some noise, so the effects behave
+    more or less like they would on a real photo (lots of different colors, but also large smooth areas).
+
+    Args:
+        megapixels (float): The size of the image, in millions of pixels.
+        nChannels (int)   : 1 for a grayscale image, 3 for an RGB image.
+        seed (int)        : The seed for the noise.
+
+    Returns:
+        np.typing.NDArray: The (H, W, nChannels) np.uint8 image.
+    """
+    side = int(np.sqrt(megapixels * 1e6))
+    rng  = np.random.default_rng(seed)
+
+    y = np.linspace(0, 1, side, dtype=np.float32).reshape(-1, 1)
+    x = np.linspace(0, 1, side, dtype=np.float32).reshape(1, -1)
+
+    img = np.empty((side, side, nChannels), dtype=np.uint8)
+    for channel in range(nChannels):
+        # Each channel gets a slightly different gradient so RGB images have actual colors in them
+        gradient = (np.sin(x * (12 + channel * 3)) * np.cos(y * (9 - channel * 2)) * 0.5 + 0.5) * 255
+        noise    = rng.integers(-20, 21, size=(side, side), dtype=np.int16)
+
+        img[..., channel] = np.clip(gradient + noise, 0, 255).astype(np.uint8)
+
+    return img
@@ -1,108 +1,200 @@
 import numpy as np
-import PIL.Image
-
-import include.effects.dithering.floyd_steinberg as floyd_steinberg
-import include.effects.dithering.ordered_dither as ordered_dither
-import include.effects.color.colormapping as colormapping
-import include.effects.edge_detection.prewitt as prewitt
-import include.effects.edge_detection.sobel as sobel
-import include.effects.color.brightness as brightness
-import include.effects.color.contrast as contrast
-import include.effects.color.quantize as quantize
-import include.effects.blur.blur as blur
-
-import include.utils.colormodel as colormodel
+import shlex
+import sys
+import warnings
+
+# The effects themselves are only imported when they are used. See include/utils/pipeline.py
+import include.utils.buffers as buffers
+import include.utils.imageio as imageio
 import include.utils.parser as parser
+import include.utils.pipeline as pipeline
+import include.utils.profiling as profiling
+import include.utils.resample as resample
+
+
+def main(args, profiler: profiling.Profiler = None):
+    """Runs the whole pipeline on args.image and saves the result in args.output.
 
+    Args:
+        args                          : The parsed command line arguments.
+        profiler (profiling.Profiler) : If given, every stage of the pipeline is measured with it.
+    """
+    if profiler is None:
+        profiler = profiling.Profiler(enabled=False)
 
-def main(args):
+    if imageio.isAnimation(args.image):
+        mainAnimation(args, profiler)
+        return
 
     # Open the image
-    img = PIL.Image.open(args.image)
-    img = np.asarray(img, dtype=np.uint8)
+    with profiler.stage("decode"):
+        img = imageio.loadImage(args.image, args.raw_shape)
 
-    # Convert to grayscale if so desired. The change back to RGB is to add a 3-channel dimension to the image.
-    # This simplifies the integration with the rest of the code.
-    if args.grayscale:
-        img = colormodel.rgb2grayscale(img)
-    
-    # Creates a uniformily spaced color distribution. It's a uniform division from 0 to 255, with args.quantize different colors.
-    availableColors = np.linspace(0, 255, args.quantize, dtype=np.uint8)
+    frameCache = {}
+    img, paletteIdx, palette = process(img, args, profiler, frameCache)
+    reportPaletteSize(frameCache)
 
-    if args.contrast != -1:
-        img = contrast.contrast_boost(img, args.contrast)
+    # Save the image
+    with profiler.stage("encode"):
+        save(img, paletteIdx, palette, args)
 
-    if args.brightness != -256:
-        img = brightness.brightness_boost(img, args.brightness)
 
-    # If the user wants to quantize the image. args.quantize contains the number of colors available. If args.quantize is 255 (the default value),
-    # then there's no need to apply quantization.
-    if args.quantize != 255:
-        # Quantize the image with dithering
-        if args.dithering is not None:
-            if args.dithering == "ordered":
-                img = ordered_dither.orderedDithering(img, 2, availableColors)
-            elif args.dithering == "floyd-steinberg":
-                img = floyd_steinberg.floydSteinberg(img, availableColors)
+def mainAnimation(args, profiler: profiling.Profiler):
+    """Same as main(), but for animations and frame sequences. The frames go through the pipeline one at a time, so only
+    one of them is in memory at any moment (besides the encoded frames of a GIF/APNG, which PIL needs all at once).
 
-        # Quantize the image without dithering
-        if args.dithering is None:
-            img = quantize.quantize(img, availableColors)
+    Args:
+        args                          : The parsed command line arguments.
+        profiler (profiling.Profiler) : Every stage of the pipeline is measured with it, once per frame.
+    """
+    # The color LUT, the ordered dithering state and anything else that can be reused from one frame to the next
+    frameCache = {"animated": True}
+
+    # Every frame has the same size, so the effects keep writing into the same buffers instead of allocating new ones for every frame
+    arena = buffers.ScratchArena()
+
+    writer = imageio.AnimationWriter(args.output, args.indexed, args.compress_level, args.optimize)
+    frames = imageio.iterFrames(args.image)
+
+    while True:
+        with profiler.stage("decode"):
+            frame = next(frames, None)
+
+        if frame is None:
+            break
+
+        img, duration = frame
+        img, paletteIdx, palette = process(img, args, profiler, frameCache, arena)
+
+        with profiler.stage("encode"):
+            writer.addFrame(img, duration, paletteIdx, palette)
+
+    with profiler.stage("encode"):
+        writer.close()
+
+    reportPaletteSize(frameCache)
+
+
+def reportPaletteSize(frameCache: dict):
+    """Tells the user how many colors --target-psnr/--target-ssim picked, if they were used.
+    """
+    if "nColors" in frameCache:
+        print(f"Using {frameCache['nColors']} colors")
 
-    
-    # Change the color palette acording to a user-specified hue
-    if args.hue is not None:
-        # This is kinda crazy, but we have to use separate functions depending if the image is Grayscale or if it is RGB.
-        # That's because if the image is in grayscale, then the available colors are... well... the array availableColors.
-
-        # But if the image is RGB, then the available colors are all the unique combinations in the R, G and B channel.
-        # That's because even though we quantize the image with an arbitrary number of colors, that reduced number of
-        # colors can COMBINE INTO DIFFERENT colors because of the 3 channels. For example, if there's only 3 colors for each channel:
-        # [0, 127, 255], then there's 3 * 3 * 3 different combinations of colors.
-        # This is what ends up giving us a very large number of different Hues, and the reason why
-        # the colors available in the RGB image are the unique values in hsvImg[..., 0] instead of availableColors :)
-        if args.grayscale:
-            # Since we just have an rgb2hsv function and not a grayscale2hsv function, we have to repeat the channel dimension 3 times
-            # to make the grayscale image work as an RGB image.
-            img      = np.repeat(img, repeats=3, axis=2)
-            hsvImg   = colormodel.rgb2hsv(img)
-            colorLUT = colormapping.generatePalette(args.hue, availableColors, args.hue_range, args.hue_reversed)
-            hsvImg   = colormapping.changeColorPaletteGrayscale(hsvImg, colorLUT)
-        else:
-            hsvImg   = colormodel.rgb2hsv(img)
-            colorLUT = colormapping.generatePalette(args.hue, np.unique(hsvImg[..., 0]), args.hue_range, args.hue_reversed)
-            hsvImg   = colormapping.changeColorPaletteRGB(hsvImg, colorLUT)
-            
-
-        img  = colormodel.hsv2rgb(hsvImg)
-
-
-    if args.blur is not None:
-        # Perform image blur
-        img = blur.blur(img, args.blur)
-
-
-    if args.edge_detection is not None:
-        # Perform sobel edge detection
-        if args.edge_detection == "sobel":
-            img = sobel.sobel(img, args.edge_color)
-        # Perform prewitt edge detection
-        if args.edge_detection == "prewitt":
-            img = prewitt.prewitt(img, args.edge_color)
 
+def process(img: np.typing.NDArray, args, profiler: profiling.Profiler, frameCache: dict = None, arena: buffers.ScratchArena = None):
+    """Applies every effect that was asked for in the command line to the image.
+
+    Args:
+        img (np.typing.NDArray)       : The image. Must be np.uint8 in the format (H, W, C).
+        args                          : The parsed command line arguments.
+        profiler (profiling.Profiler) : Every stage of the pipeline is measured with it.
+        frameCache (dict)             : When processing an animation, whatever can be reused between frames is stored here.
+        arena (buffers.ScratchArena)  : Where the effects get the buffers they write their results in. When processing an animation,
+                                        the same arena is used for every frame. By default, a new one is created.
+
+    Returns:
+        tuple: (img, paletteIdx, palette). img is the processed image. If it's going to be saved as an indexed image and its
+        palette indices are already known, paletteIdx and palette have them. Otherwise, they are None.
+    """
+    if frameCache is None:
+        frameCache = {}
+
+    if arena is None:
+        arena = buffers.ScratchArena()
+    frameCache["arena"] = arena
+
+    # In preview mode, everything runs on a smaller version of the image
+    if args.preview > 0:
+        with profiler.stage("preview"):
+            img = resample.downscale(img, 2 ** args.preview)
+
+    # Convert to grayscale if so desired. The change back to RGB is to add a 3-channel dimension to the image.
+    # This simplifies the integration with the rest of the code.
+    if args.grayscale:
+        import include.utils.colormodel as colormodel
+
+        with profiler.stage("grayscale"):
+            img = colormodel.rgb2grayscale(img)
+    
+    effects = pipeline.selectedEffects(args)
+
+    # If the output is going to be an indexed image, keep track of the palette index of each pixel right after the image is quantized.
+    # If every effect after that point works pixel by pixel (hue, brightness), the indices never change, and those effects only have
+    # to touch the palette. Spatial effects (blur, edge detection, ...) change the indices, so then they are found when saving instead.
+    names         = [effect.name for effect in effects]
+    lastQuantize  = len(names) - 1 - names[::-1].index("quantize") if "quantize" in names else None
+    trackPalette  = args.indexed and lastQuantize is not None and all(effect.perPixel for effect in effects[lastQuantize + 1 :])
+
+    paletteIdx, palette = None, None
+    for position, effect in enumerate(effects):
+        with profiler.stage(effect.stage):
+            if palette is not None:
+                # The effect is done pixel by pixel, so applying it to the palette is the same as applying it to the whole image.
+                # The palette is treated as a (1, nColors, C) image.
+                palette = effect.apply(np.expand_dims(palette, axis=0), args, frameCache)[0]
+            else:
+                # The effects that can write into a buffer take turns between the two output buffers of the arena. The last
+                # effect creates a new array, since the buffers are overwritten by the next image.
+                out = arena.outputFor(img, effect.outputChannels) if effect.acceptsOut and position < len(effects) - 1 else None
+                img = effect.apply(img, args, frameCache, out)
+
+        # 255 colors means the image wasn't quantized (--target-psnr/--target-ssim needed all the colors)
+        availableColors = pipeline.availableColors(args, frameCache)
+        if trackPalette and position == lastQuantize and len(availableColors) != 255:
+            import include.effects.color.quantize as quantize
+
+            with profiler.stage("palette indices"):
+                paletteIdx, palette = quantize.paletteIndices(img, availableColors)
+
+    # The image can still be in the arena if the last effects only changed the palette
+    if arena.owns(img):
+        img = img.copy()
 
     if img.shape[-1] == 1:
         # Remove the fake channel dimension
         img = img.squeeze(axis=2)
 
+    return img, paletteIdx, palette
 
-    # Save the image
-    img = PIL.Image.fromarray(img)
-    img.save("./processed.png")
 
+def save(img: np.typing.NDArray, paletteIdx: np.typing.NDArray, palette: np.typing.NDArray, args):
+    """Saves the processed image in args.output, as an indexed image if possible and if --indexed was used.
+    """
+    if imageio.isArrayFile(args.output):
+        imageio.saveArray(img, args.output)
+        return
+
+    if args.indexed:
+        if paletteIdx is None:
+            paletteIdx, palette = imageio.toIndexed(img)
+
+        if paletteIdx is not None:
+            imageio.saveIndexed(paletteIdx, palette, args.output, args.compress_level, args.optimize)
+            return
+
+        warnings.warn("The image has more than 256 colors and cannot be saved as an indexed image! Saving it as a regular image instead...")
+
+    imageio.saveImage(img, args.output, args.compress_level, args.optimize)
 
 if __name__ == '__main__':
     args = parser.make_parser().parse_args()
     parser.validateParams(args)
 
-    main(args)
\ No newline at end of file
+    profiler = profiling.Profiler(enabled=args.profile is not None or args.profile_trace is not None, traceMemory=args.profile_memory)
+
+    if args.preview > 0:
+        # Run on the small image, with every size scaled down to match. args itself is left untouched,
+        # so the full resolution run below uses exactly the same parameters.
+        main(parser.previewArgs(args), profiler)
+
+        print(f"Saved a preview in {args.output}. To process the image in full resolution, run:")
+        print(f"python3 {shlex.join(parser.withoutPreview(sys.argv))}")
+    else:
+        main(args, profiler)
+
+    if args.profile is not None:
+        profiler.saveReport(args.profile)
+
+    if args.profile_trace is not None:
+        profiler.saveChromeTrace(args.profile_trace)
\ No newline at end of file
@@ -1,12 +1,58 @@
+import sys
+
 from setuptools import setup, Extension
 from Cython.Build import cythonize
 import numpy as np
 
+# OpenMP is what makes the prange() loops actually run in parallel. MSVC and Apple's clang need different flags
+# (or don't ship OpenMP at all), so it's only enabled with GCC on Linux.
+openmpArgs = ["-fopenmp"] if sys.platform.startswith("linux") else []
+
 extensions = [
     Extension(
         "include.effects.dithering.floyd_steinberg",
         ["include/effects/dithering/floyd_steinberg.pyx"],
         include_dirs=[np.get_include()]
+    ),
+    Extension(
+        "include.effects.blur.recursive_gaussian",
+        ["include/effects/blur/recursive_gaussian.pyx"],
+        include_dirs=[np.get_include()],
+        extra_compile_args=openmpArgs,
+        extra_link_args=openmpArgs
+    ),
+    Extension(
+        "include.effects.edge_detection.hysteresis",
+        ["include/effects/edge_detection/hysteresis.pyx"],
+        include_dirs=[np.get_include()]
+    ),
+    Extension(
+        "include.effects.edge_detection.suppression",
+        ["include/effects/edge_detection/suppression.pyx"],
+        include_dirs=[np.get_include()],
+        extra_compile_args=openmpArgs,
+        extra_link_args=openmpArgs
+    ),
+    Extension(
+        "include.effects.edge_detection.edge_colors",
+        ["include/effects/edge_detection/edge_colors.pyx"],
+        include_dirs=[np.get_include()],
+        extra_compile_args=openmpArgs,
+        extra_link_args=openmpArgs
+    ),
+    Extension(
+        "include.effects.blur.median",
+        ["include/effects/blur/median.pyx"],
+        include_dirs=[np.get_include()],
+        extra_compile_args=openmpArgs,
+        extra_link_args=openmpArgs
+    ),
+    Extension(
+        "include.utils.lab",
+        ["include/utils/lab.pyx"],
+        include_dirs=[np.get_include()],
+        extra_compile_args=openmpArgs,
+        extra_link_args=openmpArgs
     )
 ]
 